@@ -19,7 +19,8 @@ AI病历分析系统 - 统一日志模块 (aifz_logger.py)
 - 配置驱动的日志级别管理
 - UTF-8编码确保中文日志正常显示
 - 防止重复添加处理器的机制
-- 线程安全的API统计计数器
+- 基于QueueHandler/QueueListener的异步日志输出
+- 无锁的API统计计数器（每个线程累加自己的计数，写入统计文件时求和）
 
 文件命名规则：
 logs/YYYY-MM-DD_模块名.log
@@ -29,21 +30,65 @@ logs/YYYY-MM-DD_analysis.log (API统计)
 """
 
 import logging
+import logging.handlers
 import os
-from datetime import datetime
+import re
+from datetime import datetime, timedelta
+import time
 import configparser
 import sys
 import threading
-from collections import defaultdict
+import queue
+import atexit
 
 # 全局变量
 CONFIG = None
 LOG_DIR = "logs"  # 日志文件存放目录
+_LOGDIR_READY = False  # 日志目录是否已创建，避免每次写统计文件都执行makedirs
+_QUEUE_LISTENER = None  # 后台日志监听器，负责格式化和实际的文件/控制台输出
 
 # API调用统计相关全局变量
+# API_STATS 按日期保存 {'success': _ApiCounter, 'fail': _ApiCounter}，为当天的累计值
+# 每个线程只累加自己的计数槽，热路径上不获取任何锁（线程首次计数时登记计数槽除外）；
+# API_STATS_LOCK 只在首次创建某日期的计数器以及写入统计文件时使用
 API_STATS_LOCK = threading.Lock()
-API_STATS = defaultdict(lambda: {'success': 0, 'fail': 0})  # 按日期统计
-LAST_STATS_DATE = None
+API_STATS = {}
+_API_STATS_WRITTEN = {}  # 日期 -> 上次写入文件时的 (成功, 失败)，未变化时跳过写入
+DEFAULT_STATS_FLUSH_INTERVAL = 30  # 统计文件后台定时写入间隔（秒），可通过 [system] stats_flush_interval 配置
+_STATS_FLUSH_STOP = threading.Event()
+_STATS_FLUSH_THREAD = None
+
+# 解析已有统计文件（仅在某日期的计数器首次创建时执行一次）
+API_STATS_FILE_RE = re.compile(r'成功: (\d+).*?失败: (\d+)', re.S)
+# 统计文件固定的标题前缀，预先编码，每次写入只编码变化的部分
+API_STATS_HEADER = "=== API调用统计 - ".encode('utf-8')
+
+# 当天日期字符串缓存：(YYYY-MM-DD, 次日零点的时间戳)
+# 整体作为一个元组赋值，多线程读写时不会读到不一致的中间状态
+_DATE_CACHE = (None, 0.0)
+
+def _today_str():
+    """
+    返回当天日期字符串（YYYY-MM-DD）
+
+    格式固定，只在跨过本地零点时重新strftime，其余调用只需一次浮点比较。
+    注意按本地时间而非 time.time()//86400 计算日界，后者在东八区会在早上8点切换日期。
+    """
+    global _DATE_CACHE
+    date_str, expires_at = _DATE_CACHE
+    if time.time() >= expires_at:
+        now = datetime.now()
+        next_midnight = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        date_str = now.strftime('%Y-%m-%d')
+        _DATE_CACHE = (date_str, next_midnight.timestamp())
+    return date_str
+
+def _ensure_log_dir():
+    """确保日志目录存在（只在首次调用时执行makedirs）"""
+    global _LOGDIR_READY
+    if not _LOGDIR_READY:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        _LOGDIR_READY = True
 
 def _load_config():
     """
@@ -71,6 +116,23 @@ def _load_config():
             sys.exit(1)
     return CONFIG
 
+class _BufferedStreamHandler(logging.StreamHandler):
+    """
+    写入缓冲流、但不在每条记录后flush的流处理器
+
+    标准StreamHandler每条记录都会调用flush()，高频日志下退化为逐条write()系统调用；
+    这里只把格式化后的文本写入BufferedWriter，由外层处理器按时间周期统一flush。
+    """
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            self.stream.write(msg + self.terminator)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
 class DailyRotatingFileHandler(logging.Handler):
     """
     按日期自动轮换的文件日志处理器
@@ -80,11 +142,15 @@ class DailyRotatingFileHandler(logging.Handler):
     2. 文件名包含日期信息，便于归档管理
     3. 支持UTF-8编码，确保中文日志正常显示
     4. 自动创建日志目录
+    5. 64KB写缓冲，后台线程每秒flush一次；ERROR及以上级别立即flush
     
     文件格式：logs/YYYY-MM-DD_模块名.log
     例如：logs/2025-01-15_main.log
     """
     
+    BUFFER_SIZE = 64 * 1024  # 文件写缓冲大小（字节）
+    FLUSH_INTERVAL = 1.0  # 后台flush间隔（秒）
+    
     def __init__(self, log_dir, log_name):
         """
         初始化日志处理器
@@ -98,12 +164,21 @@ class DailyRotatingFileHandler(logging.Handler):
         self.log_name = log_name
         
         # 确保日志目录存在
-        if not os.path.exists(self.log_dir):
-            os.makedirs(self.log_dir)
+        os.makedirs(self.log_dir, exist_ok=True)
+        # 日志文件路径模板，日期切换时只需format一次
+        self._log_filename_template = os.path.join(self.log_dir, "{}_" + self.log_name + ".log")
             
         self.current_date = None
         self.file_handler = None
+        self._next_rollover_ts = 0.0  # 下一次需要切换文件的时间戳（本地次日零点）
         self._update_handler()
+        
+        # 后台定时flush线程（程序退出时logging.shutdown会再调用flush/close）
+        self._flush_stop = threading.Event()
+        self._flush_thread = threading.Thread(
+            target=self._flush_loop, name=f"log-flush-{log_name}", daemon=True
+        )
+        self._flush_thread.start()
 
     def _update_handler(self):
         """
@@ -112,28 +187,58 @@ class DailyRotatingFileHandler(logging.Handler):
         当日期发生变化时，自动创建新的日志文件
         关闭旧的文件处理器，防止资源泄漏
         """
-        today = datetime.now().strftime("%Y-%m-%d")
+        today = _today_str()
         
         if self.current_date != today:
             # 关闭旧的文件处理器
-            if self.file_handler:
-                self.file_handler.close()
+            self._close_file_handler()
             
-            # 创建新的日志文件
-            log_filename = os.path.join(self.log_dir, f"{today}_{self.log_name}.log")
-            self.file_handler = logging.FileHandler(log_filename, mode='a', encoding='utf-8')
+            # 创建新的日志文件（带缓冲的文本流）
+            log_filename = self._log_filename_template.format(today)
+            stream = open(log_filename, 'a', encoding='utf-8', buffering=self.BUFFER_SIZE)
+            self.file_handler = _BufferedStreamHandler(stream)
             
             # 应用格式化器
             if self.formatter:
                 self.file_handler.setFormatter(self.formatter)
             
             self.current_date = today
+        
+        # 记录下一次切换时间，emit中只需比较时间戳
+        self._next_rollover_ts = _DATE_CACHE[1]
+
+    def _close_file_handler(self):
+        """flush并关闭当前文件流"""
+        if self.file_handler:
+            stream = self.file_handler.stream
+            self.file_handler.close()
+            try:
+                stream.flush()
+            finally:
+                stream.close()
+            self.file_handler = None
+
+    def _flush_loop(self):
+        """后台线程：按固定间隔flush缓冲区"""
+        while not self._flush_stop.wait(self.FLUSH_INTERVAL):
+            self.flush()
 
     def emit(self, record):
         """发出日志记录"""
-        self._update_handler()
+        # 未到次日零点时不做任何日期计算
+        if time.time() >= self._next_rollover_ts:
+            self._update_handler()
         if self.file_handler:
             self.file_handler.emit(record)
+            # 错误日志立即落盘，避免进程崩溃时丢失
+            if record.levelno >= logging.ERROR:
+                self.file_handler.flush()
+
+    def flush(self):
+        """将缓冲区内容写入文件"""
+        with self.lock:
+            if self.file_handler:
+                self.file_handler.flush()
 
     def setFormatter(self, fmt):
         """设置日志格式化器"""
@@ -142,11 +247,52 @@ class DailyRotatingFileHandler(logging.Handler):
             self.file_handler.setFormatter(fmt)
 
     def close(self):
-        """关闭处理器并释放资源"""
-        if self.file_handler:
-            self.file_handler.close()
+        """关闭处理器并释放资源（关闭前先flush缓冲区）"""
+        self._flush_stop.set()
+        with self.lock:
+            self._close_file_handler()
         super().close()
 
+_EXIT_HOOKS_INSTALLED = False
+
+def _stop_queue_listener():
+    """停止后台日志监听器，确保队列中的日志全部写出（程序退出时调用）"""
+    global _QUEUE_LISTENER
+    if _QUEUE_LISTENER is not None:
+        _QUEUE_LISTENER.stop()
+        _QUEUE_LISTENER = None
+
+def _stats_flush_loop(interval):
+    """后台线程：每隔interval秒写一次API统计文件（计数未变化时不产生I/O）"""
+    while not _STATS_FLUSH_STOP.wait(interval):
+        force_write_api_stats()
+
+def _start_stats_flusher(interval):
+    """启动API统计的后台定时写入线程（只启动一次）"""
+    global _STATS_FLUSH_THREAD
+    if _STATS_FLUSH_THREAD is not None or interval <= 0:
+        return
+    _STATS_FLUSH_THREAD = threading.Thread(
+        target=_stats_flush_loop, args=(interval,), name="api-stats-flush", daemon=True
+    )
+    _STATS_FLUSH_THREAD.start()
+
+def _stop_stats_flusher():
+    """停止后台统计写入线程并做最后一次写入（程序退出时调用）"""
+    _STATS_FLUSH_STOP.set()
+    force_write_api_stats()
+
+def _install_exit_hooks():
+    """注册退出钩子：atexit写入API统计并停止日志监听器（信号处理由主程序负责）"""
+    global _EXIT_HOOKS_INSTALLED
+    if _EXIT_HOOKS_INSTALLED:
+        return
+    atexit.register(_stop_stats_flusher)
+    # atexit按注册的逆序执行，此处晚于logging模块自身的shutdown注册，
+    # 因此会先排空日志队列，再由logging.shutdown统一flush/关闭处理器
+    atexit.register(_stop_queue_listener)
+    _EXIT_HOOKS_INSTALLED = True
+
 def setup_logging(log_name='main'):
     """
     配置系统日志记录器
@@ -156,6 +302,8 @@ def setup_logging(log_name='main'):
     2. 创建文件和控制台两个输出通道
     3. 设置统一的日志格式
     4. 为不同模块创建独立的日志文件
+    5. 根日志记录器只挂QueueHandler，文件和控制台输出由后台QueueListener线程完成，
+       工作线程记录日志时只需入队，不再阻塞在磁盘/控制台I/O上
     
     参数：
     log_name: 日志文件名标识，用于区分不同模块（如'main', 'zdss'）
@@ -168,6 +316,10 @@ def setup_logging(log_name='main'):
         run_mode = config.get('system', 'mode', fallback='RELEASE').upper()
     except (configparser.NoSectionError, configparser.NoOptionError):
         run_mode = 'RELEASE'  # 默认为发布模式
+    try:
+        stats_flush_interval = config.getint('system', 'stats_flush_interval', fallback=DEFAULT_STATS_FLUSH_INTERVAL)
+    except ValueError:
+        stats_flush_interval = DEFAULT_STATS_FLUSH_INTERVAL
 
     # 2. 根据运行模式设置日志级别
     # DEBUG模式：输出所有级别的日志，便于调试
@@ -176,10 +328,20 @@ def setup_logging(log_name='main'):
     file_level = logging.DEBUG if run_mode == 'DEBUG' else logging.INFO
 
     # 3. 配置根日志记录器
+    global _QUEUE_LISTENER
     logger = logging.getLogger()
     
     # 清除现有处理器，防止重复配置
+    if _QUEUE_LISTENER is not None:
+        # 先停止旧的监听器（会处理完队列中剩余的记录），再关闭其处理器
+        _QUEUE_LISTENER.stop()
+        for old_handler in _QUEUE_LISTENER.handlers:
+            old_handler.close()
+        _QUEUE_LISTENER = None
     if logger.hasHandlers():
+        # 先关闭旧处理器，确保缓冲区落盘并停止其后台flush线程
+        for old_handler in logger.handlers:
+            old_handler.close()
         logger.handlers.clear()
         
     logger.setLevel(logging.DEBUG)  # 设置为最低级别，由处理器控制输出
@@ -192,15 +354,27 @@ def setup_logging(log_name='main'):
     file_handler = DailyRotatingFileHandler(LOG_DIR, log_name)
     file_handler.setFormatter(formatter)
     file_handler.setLevel(file_level)
-    logger.addHandler(file_handler)
 
     # 6. 创建控制台日志处理器
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
     stream_handler.setLevel(console_level)
-    logger.addHandler(stream_handler)
 
-    # 7. 记录日志系统初始化信息
+    # 7. 通过队列异步输出：根日志记录器只负责入队，后台线程负责格式化和写出
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # 低于所有输出通道级别的记录直接丢弃，不进入队列
+    queue_handler.setLevel(min(file_level, console_level))
+    logger.addHandler(queue_handler)
+
+    _QUEUE_LISTENER = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+    _QUEUE_LISTENER.start()
+    _install_exit_hooks()
+    _start_stats_flusher(stats_flush_interval)
+
+    # 8. 记录日志系统初始化信息
     logger.info(f"日志系统已初始化，模块: {log_name}，运行模式: {run_mode}")
     return logger
 
@@ -209,38 +383,90 @@ def setup_logging(log_name='main'):
 # API调用统计功能
 # =============================================================================
 
+def _stats_file_path(date_str):
+    """返回指定日期的API统计文件路径"""
+    return os.path.join(LOG_DIR, f"{date_str}_analysis.log")
+
+def _read_api_stats_file(date_str):
+    """读取已有统计文件中的 (成功, 失败) 次数，文件不存在或无法解析时返回 (0, 0)"""
+    try:
+        with open(_stats_file_path(date_str), 'r', encoding='utf-8') as f:
+            match = API_STATS_FILE_RE.search(f.read())
+    except OSError:
+        return 0, 0
+    if not match:
+        return 0, 0
+    return int(match.group(1)), int(match.group(2))
+
+class _ApiCounter:
+    """
+    按线程分片的计数器：每个线程只修改自己的计数槽，递增时无需加锁；
+    读取时对初始值和所有线程的计数槽求和（线程结束后其计数槽仍保留在登记列表中，计数不丢失）
+    """
+
+    __slots__ = ('_start', '_local', '_slots', '_register_lock')
+
+    def __init__(self, start=0):
+        self._start = start
+        self._local = threading.local()
+        self._slots = []  # 各线程的计数槽 [n]
+        self._register_lock = threading.Lock()  # 只在线程首次计数、登记计数槽时使用
+
+    def increment(self):
+        """计数加一"""
+        try:
+            slot = self._local.slot
+        except AttributeError:
+            slot = self._local.slot = [0]
+            with self._register_lock:
+                self._slots.append(slot)
+        slot[0] += 1
+
+    @property
+    def value(self):
+        """当前累计值（初始值 + 各线程计数之和）"""
+        with self._register_lock:
+            slots = list(self._slots)
+        return self._start + sum(slot[0] for slot in slots)
+
+def _get_day_counters(date_str):
+    """
+    获取指定日期的计数器组
+
+    已存在时直接返回（无锁）；首次使用某日期时在锁内创建，
+    并以统计文件中已有的次数作为初始值（如程序当天重启），避免并发创建导致计数丢失。
+    """
+    counters = API_STATS.get(date_str)
+    if counters is None:
+        with API_STATS_LOCK:
+            counters = API_STATS.get(date_str)
+            if counters is None:
+                existing = _read_api_stats_file(date_str)
+                counters = {'success': _ApiCounter(existing[0]), 'fail': _ApiCounter(existing[1])}
+                API_STATS[date_str] = counters
+                _API_STATS_WRITTEN[date_str] = existing
+    return counters
+
+
+def _bump(kind):
+    """
+    递增当天指定类型（'success'/'fail'）的计数
+
+    调用线程只做内存计数，统计文件由后台线程定时写入（见 _start_stats_flusher），
+    跨日后前一天的最终计数也会在下一次定时写入时落盘。
+    """
+    _get_day_counters(_today_str())[kind].increment()
+
 def log_api_call_success():
     """记录API调用成功"""
-    global API_STATS_LOCK, API_STATS, LAST_STATS_DATE
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    with API_STATS_LOCK:
-        API_STATS[today]['success'] += 1
-        
-        # 检查是否需要写入统计日志
-        if LAST_STATS_DATE != today:
-            _write_api_stats_to_file()
-            LAST_STATS_DATE = today
+    _bump('success')
 
 def log_api_call_failure():
     """记录API调用失败"""
-    global API_STATS_LOCK, API_STATS, LAST_STATS_DATE
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    with API_STATS_LOCK:
-        API_STATS[today]['fail'] += 1
-        
-        # 检查是否需要写入统计日志
-        if LAST_STATS_DATE != today:
-            _write_api_stats_to_file()
-            LAST_STATS_DATE = today
+    _bump('fail')
 
 def force_write_api_stats():
     """强制写入API统计信息（程序退出时调用）"""
-    global API_STATS_LOCK
-    
     with API_STATS_LOCK:
         _write_api_stats_to_file()
 
@@ -248,51 +474,33 @@ def _write_api_stats_to_file():
     """内部函数：将API统计信息写入日志文件"""
     try:
         # 确保日志目录存在
-        os.makedirs(LOG_DIR, exist_ok=True)
+        _ensure_log_dir()
         
-        # 为每个日期写入统计信息
-        for date, stats in API_STATS.items():
-            if stats['success'] > 0 or stats['fail'] > 0:
-                log_filename = f"{date}_analysis.log"
-                log_path = os.path.join(LOG_DIR, log_filename)
-                
-                # 读取现有统计（如果存在）
-                existing_success = 0
-                existing_fail = 0
-                
-                if os.path.exists(log_path):
-                    try:
-                        with open(log_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            # 解析现有统计
-                            import re
-                            success_match = re.search(r'成功: (\d+)', content)
-                            fail_match = re.search(r'失败: (\d+)', content)
-                            
-                            if success_match:
-                                existing_success = int(success_match.group(1))
-                            if fail_match:
-                                existing_fail = int(fail_match.group(1))
-                    except Exception:
-                        pass  # 如果读取失败，使用默认值0
-                
-                # 累加统计
-                total_success = existing_success + stats['success']
-                total_fail = existing_fail + stats['fail']
-                total_calls = total_success + total_fail
-                
-                # 写入统计信息
-                with open(log_path, 'w', encoding='utf-8') as f:
-                    f.write(f"=== API调用统计 - {date} ===\n")
-                    f.write(f"总调用次数: {total_calls}\n")
-                    f.write(f"成功: {total_success}\n")
-                    f.write(f"失败: {total_fail}\n")
-                    f.write(f"成功率: {(total_success/total_calls*100):.2f}%\n")
-                    f.write(f"最后更新: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                
-                # 清空已写入的统计
-                stats['success'] = 0
-                stats['fail'] = 0
+        # 为每个日期写入统计信息（计数器为当天累计值，直接覆盖写入，无需读取旧文件）
+        for date, counters in list(API_STATS.items()):
+            total_success = counters['success'].value
+            total_fail = counters['fail'].value
+            if (total_success, total_fail) == _API_STATS_WRITTEN.get(date):
+                continue
+            total_calls = total_success + total_fail
+            if total_calls == 0:
+                continue
+            
+            # 拼好完整内容后一次write()写入
+            payload = API_STATS_HEADER + (
+                f"{date} ===\n"
+                f"总调用次数: {total_calls}\n"
+                f"成功: {total_success}\n"
+                f"失败: {total_fail}\n"
+                f"成功率: {(total_success/total_calls*100):.2f}%\n"
+                f"最后更新: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            ).encode('utf-8')
+            fd = os.open(_stats_file_path(date), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, payload)
+            finally:
+                os.close(fd)
+            _API_STATS_WRITTEN[date] = (total_success, total_fail)
                 
     except Exception as e:
         # 统计日志写入失败不应该影响主程序
@@ -306,10 +514,12 @@ def get_api_stats(date_str=None):
     参数：
     date_str: 日期字符串（YYYY-MM-DD格式），如果为None则返回今天的统计
     
-    返回：包含success和fail计数的字典
+    返回：包含success和fail计数的字典（当天累计值，包含程序启动前已写入文件的次数）
     """
     if date_str is None:
-        date_str = datetime.now().strftime('%Y-%m-%d')
+        date_str = _today_str()
     
-    with API_STATS_LOCK:
-        return dict(API_STATS[date_str]) 
\ No newline at end of file
+    counters = API_STATS.get(date_str)
+    if counters is None:
+        return {'success': 0, 'fail': 0}
+    return {'success': counters['success'].value, 'fail': counters['fail'].value}
@@ -32,6 +32,7 @@ AI病历智能分析系统 - 主程序 (aifz_main.py)
 
 import pymssql
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 from datetime import datetime, timedelta
 import time
@@ -41,15 +42,27 @@ import argparse
 import configparser
 import subprocess
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 import signal
 import random
-from collections import deque
+from collections import deque, OrderedDict
 import threading
+import itertools
+
+# JSON解析：优先使用C实现的orjson，未安装时回退到标准库json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
 
 # 导入自定义模块
 from aifz_logger import setup_logging, log_api_call_success, log_api_call_failure  # 统一日志配置模块
-from aifz_zdss_extract import reprocess_and_save_syxh_list  # 诊断手术提取模块
+from aifz_zdss_extract import (  # 诊断手术提取模块
+    reprocess_and_save_syxh_list, close_idle_db_connections, clear_name_match_caches, DbConnectionPool
+)
 
 # 初始化日志系统
 # 必须在所有其他操作之前配置日志，确保从程序启动开始就能记录所有日志信息
@@ -66,6 +79,11 @@ last_maintenance_time = datetime.min  # 上次维护任务执行时间
 # 全局配置容器
 API_MANAGERS = {}  # API密钥管理器字典，键为组名，值为ApiKeyManager实例
 ENABLED_API_GROUPS = []  # 启用的API组配置列表
+_GROUP_SCHEDULE = []  # 按密钥数量加权的API组轮询表
+_GROUP_RR_COUNTER = itertools.count()  # 轮询计数器（next()在GIL下原子执行，无需加锁）
+REQUIREMENTS_STAMP = '.requirements.stamp'  # 依赖检查通过后记录requirements.txt哈希的标记文件
+_REQ_SPLIT_RE = re.compile(r'[=<>~!;\s\[]')  # 从依赖声明中截取包名（版本约束、环境标记、extras之前）
+_BLANKLINE_RE = re.compile(r'\n\s*\n+')  # 连续空白行，用于DEBUG模式下压缩错误响应体
 
 class ApiLogicError(Exception):
     """API逻辑错误异常类，用于处理API返回成功状态但包含错误信息的情况"""
@@ -84,7 +102,7 @@ class ApiKeyManager:
     2. 智能限速：控制每个密钥的最小使用间隔
     3. 错误处理：自动暂停出现过多429错误的密钥
     4. 线程安全：支持多线程并发访问
-    5. 随机选择：从可用密钥中随机选择，实现负载均衡
+    5. 轮询选择：从随机起点开始轮询密钥，实现负载均衡
     
     使用场景：
     - 防止API限流（429错误）
@@ -105,7 +123,7 @@ class ApiKeyManager:
         pause_duration_minutes: 密钥暂停时长（分钟）
         """
         self._keys = api_keys
-        self._lock = threading.Lock()  # 线程锁，确保线程安全
+        self._cond = threading.Condition()  # 条件变量（内含锁），确保线程安全并在密钥释放时唤醒等待者
         
         # 为每个密钥初始化状态跟踪信息
         self._key_states = {
@@ -118,6 +136,9 @@ class ApiKeyManager:
             for key in self._keys
         }
         
+        # 轮询起点随机化，避免多个实例总是从第一个密钥开始
+        self._rr_idx = random.randrange(len(self._keys)) if self._keys else 0
+        
         # 配置参数
         self._min_interval = timedelta(seconds=min_interval_seconds)
         self._error_threshold = error_threshold
@@ -129,39 +150,44 @@ class ApiKeyManager:
         获取一个可用的API密钥
         
         算法逻辑：
-        1. 检查所有密钥的状态（使用中、冷却期、暂停状态）
-        2. 筛选出当前可用的密钥列表
-        3. 从可用列表中随机选择一个密钥
-        4. 标记该密钥为使用中状态
-        5. 如果没有可用密钥，等待1秒后重试
+        1. 从轮询位置开始依次检查密钥状态（使用中、冷却期、暂停状态）
+        2. 每个密钥最多检查一次，遇到第一个可用的即选中
+        3. 标记该密钥为使用中状态，轮询位置移到其后一个
+        4. 如果没有可用密钥，在条件变量上等待：
+           有密钥被释放时立即被唤醒，否则等到最早结束冷却/暂停的时间点
         
         返回：可用的API密钥字符串
         """
-        while True:
-            with self._lock:
+        key_count = len(self._keys)
+        with self._cond:
+            while True:
                 now = datetime.now()
-                available_keys = []
+                next_ready = None  # 最早可能有密钥可用的时间点
                 
-                # 遍历所有密钥，筛选可用的
-                for key, state in self._key_states.items():
-                    # 检查密钥是否被暂停
-                    is_paused = state['paused_until'] and now < state['paused_until']
+                for _ in range(key_count):
+                    key = self._keys[self._rr_idx]
+                    self._rr_idx = (self._rr_idx + 1) % key_count
+                    state = self._key_states[key]
+                    if state['in_use']:
+                        continue  # 使用中的密钥只能等待释放通知
+                    
+                    # 冷却结束时间和暂停结束时间取较晚者
+                    ready_at = state['last_used'] + self._min_interval
+                    if state['paused_until'] and state['paused_until'] > ready_at:
+                        ready_at = state['paused_until']
                     
                     # 检查密钥可用性：未使用 + 过了冷却期 + 未被暂停
-                    if (not state['in_use'] and 
-                        (now - state['last_used']) >= self._min_interval and 
-                        not is_paused):
-                        available_keys.append(key)
-                
-                if available_keys:
-                    # 随机选择一个可用密钥（负载均衡）
-                    key_to_use = random.choice(available_keys)
-                    self._key_states[key_to_use]['in_use'] = True
-                    logging.debug(f"线程 {threading.get_ident()} 获取API密钥: ...{key_to_use[-4:]}")
-                    return key_to_use
+                    if ready_at <= now:
+                        state['in_use'] = True
+                        logging.debug(f"线程 {threading.get_ident()} 获取API密钥: ...{key[-4:]}")
+                        return key
+                    
+                    if next_ready is None or ready_at < next_ready:
+                        next_ready = ready_at
 
-            # 没有可用密钥时，短暂等待避免CPU空转
-            time.sleep(1)
+                # 没有可用密钥时在条件变量上等待，避免CPU空转
+                timeout = (next_ready - now).total_seconds() if next_ready else None
+                self._cond.wait(timeout=timeout)
 
     def release_key(self, key):
         """
@@ -170,11 +196,13 @@ class ApiKeyManager:
         参数：
         key: 要释放的API密钥
         """
-        with self._lock:
+        with self._cond:
             if key in self._key_states:
                 self._key_states[key]['in_use'] = False
                 self._key_states[key]['last_used'] = datetime.now()
                 logging.debug(f"线程 {threading.get_ident()} 释放API密钥: ...{key[-4:]}")
+                # 唤醒一个等待者，由其重新计算冷却结束时间
+                self._cond.notify()
 
     def handle_429_error(self, key):
         """
@@ -189,7 +217,7 @@ class ApiKeyManager:
         参数：
         key: 出现429错误的API密钥
         """
-        with self._lock:
+        with self._cond:
             if key not in self._key_states:
                 return
 
@@ -220,6 +248,13 @@ class ApiKeyManager:
 # 系统初始化和配置加载
 # =============================================================================
 
+def _distribution_name(dist):
+    """返回已安装包的名称：优先使用 Distribution.name（Python 3.10+），低版本回退到元数据"""
+    try:
+        return dist.name
+    except AttributeError:
+        return dist.metadata['Name']
+
 def check_and_install_packages():
     """
     自动检查并安装Python依赖包
@@ -229,9 +264,26 @@ def check_and_install_packages():
     2. 检查当前环境中已安装的包
     3. 找出缺失的依赖包
     4. 使用多个镜像源尝试安装缺失的包
+    5. 检查通过后记录requirements.txt的哈希，清单未变化时下次启动直接跳过检查
     
     镜像源优先级：清华源 > 阿里源 > 官方源
     """
+    # 依赖清单与上次检查通过时一致，跳过扫描已安装包
+    try:
+        with open('requirements.txt', 'rb') as f:
+            requirements_hash = hashlib.blake2b(f.read()).hexdigest()
+    except OSError:
+        requirements_hash = None  # requirements.txt 缺失由下方逻辑处理
+    if requirements_hash:
+        try:
+            with open(REQUIREMENTS_STAMP, 'r', encoding='utf-8') as f:
+                stamp = f.read().strip()
+        except OSError:
+            stamp = None  # 标记文件不存在或无法读取，视为不匹配，正常检查后写入
+        if stamp == requirements_hash:
+            logging.info("依赖清单未变化，跳过依赖检查")
+            return
+
     try:
         # 导入包元数据模块，用于检查已安装的包
         import importlib.metadata as importlib_metadata
@@ -252,12 +304,14 @@ def check_and_install_packages():
             requirements = [line.strip() for line in f if line.strip() and not line.startswith('#')]
         
         # 获取已安装包的列表
-        installed_packages = {dist.metadata['Name'].lower() for dist in importlib_metadata.distributions()}
+        installed_packages = frozenset(
+            name.casefold() for name in map(_distribution_name, importlib_metadata.distributions()) if name
+        )
         
         # 找出缺失的包
         missing = []
         for req in requirements:
-            req_name = re.split(r'[=<>~]', req)[0].strip().lower()
+            req_name = _REQ_SPLIT_RE.split(req, maxsplit=1)[0].strip().casefold()
             if req_name not in installed_packages:
                 missing.append(req)
 
@@ -287,6 +341,14 @@ def check_and_install_packages():
                     sys.exit(1)
         else:
             logging.info("所有依赖包均已安装")
+        
+        # 记录本次检查通过的依赖清单哈希
+        if requirements_hash:
+            try:
+                with open(REQUIREMENTS_STAMP, 'w', encoding='utf-8') as f:
+                    f.write(requirements_hash)
+            except OSError as e:
+                logging.warning(f"写入依赖检查标记文件失败: {e}")
             
     except FileNotFoundError:
         logging.error("requirements.txt 文件未找到")
@@ -388,14 +450,15 @@ def load_config():
             thread_section = config['thread']
             
             # 整数参数转换
-            for key in ['max_workers', 'min_delay', 'max_delay']:
+            for key in ['max_workers', 'min_delay', 'max_delay', 'save_retry_base_ms', 'save_retry_max_ms']:
                 if key in thread_section:
                     try:
                         thread_config[key] = int(thread_section[key])
                     except ValueError:
                         logging.warning(f"线程配置 '{key}' 值无法转换为整数，使用默认值")
                         # 设置默认值
-                        defaults = {'max_workers': 10, 'min_delay': 0, 'max_delay': 20}
+                        defaults = {'max_workers': 10, 'min_delay': 0, 'max_delay': 20,
+                                    'save_retry_base_ms': 50, 'save_retry_max_ms': 2000}
                         thread_config[key] = defaults[key]
             
             result_config['thread'] = thread_config
@@ -406,6 +469,18 @@ def load_config():
         else:
             result_config['system'] = {'mode': 'RELEASE'}  # 默认发布模式
 
+        # 系统配置中的整数参数（0表示不启用）：
+        # content_cache_seconds - 提示词/知识库内容的缓存秒数
+        # min_content_length - 病历自身内容（不含提示词/知识库）的最小长度，不足时跳过AI分析
+        # ai_result_cache_size - 按内容哈希缓存AI分析结果的条数
+        system_int_defaults = {'content_cache_seconds': 0, 'min_content_length': 0, 'ai_result_cache_size': 0}
+        for key, default in system_int_defaults.items():
+            try:
+                result_config['system'][key] = int(result_config['system'].get(key, default))
+            except ValueError:
+                logging.warning(f"系统配置 '{key}' 值无法转换为整数，使用默认值 {default}")
+                result_config['system'][key] = default
+
         return result_config
         
     except KeyError as e:
@@ -424,8 +499,29 @@ try:
         group_name = group['name']
         api_keys_list = [key.strip() for key in group.get('api_keys', '').split(',') if key.strip()]
         API_MANAGERS[group_name] = ApiKeyManager(api_keys_list)
+        group['_keys_list'] = api_keys_list
+        
+        # 预先规范化请求参数，避免每次调用API时重复转换和构建
+        group['timeout'] = int(group.get('timeout', '1800'))
+        group['proxies'] = group.get('proxies') or {}
+        group['_base_headers'] = {'Content-Type': 'application/json'}
+        group['_payload_template'] = {
+            "model": group['model'],
+            "stream": False,
+            "temperature": 0.1,
+            "transforms": ["middle-out"]
+        }
         logging.info(f"API组 '{group_name}' 已加载，包含 {len(api_keys_list)} 个密钥")
 
+    # 构建加权轮询表：每个组出现的次数等于其密钥数量，各组交错排列
+    max_keys = max((len(group['_keys_list']) for group in ENABLED_API_GROUPS), default=0)
+    _GROUP_SCHEDULE = [
+        group
+        for round_idx in range(max_keys)
+        for group in ENABLED_API_GROUPS
+        if round_idx < len(group['_keys_list'])
+    ]
+
     # 加载线程配置
     if 'thread' in APP_CONFIG:
         THREAD_CONFIG = APP_CONFIG['thread']
@@ -436,6 +532,16 @@ try:
             'min_delay': 0,
             'max_delay': 30
         }
+
+    # 为每个API组创建进程级持久的HTTP会话，复用TCP/TLS连接（keep-alive）
+    # 连接池大小按线程数配置，保证并发请求时各线程都能复用连接
+    pool_size = int(THREAD_CONFIG.get('max_workers', 10))
+    for group in ENABLED_API_GROUPS:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size * 2)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        group['_session'] = session
         
 except (FileNotFoundError, KeyError) as e:
     logging.critical(f"配置加载失败，程序终止: {e}")
@@ -446,16 +552,16 @@ except (FileNotFoundError, KeyError) as e:
 # =============================================================================
 
 def get_db_connection():
-    """建立数据库连接"""
+    """建立数据库连接（默认会话参数由连接池 DbConnectionPool 统一设置）"""
     try:
         db_cfg = DB_CONFIG.copy()
         # 配置文件中已经正确处理了类型转换，直接使用
         conn = pymssql.connect(**db_cfg)
-        logging.info("数据库连接成功")
-        return conn
     except Exception as e:
         logging.error(f"数据库连接失败: {e}")
         raise
+    logging.info("数据库连接成功")
+    return conn
 
 def close_db_connection(conn, conn_name=""):
     """安全关闭数据库连接"""
@@ -468,6 +574,10 @@ def close_db_connection(conn, conn_name=""):
     finally:
         conn = None
 
+# 进程级数据库连接池，工作线程通过 DB_POOL.acquire() 借用连接
+# 空闲上限取最大线程数（命令行最多20）再留少量余量
+DB_POOL = DbConnectionPool(get_db_connection, max_idle=max(int(THREAD_CONFIG.get('max_workers', 10)), 20) + 2)
+
 def execute_sp(cursor, sp_name, *params):
     """执行存储过程"""
     try:
@@ -482,17 +592,140 @@ def execute_sp(cursor, sp_name, *params):
         logging.error(f"执行存储过程 {sp_name} 失败: {e}")
         return None
 
+# 病历内容的组成部分（按拼接顺序）：提示词、病程记录、检查结果、检验结果、费用明细、知识库
+CONTENT_TYPES = ('prompt', 'bcjl', 'jcjg', 'jyjg', 'fymx', 'kb')
+# 与具体病历无关的部分（提示词、知识库），可按 [system] content_cache_seconds 在进程内缓存
+STATIC_CONTENT_TYPES = frozenset(('prompt', 'kb'))
+_STATIC_CONTENT_CACHE = {}  # content_type -> (过期时间戳, 内容)，整体替换元组，多线程读写无需加锁
+
+def _first_content(rows):
+    """从存储过程结果中取出第一行的Content，没有有效内容时返回空字符串"""
+    if rows and rows[0] and rows[0].get('Content'):
+        return rows[0]['Content']
+    return ''
+
+# 批量获取病历内容是否可用：结果集数量不符或批处理语法不被支持时置为False，此后进程内直接逐个执行存储过程
+_CONTENT_BATCH_ENABLED = True
+
+class _ResultSetCountMismatch(Exception):
+    """批处理返回的结果集数量与存储过程调用数不一致"""
+
+def _discard_pending_results(cursor):
+    """丢弃游标上尚未读取的结果集，以便在同一游标上执行后续语句"""
+    try:
+        while cursor.nextset():
+            pass
+    except Exception as e:
+        logging.debug(f"丢弃未读取的结果集时出错: {e}")
+
+def _fetch_content_batch(cursor, syxh, content_types):
+    """
+    获取指定类型的病历内容，返回与 content_types 顺序一致的字符串列表
+
+    优先把各存储过程调用拼成一个批处理，一次网络往返后按顺序读取各结果集；
+    结果集必须与调用一一对应（不多不少），否则无法确定各结果集属于哪个类型。
+    - 结果集数量不符或批处理语法不被支持（ProgrammingError/NotSupportedError）：只警告一次，
+      本进程此后退回到逐个执行存储过程；
+    - 死锁/锁超时等瞬时错误：原样抛出，由调用方回滚本条病历的事务，下一轮重新处理（批处理保持启用）；
+    - 其他错误：本条病历改为逐个执行存储过程，批处理保持启用。
+    """
+    global _CONTENT_BATCH_ENABLED
+    if _CONTENT_BATCH_ENABLED:
+        try:
+            sql = "; ".join(["EXEC usp_xx_hz_zlxx %s, %s"] * len(content_types))
+            params = tuple(value for content_type in content_types for value in (syxh, content_type))
+            cursor.execute(sql, params)
+            parts = [_first_content(cursor.fetchall())]
+            for _ in content_types[1:]:
+                if not cursor.nextset():
+                    raise _ResultSetCountMismatch("存储过程返回的结果集数量少于预期")
+                parts.append(_first_content(cursor.fetchall()))
+            if cursor.nextset():
+                raise _ResultSetCountMismatch("存储过程返回的结果集数量多于预期")
+            return parts
+        except (_ResultSetCountMismatch, pymssql.ProgrammingError, pymssql.NotSupportedError) as e:
+            _discard_pending_results(cursor)
+            if _CONTENT_BATCH_ENABLED:  # 多个线程同时失败时只由第一个警告
+                _CONTENT_BATCH_ENABLED = False
+                logging.warning(f"批量获取病历内容不可用（syxh: {syxh}），此后改为逐项获取: {e}")
+        except Exception as e:
+            if _is_transient_db_error(e):
+                raise
+            _discard_pending_results(cursor)
+            logging.warning(f"批量获取 syxh: {syxh} 的病历内容失败，本条改为逐项获取: {e}")
+
+    parts = []
+    for content_type in content_types:
+        logging.debug(f"获取 syxh: {syxh} 的 '{content_type}' 内容")
+        parts.append(_first_content(execute_sp(cursor, 'usp_xx_hz_zlxx', syxh, content_type)))
+    return parts
+
+def fetch_content_parts(cursor, syxh):
+    """
+    获取病历各部分内容，返回与 CONTENT_TYPES 顺序一致的字符串列表
+
+    启用 content_cache_seconds 时，提示词和知识库在有效期内直接使用缓存，只查询其余部分；
+    缓存只保存非空内容，避免把一次查询失败的结果缓存下来。
+    """
+    ttl = SYSTEM_CONFIG.get('content_cache_seconds', 0)
+    now = time.monotonic()
+    parts = [''] * len(CONTENT_TYPES)
+    to_fetch = []  # [(位置, 类型), ...]
+    for idx, content_type in enumerate(CONTENT_TYPES):
+        cached = _STATIC_CONTENT_CACHE.get(content_type) if ttl > 0 else None
+        if cached is not None and cached[0] > now:
+            parts[idx] = cached[1]
+        else:
+            to_fetch.append((idx, content_type))
+
+    if to_fetch:
+        fetched = _fetch_content_batch(cursor, syxh, [content_type for _, content_type in to_fetch])
+        for (idx, content_type), content in zip(to_fetch, fetched):
+            parts[idx] = content
+            if ttl > 0 and content and content_type in STATIC_CONTENT_TYPES:
+                _STATIC_CONTENT_CACHE[content_type] = (now + ttl, content)
+    return parts
+
 # =============================================================================
 # AI接口调用模块
 # =============================================================================
 
+# AI分析结果缓存：内容哈希 -> AI返回内容（LRU，容量由 [system] ai_result_cache_size 配置）
+# 同一份病历内容在进程内再次提交时（如定时任务重复拉到未变化的病历）直接复用结果，不再调用AI。
+# 只缓存诊断提取成功且含诊断的结果：无法解析或没有诊断的结果会被清理后重新交给AI，不能从缓存重放
+_AI_RESULT_CACHE = OrderedDict()
+_AI_RESULT_CACHE_LOCK = threading.Lock()
+
+def _content_hash(content):
+    """计算病历内容的哈希，作为AI结果缓存的键"""
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+def get_cached_ai_result(content_hash):
+    """查询AI结果缓存，命中时返回缓存内容并标记为最近使用，未命中返回None"""
+    with _AI_RESULT_CACHE_LOCK:
+        ai_return = _AI_RESULT_CACHE.get(content_hash)
+        if ai_return is not None:
+            _AI_RESULT_CACHE.move_to_end(content_hash)
+        return ai_return
+
+def cache_ai_result(content_hash, ai_return):
+    """写入AI结果缓存，超出容量时淘汰最久未使用的条目"""
+    capacity = SYSTEM_CONFIG.get('ai_result_cache_size', 0)
+    if capacity <= 0:
+        return
+    with _AI_RESULT_CACHE_LOCK:
+        _AI_RESULT_CACHE[content_hash] = ai_return
+        _AI_RESULT_CACHE.move_to_end(content_hash)
+        while len(_AI_RESULT_CACHE) > capacity:
+            _AI_RESULT_CACHE.popitem(last=False)
+
 def call_ai_api(content):
     """
     调用AI大模型API进行病历分析
     
     功能特性：
     1. 自动重试机制：最多重试3次
-    2. 智能API组选择：随机选择可用的API组
+    2. 智能API组选择：按密钥数量加权轮询API组
     3. 密钥管理：自动获取和释放API密钥
     4. 错误处理：特殊处理429限流错误
     5. 响应验证：检查API返回格式的有效性
@@ -511,71 +744,63 @@ def call_ai_api(content):
         
         try:
             # 1. 选择API组和获取密钥
-            if not ENABLED_API_GROUPS:
+            if not _GROUP_SCHEDULE:
                 logging.error("没有可用的API组")
                 log_api_call_failure()  # 记录API调用失败
                 return None
                 
-            api_group = random.choice(ENABLED_API_GROUPS)  # 随机选择API组
+            # 按密钥数量加权轮询选择API组
+            api_group = _GROUP_SCHEDULE[next(_GROUP_RR_COUNTER) % len(_GROUP_SCHEDULE)]
             group_name = api_group['name']
             api_manager = API_MANAGERS[group_name]
             logging.debug(f"线程 {threading.get_ident()} 选择API组: '{group_name}'")
 
             api_key = api_manager.get_key()  # 获取可用密钥
 
-            # 2. 构建API请求
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f"Bearer {api_key}"
-            }
-            payload = {
-                "model": api_group['model'],
-                "messages": [{"role": "user", "content": content}],
-                "stream": False,
-                "temperature": 0.1,
-                "transforms": ["middle-out"]
-            }
-            proxies = api_group.get('proxies', {})
-
-            # 3. 发送API请求
-            with requests.Session() as session:
-                logging.info(f"调用API组 '{group_name}' (尝试 {attempt + 1}/{max_retries})")
-                
-                response = session.post(
-                    api_group['url'], 
-                    json=payload, 
-                    headers=headers, 
-                    timeout=int(api_group.get('timeout', '1800')),
-                    proxies=proxies
-                )
-                response.raise_for_status()
+            # 2. 构建API请求（基于加载配置时预先生成的模板）
+            headers = {**api_group['_base_headers'], 'Authorization': f"Bearer {api_key}"}
+            payload = {**api_group['_payload_template'], "messages": [{"role": "user", "content": content}]}
 
-                # 4. 解析API响应
-                try:
-                    response_data = response.json()
-                except ValueError as json_error:
-                    # JSON解析失败，通常是响应内容不是有效的JSON
-                    raise ApiLogicError(f"API返回的响应无法解析为JSON: {json_error}")
-
-                # 检查API逻辑错误
-                if 'error' in response_data:
-                    raise ApiLogicError(f"API返回错误: {response_data['error']}")
-
-                # 提取AI分析结果
-                if (response_data and 'choices' in response_data and 
-                    len(response_data['choices']) > 0):
-                    message = response_data['choices'][0].get('message', {})
-                    ai_return = message.get('content')
-                    
-                    if ai_return is not None:
-                        logging.info("AI分析完成")
-                        log_api_call_success()  # 记录API调用成功
-                        return ai_return
+            # 3. 发送API请求（使用该组的持久会话）
+            session = api_group['_session']
+            logging.info(f"调用API组 '{group_name}' (尝试 {attempt + 1}/{max_retries})")
+            
+            response = session.post(
+                api_group['url'], 
+                json=payload, 
+                headers=headers, 
+                timeout=api_group['timeout'],
+                proxies=api_group['proxies']
+            )
+            response.raise_for_status()
+
+            # 4. 解析API响应
+            try:
+                # 直接解析响应字节，省去先解码为str的步骤
+                response_data = _json_loads(response.content)
+            except ValueError as json_error:
+                # JSON解析失败，通常是响应内容不是有效的JSON
+                raise ApiLogicError(f"API返回的响应无法解析为JSON: {json_error}")
+
+            # 检查API逻辑错误
+            if 'error' in response_data:
+                raise ApiLogicError(f"API返回错误: {response_data['error']}")
+
+            # 提取AI分析结果
+            if (response_data and 'choices' in response_data and 
+                len(response_data['choices']) > 0):
+                message = response_data['choices'][0].get('message', {})
+                ai_return = message.get('content')
                 
-                # 响应格式不符合预期
-                logging.warning(f"API返回格式异常: {response_data}")
-                log_api_call_failure()  # 记录API调用失败
-                return None
+                if ai_return is not None:
+                    logging.info("AI分析完成")
+                    log_api_call_success()  # 记录API调用成功
+                    return ai_return
+            
+            # 响应格式不符合预期
+            logging.warning(f"API返回格式异常: {response_data}")
+            log_api_call_failure()  # 记录API调用失败
+            return None
 
         except (requests.exceptions.RequestException, ApiLogicError, ValueError) as e:
             # 记录详细错误信息
@@ -585,13 +810,14 @@ def call_ai_api(content):
                 status_code = response.status_code
                 
                 # 根据运行模式决定是否显示响应体
-                if SYSTEM_CONFIG.get('mode', 'RELEASE') == 'DEBUG':
+                if (SYSTEM_CONFIG.get('mode', 'RELEASE') == 'DEBUG'
+                        and logging.getLogger().isEnabledFor(logging.DEBUG)):
                     # DEBUG模式：显示响应体内容（清理空白行）
-                    response_body = response.text.strip()
+                    # 先截取前500字符再做正则替换，避免对大体积错误页面做全文扫描
+                    response_body = response.text[:500].strip()
                     # 压缩连续的空白行为单个空行
-                    import re
-                    response_body = re.sub(r'\n\s*\n+', '\n\n', response_body)
-                    response_info = f" Status: {status_code}, Body: {response_body[:500]}"
+                    response_body = _BLANKLINE_RE.sub('\n\n', response_body)
+                    response_info = f" Status: {status_code}, Body: {response_body}"
                 else:
                     # RELEASE模式：只显示状态码和基本信息
                     if status_code == 200:
@@ -617,7 +843,10 @@ def call_ai_api(content):
             
             if attempt < max_retries - 1:
                 logging.info(f"将在 {retry_delay} 秒后重试...")
-                time.sleep(retry_delay)
+                # 等待期间收到关闭信号时立即放弃重试
+                if SHUTDOWN_FLAG.wait(retry_delay):
+                    logging.warning("检测到关闭标志，放弃API重试")
+                    return None
             else:
                 logging.error(f"API调用在 {max_retries} 次尝试后仍然失败")
                 log_api_call_failure()  # 记录API调用失败
@@ -659,34 +888,30 @@ def perform_hourly_maintenance():
         return
 
     logging.info("开始执行每小时系统维护任务...")
+    # 清空诊断手术提取模块的名称匹配缓存，使对照表（MED_LCYBZDDYK/MED_LCYBSSDYK）及其灰码/除外码标志的修改每小时内生效
+    clear_name_match_caches()
     
-    conn = None
     try:
-        # 使用独立的数据库连接进行维护操作
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
+        # 从连接池借用连接进行维护操作（出现异常时归还前自动回滚，并恢复默认会话参数）
+        with DB_POOL.acquire() as conn, conn.cursor() as cursor:
+            # 维护操作使用较短的锁超时，避免长时间阻塞业务处理
+            cursor.execute("SET LOCK_TIMEOUT 30000")  # 30秒锁超时
+
             # 步骤1：清理孤立的AI分析结果记录
             logging.info("维护步骤1：清理数据库孤立记录...")
             
-            # 删除在诊断手术表中完全没有对应记录的AI结果
-            sql_delete_1 = """
-            DELETE a FROM XX_AIFZ_RETURN a WITH (NOLOCK) 
-            LEFT JOIN XX_AIFZ_ZDSS b WITH (NOLOCK) ON a.syxh = b.syxh 
-            WHERE ISNULL(b.syxh, '') = ''
-            """
-            cursor.execute(sql_delete_1)
-            deleted_1 = cursor.rowcount
-            logging.info(f"清理了 {deleted_1} 条完全孤立的AI分析记录")
-            
-            # 删除在诊断表中没有诊断类型记录的AI结果
-            sql_delete_2 = """
-            DELETE a FROM XX_AIFZ_RETURN a WITH (NOLOCK) 
-            LEFT JOIN XX_AIFZ_ZDSS b WITH (NOLOCK) ON a.syxh = b.syxh AND b.type = 'zd' 
-            WHERE ISNULL(b.syxh, '') = ''
+            # 删除在诊断手术表中没有诊断类型记录的AI结果
+            # （完全没有诊断手术记录的AI结果同样满足该条件，一条语句、一次扫描即可覆盖两种情况）
+            sql_delete = """
+            DELETE a FROM XX_AIFZ_RETURN a
+            WHERE NOT EXISTS (
+                SELECT 1 FROM XX_AIFZ_ZDSS b WITH (NOLOCK)
+                WHERE b.syxh = a.syxh AND b.type = 'zd'
+            )
             """
-            cursor.execute(sql_delete_2)
-            deleted_2 = cursor.rowcount
-            logging.info(f"清理了 {deleted_2} 条缺少诊断记录的AI分析记录")
+            cursor.execute(sql_delete)
+            deleted = cursor.rowcount
+            logging.info(f"清理了 {deleted} 条缺少诊断记录的AI分析记录")
             
             conn.commit()
             logging.info("数据库清理操作已提交")
@@ -700,16 +925,14 @@ def perform_hourly_maintenance():
             cursor.execute(sql_select_reprocess)
             results = cursor.fetchall()
             
-            # 提取需要重新处理的syxh列表
+            # 提取需要重新处理的syxh列表（行格式只判断一次，兼容字典和元组）
             syxh_to_reprocess: list[str] = []
             if results:
-                for row in results:
-                    if isinstance(row, dict):
-                        val = row.get('syxh')
-                        if isinstance(val, str):
-                            syxh_to_reprocess.append(val)
-                        elif val is not None:
-                            syxh_to_reprocess.append(str(val))
+                if isinstance(results[0], dict):
+                    values = (row.get('syxh') for row in results)
+                else:
+                    values = (row[0] for row in results)
+                syxh_to_reprocess = [str(val) for val in values if val is not None]
 
         # 步骤3：重新处理未完成的记录
         if syxh_to_reprocess:
@@ -724,30 +947,55 @@ def perform_hourly_maintenance():
 
     except Exception as e:
         logging.error(f"执行系统维护任务时发生错误: {e}", exc_info=True)
-        if conn:
-            try:
-                conn.rollback()
-            except Exception as rb_e:
-                logging.error(f"维护任务事务回滚失败: {rb_e}")
-    finally:
-        if conn:
-            close_db_connection(conn, "maintenance_conn")
 
 
 # =============================================================================
 # 病历AI分析处理模块
 # =============================================================================
 
+# aisavetime 取数据库服务器时间，格式化为 'YYYY-MM-DD HH:MM:SS'（style 120），
+# 与 zdssextime 等字段原有的字符串格式一致，无论列是字符类型还是日期类型都可直接比较
+SAVE_AIRETURN_MERGE_SQL = """
+MERGE XX_AIFZ_RETURN WITH (ROWLOCK, HOLDLOCK) AS t
+USING (VALUES (%s, %s, CONVERT(varchar(19), GETDATE(), 120), %s, %s)) AS s (syxh, aireturn, aisavetime, isgdsave, iscqsave)
+ON t.syxh = s.syxh
+WHEN MATCHED THEN UPDATE SET
+    aireturn = s.aireturn,
+    aisavetime = s.aisavetime,
+    zdssextime = NULL,
+    isgdsave = CASE WHEN s.isgdsave = 1 THEN 1 ELSE t.isgdsave END,
+    iscqsave = CASE WHEN s.iscqsave = 1 THEN 1 ELSE t.iscqsave END
+WHEN NOT MATCHED THEN
+    INSERT (syxh, aireturn, aisavetime, zdssextime, iscqsave, isgdsave)
+    VALUES (s.syxh, s.aireturn, s.aisavetime, NULL, s.iscqsave, s.isgdsave)
+OUTPUT $action AS merge_action;
+"""
+
+# 可重试的SQL Server错误号：1205=死锁牺牲品，1222=锁请求超时
+# 连接级错误（如-2超时、10054连接重置）不在此列：原连接和事务已不可用，在同一游标上重试没有意义
+TRANSIENT_DB_ERROR_CODES = frozenset((1205, 1222))
+
+def _is_transient_db_error(e):
+    """判断数据库异常是否为可重试的瞬时错误（兼容 args 为 (code, msg) 或 ((code, msg),) 两种形式）"""
+    args = getattr(e, 'args', ())
+    if args:
+        first = args[0]
+        if isinstance(first, tuple) and first:
+            first = first[0]
+        if isinstance(first, int) and first in TRANSIENT_DB_ERROR_CODES:
+            return True
+    return 'deadlock' in str(e).lower()
+
 def save_aireturn_to_db(cursor, syxh, ai_return, process_type):
     """
     将AI分析结果保存到数据库
     
     处理逻辑：
-    1. 使用行级锁检查记录是否存在（防止并发冲突）
+    1. 使用一条带 HOLDLOCK 的 MERGE 语句原子地完成更新或插入（防止并发冲突）
     2. 如果存在则更新，不存在则插入
     3. 根据处理类型设置相应的标志位
     4. 重置诊断提取时间，触发后续处理
-    5. 包含死锁重试机制，最多重试3次
+    5. 包含死锁/锁超时重试机制，最多重试3次
     
     参数：
     cursor: 数据库游标
@@ -760,63 +1008,35 @@ def save_aireturn_to_db(cursor, syxh, ai_return, process_type):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            # 设置事务隔离级别和锁超时时间
-            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-            cursor.execute("SET LOCK_TIMEOUT 30000")  # 30秒锁超时
-            
-            # 使用行级更新锁检查记录是否存在（防止死锁）
-            cursor.execute("SELECT 1 AS record_exists FROM XX_AIFZ_RETURN WITH (UPDLOCK, ROWLOCK) WHERE syxh = %s", (syxh,))
-            exists = cursor.fetchone()
-            
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            if exists:
-                # 记录存在，执行更新操作
-                set_clauses = [
-                    "aireturn = %s",
-                    "aisavetime = %s",
-                    "zdssextime = NULL"  # 重置诊断提取时间，触发重新提取
-                ]
-                params = [ai_return, current_time]
-
-                # 根据处理类型设置标志位
-                if process_type == 'brgd':
-                    set_clauses.append("isgdsave = 1")  # 标记挂单已保存
-                elif process_type == 'brcq':
-                    set_clauses.append("iscqsave = 1")  # 标记出院已保存
-                # brzy类型只更新内容，不修改标志位
-
-                update_query = f"UPDATE XX_AIFZ_RETURN WITH (ROWLOCK) SET {', '.join(set_clauses)} WHERE syxh = %s"
-                params.append(syxh)
-                
-                cursor.execute(update_query, tuple(params))
+            # 会话已是 READ COMMITTED + 60秒锁超时（连接建立时设置），此处无需重复设置
+            isgdsave = 1 if process_type == 'brgd' else 0  # 标记挂单已保存
+            iscqsave = 1 if process_type == 'brcq' else 0  # 标记出院已保存
+
+            # 单条MERGE完成"存在则更新、不存在则插入"（HOLDLOCK防止并发插入同一syxh）
+            # 更新时只在对应类型下把标志位置1，brzy类型只更新内容；同时重置诊断提取时间，触发重新提取
+            cursor.execute(SAVE_AIRETURN_MERGE_SQL, (syxh, ai_return, isgdsave, iscqsave))
+            row = cursor.fetchone()
+            action = (row.get('merge_action') if isinstance(row, dict) else row[0]) if row else None
+            if action == 'UPDATE':
                 logging.info(f"[更新] syxh: {syxh} 的AI分析结果已更新（类型: {process_type}）")
             else:
-                # 记录不存在，执行插入操作
-                isgdsave = 1 if process_type == 'brgd' else 0
-                iscqsave = 1 if process_type == 'brcq' else 0
-
-                insert_query = "INSERT INTO XX_AIFZ_RETURN (syxh, aireturn, aisavetime, zdssextime, iscqsave, isgdsave) VALUES (%s, %s, %s, NULL, %s, %s)"
-                cursor.execute(insert_query, (syxh, ai_return, current_time, iscqsave, isgdsave))
                 logging.info(f"[插入] syxh: {syxh} 的AI分析结果已插入（类型: {process_type}）")
             return True
             
         except Exception as e:
-            # 检查是否是死锁错误 (1205)
-            is_deadlock = False
-            if hasattr(e, 'args') and len(e.args) > 0:
-                if isinstance(e.args[0], tuple) and len(e.args[0]) > 0:
-                    error_code = e.args[0][0]
-                    is_deadlock = (error_code == 1205)
-            
-            if is_deadlock and attempt < max_retries - 1:
-                # 死锁错误，增加随机延迟后重试
-                retry_delay = random.uniform(1, 3) * (attempt + 1)
-                logging.warning(f"syxh: {syxh} 遇到死锁错误，{retry_delay:.2f}秒后重试 (尝试 {attempt + 1}/{max_retries})")
-                time.sleep(retry_delay)
+            # 检查是否是可重试的瞬时错误（死锁、锁超时）
+            if _is_transient_db_error(e) and attempt < max_retries - 1:
+                # 瞬时错误，按指数退避 + 全抖动（full jitter）随机等待后重试
+                base = int(THREAD_CONFIG.get('save_retry_base_ms', 50)) / 1000
+                cap = int(THREAD_CONFIG.get('save_retry_max_ms', 2000)) / 1000
+                retry_delay = min(cap, base * 2 ** attempt) * random.random()
+                logging.warning(f"syxh: {syxh} 遇到可重试的数据库错误（{e}），{retry_delay:.2f}秒后重试 (尝试 {attempt + 1}/{max_retries})")
+                if SHUTDOWN_FLAG.wait(retry_delay):
+                    logging.warning(f"syxh: {syxh} 检测到关闭标志，放弃保存重试")
+                    return False
                 continue
             else:
-                # 非死锁错误或重试次数用完，记录错误并返回失败
+                # 不可重试的错误或重试次数用完，记录错误并返回失败
                 logging.error(f"保存AI分析结果失败 (syxh: {syxh}): {e}")
                 return False
     
@@ -826,6 +1046,7 @@ def save_aireturn_to_db(cursor, syxh, ai_return, process_type):
 
 # 导入诊断手术提取模块
 from aifz_zdss_extract import process_single_syxh as process_zdss_for_syxh
+from aifz_parser import parse_table
 
 def process_single_syxh(cursor, syxh_row, process_type):
     """
@@ -848,39 +1069,38 @@ def process_single_syxh(cursor, syxh_row, process_type):
     logging.info(f"开始处理病历 syxh: {syxh} (类型: {process_type})")
     
     try:
-        # 设置数据库事务参数
-        cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-        cursor.execute("SET LOCK_TIMEOUT 60000")  # 60秒锁超时
-        
-        # 按顺序获取病历的各部分内容
-        content_parts = []
-        content_types = ['prompt', 'bcjl', 'jcjg', 'jyjg', 'fymx', 'kb']  # 提示词、病程记录、检查结果、检验结果、费用明细、知识库
-        
-        for content_type in content_types:
-            logging.debug(f"获取 syxh: {syxh} 的 '{content_type}' 内容")
-            result = execute_sp(cursor, 'usp_xx_hz_zlxx', syxh, content_type)
-            
-            # 提取有效内容
-            if result and result[0] and result[0].get('Content'):
-                content_parts.append(result[0]['Content'])
-            else:
-                content_parts.append('')
+        # 获取病历的各部分内容（一次往返获取全部部分）
+        content_parts = fetch_content_parts(cursor, syxh)
 
-        # 拼接所有内容作为AI输入
-        final_content = "".join(content_parts)
-
-        if not final_content.strip():
+        # 先逐部分判断是否全为空白（遇到首个非空部分即停止，isspace不复制字符串），再拼接
+        if not any(part and not part.isspace() for part in content_parts):
             logging.warning(f"syxh: {syxh} 的病历内容为空，跳过处理")
             return f"syxh: {syxh} - 病历内容为空", False
+
+        # 病历自身内容过短时不值得调用AI（按长度求和，不拼接、不复制字符串）
+        min_length = SYSTEM_CONFIG.get('min_content_length', 0)
+        if min_length > 0:
+            record_length = sum(len(part) for content_type, part in zip(CONTENT_TYPES, content_parts)
+                                if content_type not in STATIC_CONTENT_TYPES)
+            if record_length < min_length:
+                logging.warning(f"syxh: {syxh} 的病历内容过短（{record_length} < {min_length} 字符），跳过处理")
+                return f"syxh: {syxh} - 病历内容过短", False
+
+        # 拼接所有内容作为AI输入
+        final_content = "".join(content_parts)
             
-        # 调用AI接口进行分析
-        ai_return = call_ai_api(final_content)
+        # 调用AI接口进行分析（内容与之前某次完全相同时直接复用缓存结果）
+        content_hash = _content_hash(final_content)
+        ai_return = get_cached_ai_result(content_hash)
+        from_cache = ai_return is not None
+        if from_cache:
+            logging.info(f"syxh: {syxh} 的病历内容未变化，复用缓存的AI分析结果")
+        else:
+            ai_return = call_ai_api(final_content)
 
         if ai_return:
-            # 添加随机延迟，降低数据库并发冲突概率
-            save_delay = random.uniform(0, 10)
-            logging.info(f"syxh: {syxh} - AI分析完成，延迟 {save_delay:.2f} 秒后保存结果")
-            time.sleep(save_delay)
+            # 直接保存；只有真正遇到死锁时才在 save_aireturn_to_db 中退避重试
+            logging.info(f"syxh: {syxh} - AI分析完成，开始保存结果")
 
             # 步骤1：保存AI分析结果
             if save_aireturn_to_db(cursor, syxh, ai_return, process_type):
@@ -889,6 +1109,9 @@ def process_single_syxh(cursor, syxh_row, process_type):
                 # 步骤2：立即进行诊断手术信息提取
                 conn = cursor.connection
                 if process_zdss_for_syxh(conn, syxh):
+                    # 诊断提取成功且解析出诊断后才缓存，避免重放会被维护任务清理的无效结果
+                    if not from_cache and parse_table(ai_return, '诊断'):
+                        cache_ai_result(content_hash, ai_return)
                     logging.info(f"syxh: {syxh} 处理完成 - AI分析和诊断提取均成功")
                     return f"syxh: {syxh} - 处理完成", True
                 else:
@@ -921,20 +1144,15 @@ def process_syxh_threaded(syxh_row, process_type):
             logging.info(f"syxh: {syxh} 检测到关闭标志，线程提前退出（延迟前）")
             return
         logging.debug(f"syxh: {syxh} 的处理将随机延迟 {delay_seconds:.2f} 秒")
-        time.sleep(delay_seconds)
-        if SHUTDOWN_FLAG.is_set():
-            logging.info(f"syxh: {syxh} 检测到关闭标志，线程提前退出（延迟后）")
+        # Event.wait在关闭标志被设置时立即返回True，不必等满整个延迟
+        if SHUTDOWN_FLAG.wait(delay_seconds):
+            logging.info(f"syxh: {syxh} 检测到关闭标志，线程提前退出（延迟中）")
             return
     
-    conn = None
     try:
-        # 每个线程都创建自己的数据库连接
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            # 先设置事务隔离级别，然后再设置锁超时 - 顺序很重要
-            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-            cursor.execute("SET LOCK_TIMEOUT 60000")  # 60秒锁超时
-            
+        # 从连接池借用连接（会话参数已由连接池设置为 READ COMMITTED + 60秒锁超时）
+        # 出现异常时，连接归还连接池前会自动回滚未提交的事务
+        with DB_POOL.acquire() as conn, conn.cursor() as cursor:
             # 调用原始的单一处理逻辑
             if SHUTDOWN_FLAG.is_set():
                 logging.info(f"syxh: {syxh} 检测到关闭标志，线程提前退出（处理前）")
@@ -953,95 +1171,101 @@ def process_syxh_threaded(syxh_row, process_type):
                 except Exception as rb_e:
                     logging.error(f"回滚 syxh: {syxh} 的事务时发生错误: {rb_e}")
     except Exception as e:
-        if conn:
-            try:
-                conn.rollback()
-            except Exception as rb_e:
-                logging.error(f"对 syxh: {syxh} 进行回滚时发生错误: {rb_e}")
         logging.error(f"处理 syxh: {syxh} 的线程中发生严重错误: {e}", exc_info=True)
-    finally:
-        close_db_connection(conn, f"syxh: {syxh} 的线程")
+
+PROCESS_TYPES = ('brgd', 'brcq', 'brzy')  # 定时任务依次处理的类型：病人挂单、病人出院、病人在院
+
+def _syxh_of(syxh_row):
+    """兼容syxh_row为dict或str，返回syxh"""
+    if isinstance(syxh_row, dict):
+        return syxh_row.get('syxh', str(syxh_row))
+    return str(syxh_row)
 
 def run_main_process(process_type, specific_syxh=None, max_workers=None):
     """
     运行主流程，获取syxh列表并使用线程池并发处理。
-    :param process_type: 处理类型 ('brgd', 'brcq', 'brzy')，如果指定了specific_syxh则此项无效
+    :param process_type: 处理类型 ('brgd', 'brcq', 'brzy')，也可以是多个类型的序列；
+                         多个类型时先依次获取各类型的列表，再合并到同一个线程池中处理；
+                         同一syxh出现在多个类型中时只按最先出现的类型处理一次（与逐个类型处理时
+                         后一类型不再返回前一类型已处理的记录一致），避免同一周期内重复调用AI。
+                         如果指定了specific_syxh则此项无效
     :param specific_syxh: 如果提供，则只处理这一个syxh
     :param max_workers: 线程池的最大线程数，如果未指定则使用配置文件中的值
     """
     if max_workers is None:
         max_workers = int(THREAD_CONFIG.get('max_workers', 10))
     
-    task_name = f"syxh: {specific_syxh}" if specific_syxh else f"'{process_type}' 类型"
+    process_types = (process_type,) if isinstance(process_type, str) or process_type is None else tuple(process_type)
+    if specific_syxh:
+        task_name = f"syxh: {specific_syxh}"
+    else:
+        task_name = "、".join(f"'{t}'" for t in process_types) + " 类型"
     logging.info(f"====== 开始执行 {task_name} 任务 (并发数: {max_workers}) ======")
     start_time = time.time()
     
-    conn = None
     try:
-        conn = get_db_connection()
-        
-        syxh_list = []
-        with conn.cursor() as cursor:
-            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-            cursor.execute("SET LOCK_TIMEOUT 30000")  # 30秒锁超时
-            
+        tasks = []  # [(syxh_row, process_type), ...]
+        # 借用连接池中的连接（会话参数已在建立连接时设置）
+        with DB_POOL.acquire() as conn, conn.cursor() as cursor:
             if specific_syxh:
-                syxh_list.append({'syxh': specific_syxh})
-                process_type = 'brgd'
+                tasks.append(({'syxh': specific_syxh}, 'brgd'))
             else:
-                logging.info(f"正在获取 '{process_type}' 类型的待处理 syxh 列表...")
-                syxh_list = execute_sp(cursor, 'usp_xx_aifz_auto', process_type)
-        close_db_connection(conn, "获取任务列表")
-        conn = None
+                for t in process_types:
+                    logging.info(f"正在获取 '{t}' 类型的待处理 syxh 列表...")
+                    rows = execute_sp(cursor, 'usp_xx_aifz_auto', t) or []
+                    if len(process_types) > 1:
+                        logging.info(f"'{t}' 类型获取到 {len(rows)} 个 syxh")
+                    tasks.extend((row, t) for row in rows)
         
-        if not syxh_list:
+        if not tasks:
             logging.info(f"未获取到 {task_name} 的待处理记录，任务结束。")
             return
 
-        logging.info(f"获取到 {len(syxh_list)} 个 syxh，准备使用 {max_workers} 个线程进行处理...")
+        # 跨类型按syxh去重（保持首次出现的顺序和类型）：各类型列表是在处理前一次性获取的，
+        # 前一类型将要处理的记录仍会出现在后面类型的列表中
+        tasks_by_syxh = {}
+        for syxh_row, t in tasks:
+            tasks_by_syxh.setdefault(_syxh_of(syxh_row), (syxh_row, t))
+        duplicates = len(tasks) - len(tasks_by_syxh)
+        if duplicates:
+            logging.info(f"跳过 {duplicates} 条重复的 syxh（同一类型内或跨类型重复），每个 syxh 只按最先出现的类型处理一次")
+
+        logging.info(f"获取到 {len(tasks_by_syxh)} 个 syxh，准备使用 {max_workers} 个线程进行处理...")
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 一次性提交全部任务；请求错峰由工作线程内的随机延迟和API密钥管理器的限速负责
             futures = {}
-            for i, syxh_row in enumerate(syxh_list):
-                if max_workers > 1 and i > 0:
-                    stagger_delay = min(2.0, 10.0 / max_workers) * (i % max_workers)
-                    if stagger_delay > 0:
-                        if SHUTDOWN_FLAG.is_set():
-                            logging.warning("检测到关闭标志，线程池任务提交提前终止！")
-                            break
-                        time.sleep(stagger_delay)
-                future = executor.submit(process_syxh_threaded, syxh_row, process_type)
-                # 兼容syxh_row为dict或str
-                if isinstance(syxh_row, dict):
-                    futures[future] = syxh_row.get('syxh', str(syxh_row))
-                else:
-                    futures[future] = str(syxh_row)
-            # --- 优化主线程等待方式 ---
-            pending_futures = set(futures.keys())
+            for syxh, (syxh_row, t) in tasks_by_syxh.items():
+                future = executor.submit(process_syxh_threaded, syxh_row, t)
+                futures[future] = syxh
+            # --- 主线程等待方式：as_completed 在任务完成时才被唤醒 ---
+            # 超时只用于定期检查关闭标志，超时后对剩余任务重新调用 as_completed
+            pending_futures = set(futures)
             total = len(pending_futures)
             finished = 0
             while pending_futures:
-                done, not_done = wait(pending_futures, timeout=2, return_when=FIRST_COMPLETED)
-                for future in done:
-                    syxh = futures[future]
-                    finished += 1
-                    logging.info(f"--- 进度: {finished}/{total} (syxh: {syxh} 已处理完毕) ---")
-                    try:
-                        future.result()
-                    except Exception as exc:
-                        logging.error(f'syxh {syxh} 在其工作线程中产生了一个未处理的异常: {exc}')
-                    pending_futures.remove(future)
+                try:
+                    for future in as_completed(pending_futures, timeout=2):
+                        pending_futures.discard(future)
+                        syxh = futures[future]
+                        finished += 1
+                        logging.info(f"--- 进度: {finished}/{total} (syxh: {syxh} 已处理完毕) ---")
+                        try:
+                            future.result()
+                        except Exception as exc:
+                            logging.error(f'syxh {syxh} 在其工作线程中产生了一个未处理的异常: {exc}')
+                        if SHUTDOWN_FLAG.is_set():
+                            break
+                except FuturesTimeoutError:
+                    pass
                 if SHUTDOWN_FLAG.is_set():
                     logging.warning("检测到关闭标志，正在取消剩余的未开始任务...")
-                    for f in not_done:
+                    for f in pending_futures:
                         if not f.running() and not f.done():
                             f.cancel()
                     break
     except Exception as e:
         logging.error(f"执行 {task_name} 任务主流程时发生严重错误: {e}", exc_info=True)
-    finally:
-        if conn:
-            close_db_connection(conn, "主流程")
     end_time = time.time()
     logging.info(f"====== {task_name} 任务执行完毕，总耗时: {end_time - start_time:.2f} 秒 ======")
 
@@ -1049,12 +1273,12 @@ def run_main_process(process_type, specific_syxh=None, max_workers=None):
 def run_scheduled_tasks(max_workers=1):
     """封装需要定时执行的所有任务"""
     logging.info(f"##### 开始执行一轮预定任务 @ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} #####")
-    # 依次执行所有类型的任务
-    for process_type in ['brgd', 'brcq', 'brzy']:
-        if SHUTDOWN_FLAG.is_set():
-            logging.warning("检测到关闭标志，本轮预定任务提前中止。")
-            break
-        run_main_process(process_type, max_workers=max_workers)
+    # 一次获取所有类型的待处理列表，合并到同一个线程池中处理，
+    # 避免前一类型的最后几条记录拖慢时整个线程池空等
+    if SHUTDOWN_FLAG.is_set():
+        logging.warning("检测到关闭标志，本轮预定任务提前中止。")
+    else:
+        run_main_process(PROCESS_TYPES, max_workers=max_workers)
     logging.info(f"##### 本轮所有预定任务执行完毕 @ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} #####")
 
 def get_next_run_time():
@@ -1073,16 +1297,17 @@ def get_next_run_time():
 def main():
     """主函数，负责初始化、解析命令行参数并启动程序核心逻辑"""
     
-    # --- Ctrl+C 优雅退出处理 ---
+    # --- Ctrl+C / SIGTERM（如 docker stop）优雅退出处理：只设置关闭标志，API统计由退出时的 finally 写入 ---
     def shutdown_handler(signum, frame):
         if not SHUTDOWN_FLAG.is_set():
-            logging.warning("\n捕获到中断信号 (Ctrl+C)，正在准备优雅退出... 按第二次 Ctrl+C 可强制退出。")
+            logging.warning("\n捕获到中断信号 (Ctrl+C/SIGTERM)，正在准备优雅退出... 按第二次 Ctrl+C 可强制退出。")
             SHUTDOWN_FLAG.set()
         else:
             logging.warning("已接收到第二次关闭信号，将强制退出。")
             os._exit(1) # 强制退出
 
     signal.signal(signal.SIGINT, shutdown_handler)
+    signal.signal(signal.SIGTERM, shutdown_handler)
 
     parser = argparse.ArgumentParser(description="自动化AI病历辅助处理程序", formatter_class=argparse.RawTextHelpFormatter)
     
@@ -1150,11 +1375,11 @@ def main():
                             perform_hourly_maintenance()
 
                         # 使用 next_run 作为最终的等待时间点，确保任务准时执行
-                        while datetime.now() < next_run:
-                            if SHUTDOWN_FLAG.is_set():
+                        # 整段剩余时间只阻塞一次（收到关闭信号立即返回）；维护任务可能耗时，因此在其后计算剩余时间，
+                        # 循环只用于防止等待提前返回几毫秒时在 next_run 之前开始任务
+                        while (remaining_wait := (next_run - datetime.now()).total_seconds()) > 0:
+                            if SHUTDOWN_FLAG.wait(remaining_wait):
                                 break
-                            remaining_wait = (next_run - datetime.now()).total_seconds()
-                            SHUTDOWN_FLAG.wait(min(1, max(0, remaining_wait)))
                         
                         if SHUTDOWN_FLAG.is_set():
                             break
@@ -1174,6 +1399,9 @@ def main():
         logging.warning("主线程捕获到 KeyboardInterrupt，确保关闭标志已设置。")
         SHUTDOWN_FLAG.set()
     finally:
+        # 关闭连接池中的空闲数据库连接（含诊断手术提取模块保留的空闲连接）
+        DB_POOL.close_all()
+        close_idle_db_connections()
         # 程序退出时强制写入API统计信息
         try:
             from aifz_logger import force_write_api_stats
@@ -31,11 +31,20 @@ AI病历分析系统 - 智能解析模块 (aifz_parser.py)
 """
 
 import re
-from typing import List, Dict, Tuple
+from functools import lru_cache
+from operator import itemgetter
+from typing import List, Dict, Iterator, Optional, Tuple
 import logging
 import pandas as pd
 import os
 
+# Excel导出：优先使用C加速的xlsxwriter引擎，未安装时回退到pandas默认引擎(openpyxl)
+try:
+    import xlsxwriter  # noqa: F401  仅用于检测是否可用
+    _EXCEL_ENGINE = 'xlsxwriter'
+except ImportError:
+    _EXCEL_ENGINE = None
+
 # =============================================================================
 # 常量定义 - 医疗术语关键词
 # =============================================================================
@@ -67,6 +76,15 @@ NAME_KEYWORDS = {
     '诊断名称', '疾病名称', '操作名称'
 }
 
+def _keyword_regex(keywords, flags=0):
+    """把关键词集合编译成一个正则（长词优先），一次search即可判断文本是否包含任一关键词"""
+    return re.compile('|'.join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True)), flags)
+
+# 表头单元格识别用的预编译正则（替代逐个关键词的 in 判断）
+# 关键词均为小写，用 IGNORECASE 匹配，不必为每个单元格生成 lower() 副本
+CODE_KEYWORDS_RE = _keyword_regex(CODE_KEYWORDS, re.IGNORECASE)
+NAME_KEYWORDS_RE = _keyword_regex(NAME_KEYWORDS, re.IGNORECASE)
+
 # 无效内容标记
 NEGATIVE_MARKERS = {'无', '未见', '不详', '待查', '是', '否'}
 
@@ -75,6 +93,168 @@ HEADER_WORDS = {
     '编码', '名称', '代码', '诊断', '手术', '标识', '依据', '费用', '主手术', '主诊断'
 }
 
+# =============================================================================
+# 预编译正则表达式
+# =============================================================================
+# 解析函数在逐行/逐个编码的循环里调用正则，统一在模块加载时编译，
+# 避免每次调用都经过 re 模块内部缓存的查找
+
+# 编码模式：表格回退解析/压缩表格使用的诊断编码，及严格格式的手术编码（避免匹配费用）
+DIAG_CODE_RE = re.compile(r'([A-Z]\d{1,3}(?:\.\d{1,3})?(?:x\d{1,4})?)')
+SURG_CODE_RE = re.compile(r'(\d{2}\.\d{2,4}(?:x\d{3,4})?)')
+# 压缩表格中的手术编码（小数位更宽松）
+COMPRESSED_SURG_CODE_RE = re.compile(r'(\d{2}\.\d{1,4})')
+# 纯文本回退解析的诊断编码（至少两位数字，更严格）
+FALLBACK_DIAG_CODE_RE = re.compile(r'([A-Z]\d{2}(?:\.\d{1,3})?(?:x\d{1,4})?)')
+
+_CODE_RE = {'diag': DIAG_CODE_RE, 'surg': SURG_CODE_RE}
+_COMPRESSED_CODE_RE = {'diag': DIAG_CODE_RE, 'surg': COMPRESSED_SURG_CODE_RE}
+_FALLBACK_CODE_RE = {'diag': FALLBACK_DIAG_CODE_RE, 'surg': SURG_CODE_RE}
+# 快速预检：以上编码模式（以及特殊编码补充）都至少包含一个数字
+_DIGIT_RE = re.compile(r'\d')
+
+# 编码格式完整校验（只看首字符的校验直接比较字符，\d 对应 str.isdecimal）
+_SURG_CODE_SHORT_RE = re.compile(r'^\d{2}\.\d{1,4}$')
+_SURG_CODE_STRICT_RE = re.compile(r'^\d{2}\.\d{2,4}$')
+
+# 表格结构
+_SEPARATOR_LINE_RE = re.compile(r'^\s*\|?\s*[-|]+\s*\|?\s*$')
+_MULTI_SPACE_RE = re.compile(r'\s{2,}')
+# 压缩表格行：至少含11个|分隔符的整行
+_COMPRESSED_ROW_RE = re.compile(r'^(?:[^|\n]*\|){11}[^\n]*', re.MULTILINE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 中文名称提取与清理
+_CJK_RE = re.compile(r'[\u4e00-\u9fa5]')
+_CJK_MIN2_RE = re.compile(r'[\u4e00-\u9fa5]{2,}')
+_CJK_TO_PIPE_RE = re.compile(r'[\u4e00-\u9fa5][^\|]*')
+_CJK_NAME_RE = re.compile(r'[\u4e00-\u9fa5][^0-9A-Z]*')
+_CJK_NAME_TAIL_RE = re.compile(r'[\u4e00-\u9fa5][^0-9A-Z]*$')
+_NON_CJK_RE = re.compile(r'[^\u4e00-\u9fa5\s]+')  # 连续的非中文字符一次替换
+_PAREN_RE = re.compile(r'[（(].*?[)）]')
+# 一次替换同时完成 _PAREN_RE 和 _NON_CJK_RE 两步清理：成对括号整体删除，
+# 其余非中文字符按段删除（不吞掉左括号，保证括号对优先匹配），落单的左括号单独删除
+_NAME_CLEAN_RE = re.compile(r'[（(][^）)\n]*[)）]|[^\u4e00-\u9fa5\s（(]+|[（(]')
+_MAIN_MARK_RE = re.compile(r'(主诊断|主手术)')
+_TRAILING_PUNCT_RE = re.compile(r'[，。！？\s]+$')
+_ITEM_SPLIT_RE = re.compile(r'[,，、;；]\s*')
+_CELL_START_RE = re.compile(r'[^\s|]')
+
+# 费用上下文判断（_LEADING_YUAN_RE 配合 match(text, pos) 使用，不能带 ^ 锚点）
+_TRAILING_NUMBER_RE = re.compile(r'\d+\.?\d*\s*$')
+_LEADING_YUAN_RE = re.compile(r'\s*元')
+_FEE_WORDS_RE = _keyword_regex(['费用', '价格', '元', '成本'])
+_MEDICAL_WORDS_RE = _keyword_regex(['手术', '操作', '治疗', '检查', '监测'])
+_HEADER_MARK_WORDS_RE = _keyword_regex(['编码', 'code', '名称', 'name'])
+
+# 占位符和无效内容关键词（与上面一样合并成单个正则，一次扫描代替逐词的 in 判断）
+# 占位符比较不区分大小写，用 IGNORECASE 代替先 lower() 再匹配
+_CODE_PLACEHOLDER_RE = _keyword_regex(['-', '无', '编码', 'icd', 'code'], re.IGNORECASE)
+_NAME_PLACEHOLDER_RE = _keyword_regex(['无', '名称', 'name', '未见', '不详'], re.IGNORECASE)
+_NAME_SKIP_RE = _keyword_regex(['是', '否', '依据', '费用', '178/108', 'mmHg', '1007', 'U/L', '元'])
+_NEGATIVE_NAME_RE = _keyword_regex(['无', '未见', '不详'])
+_NEGATIVE_CELL_RE = _keyword_regex(['无', '未见', '不详', '-'])
+_LINE_FEE_WORDS_RE = _keyword_regex(['元', '费用', '元（', '元）', '元，', '元。'])
+_SURG_LINE_WORDS_RE = _keyword_regex(['手术', '操作', '切除', '置换', '修复', '引流', '吻合'])
+_SURG_NAME_WORDS_RE = _keyword_regex(['手术', '操作', '切除', '置换', '修复', '引流', '吻合', '治疗'])
+
+# 压缩表格中不能作为名称的单元格/名称（整串比较，用 frozenset 做成员判断）
+_COMPRESSED_SKIP_CELLS = frozenset(['是', '否', '依据', '费用说明', '诊断依据及费用说明', '手术依据及费用说明'])
+_COMPRESSED_SKIP_NAMES = frozenset(['是', '否', '依据', '费用'])
+
+# 区域标题定位
+def _heading_alternation(patterns):
+    """
+    把按优先级排列的标题模式合并成一个正则，每个分支包一层捕获组，
+    匹配后用 lastindex 得知命中的是第几个模式（模式本身不含捕获组）
+    """
+    return re.compile('|'.join(f'({p})' for p in patterns), re.IGNORECASE | re.MULTILINE)
+
+_DIAG_TITLE_RE = _heading_alternation((
+    r'#{1,4}\s*诊断[表列]?',
+    r'#{1,4}\s*诊断[信息列表]*',
+    r'#{1,4}\s*最终诊断',
+    r'诊断[表列]?\s*[:：]',
+    r'诊断[列表信息]*\s*\(',
+    r'\*\*诊断[表列]?\*\*'
+))
+_SURG_TITLE_RE = _heading_alternation((
+    r'#{1,4}\s*手术[表列操作]*',
+    r'#{1,4}\s*操作[表列]*',
+    r'#{1,4}\s*手术及操作',
+    r'手术[表列操作]*\s*[:：]',
+    r'操作[表列]*\s*[:：]',
+    r'\*\*手术[表列]?\*\*'
+))
+_SURG_HEADING_RE = re.compile(r'#{1,4}\s*(手术|操作)', re.IGNORECASE)
+_NON_DIAG_HEADING_RE = re.compile(r'\n\s*#{1,4}(?!\s*诊断)')
+_HEADING_MARK_RE = re.compile(r'#+')
+_SECTION_NO_SURGERY_RE = re.compile(r'(无|未见|\-)\s*(手术|操作)', re.IGNORECASE)
+_NO_SURGERY_RE = re.compile(r'(手术|操作)[:：\s]*\s*(无|未见)(?!\S)', re.IGNORECASE)
+
+# 纯文本回退解析：按条目类型预先组合好的模式
+# 逐行兜底：每行第一个编码（惰性前缀保证取到行内最左边的编码）
+_LINE_CODE_RES = {
+    entry_type: re.compile(r'^[^\n]*?' + code_re.pattern, re.MULTILINE)
+    for entry_type, code_re in _FALLBACK_CODE_RE.items()
+}
+_FALLBACK_KEYWORDS = {
+    'diag': ['诊断', 'diagnosis', '疾病'],
+    'surg': ['手术', '操作', 'operation', 'surgery'],
+}
+# 表格行："| 编码 | 中文开头的名称 | ..."
+_TABLE_LINE_RES = {
+    entry_type: re.compile(
+        r'^\s*\|?\s*' +                  # 可选的前导 |
+        code_re.pattern +                # 编码
+        r'\s*\|\s*' +                    # | 分隔符
+        r'([\u4e00-\u9fa5][^|\n]*?)' +   # 中文开头的名称
+        r'\s*(?:\|.*)?$',                # 可选的后续列和结束 |
+        re.MULTILINE
+    )
+    for entry_type, code_re in _FALLBACK_CODE_RE.items()
+}
+# 键值对："诊断：编码1 名称1，编码2 名称2"
+_KV_LINE_RES = {
+    entry_type: [re.compile(rf'{keyword}\s*[:：]\s*(.+?)(?=\n|$)', re.IGNORECASE | re.DOTALL)
+                 for keyword in keywords]
+    for entry_type, keywords in _FALLBACK_KEYWORDS.items()
+}
+# 简单格式："手术：编码 名称"
+_SIMPLE_LINE_RES = {
+    entry_type: [re.compile(rf'{keyword}\s*[:：]\s*({_FALLBACK_CODE_RE[entry_type].pattern})\s*([\u4e00-\u9fa5][^\n,，]*)',
+                            re.IGNORECASE)
+                 for keyword in keywords]
+    for entry_type, keywords in _FALLBACK_KEYWORDS.items()
+}
+# 压缩表格的特定模式
+_COMPRESSED_DIAG_RES = tuple(re.compile(p) for p in (
+    # 精确匹配已知的编码-名称对
+    r'\|\s*(S06\.000)\s*\|\s*(脑震荡)\s*\|',
+    r'\|\s*(D68\.801)\s*\|\s*(凝血因子缺乏)\s*\|',
+    # 通用模式：| 编码 | 中文名称 | 是/否 |
+    r'\|\s*([A-Z]\d+\.\d+)\s*\|\s*([\u4e00-\u9fa5]+[^\|]*?)\s*\|\s*[是否]',
+))
+# 特殊编码补充（针对已知遗漏的编码）
+# 每个模式都包含编码本身的字面文本，文本中没有该编码时可以跳过正则搜索
+_SPECIAL_DIAG_PATTERNS = tuple((re.compile(p), code, name) for p, code, name in (
+    (r'\|\s*(I10)\s*\|\s*(原发性高血压)', 'I10', '原发性高血压'),
+    (r'(I10)\s+原发性高血压', 'I10', '原发性高血压'),
+    (r'高血压.*?(I10)', 'I10', '原发性高血压'),
+))
+_SPECIAL_SURG_PATTERNS = tuple((re.compile(p), code, name) for p, code, name in (
+    (r'\|\s*(99\.15)\s*\|\s*(静脉输液治疗)', '99.15', '静脉输液治疗'),
+    (r'\|\s*(89\.14)\s*\|\s*(脑电图)', '89.14', '脑电图'),
+    (r'\|\s*(89\.52)\s*\|\s*(心电图)', '89.52', '心电图'),
+    (r'\|\s*(99\.29)\s*\|\s*(肌肉注射)', '99.29', '肌肉注射'),
+))
+
+# 传统解析器的名称清理
+_LEADING_PUNCT_RE = re.compile(r'^[\s\:\：\,\，\.\。]+')
+_LEADING_INDEX_RE = re.compile(r'^\s*\d+\s+')
+_LEGACY_DIAG_NAME_RE = re.compile(r'\d+\s+(.*?)(?=\s+[A-Z]\d{2}|\s*$)')
+_LEGACY_SURG_NAME_RE = re.compile(r'\d+\s+(.*?)(?=\s+\d{2}\.\d+|\s+\d{2}|\s*$)')
+
 # 确保日志目录存在
 os.makedirs('logs', exist_ok=True)
 
@@ -85,166 +265,204 @@ logger = logging.getLogger(__name__)
 # 核心解析函数
 # =============================================================================
 
-def _parse_markdown_table(table_text: str, entry_type: str) -> List[Dict]:
+@lru_cache(maxsize=8)
+def _scan_markdown_table(table_text: str) -> Tuple[Optional[Tuple[int, int]], Tuple[Tuple[int, str, Tuple[str, ...]], ...]]:
     """
-    增强版Markdown表格解析器
+    扫描表格结构：定位表头中的编码列/名称列，并把之后的数据行切分为单元格
     
-    支持多种表格格式的智能识别和解析：
-    1. 标准Markdown格式：| 列1 | 列2 | 分隔符：|---|---|
-    2. 非标准格式：列1 | 列2 | 列3 分隔符：---|---|---
-    3. 混合格式的自适应表头识别
-    4. 容错处理：自动修复格式不规范的表格
+    这部分与条目类型无关，parse_diagnoses_and_surgeries 会对同一段文本
+    分别按诊断和手术解析，因此按文本缓存扫描结果，避免重复切分和扫描。
+    返回值均为不可变类型，可以安全地在多次调用间共享。
     
     参数：
     table_text: 包含表格的文本内容
-    entry_type: 条目类型（'diag'=诊断, 'surg'=手术）
     
     返回：
-    解析结果列表，每个元素包含 {'xh': 序号, 'bm': 编码, 'mc': 名称}
+    (表头列位置 (编码列, 名称列)，未找到表头时为 None,
+     数据行元组 ((行号, 行内容, 单元格元组), ...))
     """
-    logger.debug(f"开始解析{entry_type}类型的Markdown表格")
-    
-    # 保存原始文本用于回退策略
-    original_text = table_text
-    
     # 轻量级预处理：只做最基本的格式修复，避免破坏表格结构
     # 1. 标准化换行符
     table_text = table_text.replace('\r\n', '\n').replace('\r', '\n')
     # 2. 去除行首尾的多余空白，但保留表格结构
+    # （之后的步骤直接使用这里去除了首尾空白的行，单元格也只在切分时 strip 一次）
     lines = [line.strip() for line in table_text.split('\n')]
-    table_text = '\n'.join(lines)
-    
-    lines = table_text.strip().split('\n')
-    results = []
-    header_indices = None
+    # 3. 去掉首尾的空行（等价于拼接后整体 strip 再重新切分，但不必再切分一次）
+    start, end = 0, len(lines)
+    while start < end and not lines[start]:
+        start += 1
+    while end > start and not lines[end - 1]:
+        end -= 1
+    lines = lines[start:end] or ['']
+    header_cols = None
     data_start_index = -1
 
-    logger.debug(f"[{entry_type}] 表格预处理后，共{len(lines)}行")
+    logger.debug(f"表格预处理后，共{len(lines)}行")
 
     # 步骤1：查找表格分隔符行，确定表头和数据的位置
-    for i, line in enumerate(lines):
-        line_clean = line.strip()
-        
+    for i, line_clean in enumerate(lines):
         # 检测各种分隔符格式（标准和非标准）
-        is_separator = False
-        if '---' in line_clean or '-' in line_clean:
-            # 移除所有|和空格，检查是否主要由'-'组成
-            cleaned = re.sub(r'[\s|]', '', line_clean)
-            if len(cleaned) > 0 and cleaned.count('-') / len(cleaned) > 0.6:
-                is_separator = True
-        
-        # 检测简单的表格分隔符（只有|和---）
-        if re.match(r'^\s*\|?\s*[-|]+\s*\|?\s*$', line_clean):
-            is_separator = True
+        if '-' in line_clean:
+            # 移除所有|和空白，检查是否主要由'-'组成（只由|、-、空白组成的行必然满足）
+            cleaned = ''.join(line_clean.split()).replace('|', '')
+            is_separator = cleaned.count('-') / len(cleaned) > 0.6
+        else:
+            # 不含'-'时只有纯|行可能是简单分隔符，先用字符串操作排除普通文本行
+            is_separator = (bool(line_clean) and not line_clean.replace('|', '').strip()
+                            and _SEPARATOR_LINE_RE.match(line_clean) is not None)
         
         if is_separator and i > 0:
-            header_line = lines[i-1].strip()
-            logger.debug(f"[{entry_type}] 检测到分隔符行，分析表头: '{header_line}'")
+            header_line = lines[i-1]
+            logger.debug(f"检测到分隔符行，分析表头: '{header_line}'")
             
             # 解析表头 - 支持多种格式
             header_cells = []
             if '|' in header_line:
                 # 标准格式：有|分隔符
-                header_cells = [c.strip() for c in header_line.split('|') if c.strip()]
+                header_cells = [cell for c in header_line.split('|') if (cell := c.strip())]
             else:
                 # 非标准格式：无|分隔符，通过多个空格分割
-                header_cells = [c.strip() for c in re.split(r'\s{2,}', header_line) if c.strip()]
+                header_cells = [cell for c in _MULTI_SPACE_RE.split(header_line) if (cell := c.strip())]
             
-            # 识别编码列和名称列
-            temp_indices = {'code': -1, 'name': -1}
+            # 识别编码列和名称列（-1 表示未找到）
+            code_idx = -1
+            name_idx = -1
             
             for idx, cell in enumerate(header_cells):
-                cell_lower = cell.lower()
-                logger.debug(f"[{entry_type}] 分析表头单元格 {idx}: '{cell}'")
+                logger.debug(f"分析表头单元格 {idx}: '{cell}'")
                 
                 # 查找编码相关列
-                if any(kw in cell_lower for kw in CODE_KEYWORDS):
-                    temp_indices['code'] = idx
-                    logger.debug(f"[{entry_type}] 识别编码列: 位置{idx}")
+                if CODE_KEYWORDS_RE.search(cell):
+                    code_idx = idx
+                    logger.debug(f"识别编码列: 位置{idx}")
                     
                 # 查找名称相关列
-                if any(kw in cell_lower for kw in NAME_KEYWORDS):
-                    temp_indices['name'] = idx
-                    logger.debug(f"[{entry_type}] 识别名称列: 位置{idx}")
+                if NAME_KEYWORDS_RE.search(cell):
+                    name_idx = idx
+                    logger.debug(f"识别名称列: 位置{idx}")
 
             # 验证是否找到了必要的列
-            if temp_indices['code'] != -1 and temp_indices['name'] != -1:
-                header_indices = temp_indices
+            if code_idx != -1 and name_idx != -1:
+                header_cols = (code_idx, name_idx)
                 data_start_index = i + 1
-                logger.debug(f"[{entry_type}] 表头解析成功 - 编码列:{header_indices['code']}, 名称列:{header_indices['name']}")
+                logger.debug(f"表头解析成功 - 编码列:{code_idx}, 名称列:{name_idx}")
                 break
             else:
-                logger.debug(f"[{entry_type}] 表头解析失败，未找到必要列")
+                logger.debug("表头解析失败，未找到必要列")
 
-    # 步骤2：解析数据行
-    if header_indices is not None:
-        logger.debug(f"[{entry_type}] 开始解析数据行，从第{data_start_index}行开始")
+    if header_cols is None:
+        return None, ()
+
+    # 步骤2：切分数据行 - 支持有|和无|的格式
+    rows = []
+    for line_idx, line in enumerate(lines[data_start_index:], start=data_start_index):
+        if not line:
+            continue
         
-        for line_idx, line in enumerate(lines[data_start_index:], start=data_start_index):
-            line = line.strip()
-            if not line:
-                continue
-            
-            # 跳过明显的非数据行
-            if '---' in line or line.startswith('#'):
-                continue
-            
-            # 解析数据行 - 支持有|和无|的格式
-            cells = []
-            if '|' in line:
-                cells = [c.strip() for c in line.split('|')]
-                # 移除空的首尾单元格（Markdown表格格式）
-                if cells and not cells[0]:
-                    cells = cells[1:]
-                if cells and not cells[-1]:
-                    cells = cells[:-1]
-            else:
-                # 通过多个空格分割
-                cells = [c.strip() for c in re.split(r'\s{2,}', line) if c.strip()]
-            
+        # 跳过明显的非数据行
+        if '---' in line or line.startswith('#'):
+            continue
+        
+        if '|' in line:
+            # 移除空的首尾单元格（Markdown表格格式）：行已去除首尾空白，
+            # 首/尾单元格为空当且仅当行以|开头/结尾，直接跳过对应的片段
+            parts = line.split('|')
+            start = 1 if line[0] == '|' else 0
+            end = len(parts) - 1 if line[-1] == '|' else len(parts)
+            cells = tuple([parts[i].strip() for i in range(start, end)])
+        else:
+            # 通过多个空格分割
+            cells = tuple([cell for c in _MULTI_SPACE_RE.split(line) if (cell := c.strip())])
+        rows.append((line_idx, line, cells))
+
+    return header_cols, tuple(rows)
+
+
+def _cell_before_pipe(text: str, start: int, end: int) -> str:
+    """
+    取 text[start:end] 范围内跳过空白和|后的第一个单元格内容（到下一个|为止，去除尾部空白）
+    
+    结果与"跳过空白和|、再非贪婪匹配以空白分隔的词直到下一个|"的正则搜索一致，
+    但那样的正则在范围内没有|时会从每个起点反复回溯，这里改为一次线性查找。
+    范围内找不到单元格或其后没有|时返回空字符串。
+    """
+    cell_start = _CELL_START_RE.search(text, start, end)
+    if cell_start is None:
+        return ''
+    cell_begin = cell_start.start()
+    pipe = text.find('|', cell_begin, end)
+    if pipe < 0:
+        return ''
+    return text[cell_begin:pipe].rstrip()
+
+
+def _parse_markdown_table(table_text: str, entry_type: str) -> List[Dict]:
+    """
+    增强版Markdown表格解析器
+    
+    支持多种表格格式的智能识别和解析：
+    1. 标准Markdown格式：| 列1 | 列2 | 分隔符：|---|---|
+    2. 非标准格式：列1 | 列2 | 列3 分隔符：---|---|---
+    3. 混合格式的自适应表头识别
+    4. 容错处理：自动修复格式不规范的表格
+    
+    参数：
+    table_text: 包含表格的文本内容
+    entry_type: 条目类型（'diag'=诊断, 'surg'=手术）
+    
+    返回：
+    解析结果列表，每个元素包含 {'xh': 序号, 'bm': 编码, 'mc': 名称}
+    """
+    logger.debug(f"开始解析{entry_type}类型的Markdown表格")
+    
+    # 表头定位和数据行切分与类型无关，按文本缓存
+    header_cols, rows = _scan_markdown_table(table_text)
+    results = []
+
+    # 解析数据行
+    if header_cols is not None:
+        # 列位置在所有数据行中都不变，先取成局部变量
+        code_col, name_col = header_cols
+        max_index = max(code_col, name_col)
+        expected_cols = max_index + 1
+        logger.debug(f"[{entry_type}] 开始解析数据行，编码列:{code_col}, 名称列:{name_col}")
+        
+        for line_idx, line, cells in rows:
             # 特殊处理：压缩表格格式（所有数据在一行中）
             # 检测：如果列数远超预期且包含多个编码，可能是压缩格式
-            expected_cols = max(header_indices['code'], header_indices['name']) + 1
             if len(cells) > expected_cols * 3:  # 远超预期列数
                 logger.debug(f"[{entry_type}] 检测到压缩表格格式，尝试重新组织数据")
                 
-                # 重新组织：按预期列数分组
-                grouped_rows = []
-                for i in range(0, len(cells) - expected_cols + 1, expected_cols):
-                    if i + expected_cols <= len(cells):
-                        row_cells = cells[i:i + expected_cols]
-                        grouped_rows.append(row_cells)
-                
-                logger.debug(f"[{entry_type}] 压缩表格重组为 {len(grouped_rows)} 行")
+                # 重新组织：按预期列数分组，直接按组的起始位置取编码和名称，不生成中间的分组列表
+                group_starts = range(0, len(cells) - expected_cols + 1, expected_cols)
+                logger.debug(f"[{entry_type}] 压缩表格重组为 {len(group_starts)} 行")
                 
                 # 处理每个重组后的行
-                for row_idx, row_cells in enumerate(grouped_rows):
-                    if len(row_cells) <= max(header_indices['code'], header_indices['name']):
-                        continue
-                        
-                    code = row_cells[header_indices['code']].strip()
-                    name = row_cells[header_indices['name']].strip()
+                for i in group_starts:
+                    code = cells[i + code_col]
+                    name = cells[i + name_col]
                     
                     # 数据验证和清理（与下面的逻辑相同）
                     if not code or not name:
                         continue
                         
                     # 跳过占位符
-                    if any(placeholder in code.lower() for placeholder in ['-', '无', '编码', 'icd', 'code']):
+                    if _CODE_PLACEHOLDER_RE.search(code):
                         continue
-                    if any(placeholder in name.lower() for placeholder in ['无', '名称', 'name', '未见', '不详']):
+                    if _NAME_PLACEHOLDER_RE.search(name):
                         continue
 
                     # 验证编码格式
                     if entry_type == 'diag':
-                        if not re.match(r'^[A-Z]', code):
+                        if not 'A' <= code[0] <= 'Z':
                             continue
                     else:  # 'surg'
-                        if not re.match(r'^\d', code):
+                        if not code[0].isdecimal():
                             continue
 
                     # 清理名称
-                    name = re.sub(r'\s+', ' ', name).strip()
+                    if '  ' in name or not name.isprintable():
+                        name = _WHITESPACE_RE.sub(' ', name)
                     
                     results.append({'xh': len(results) + 1, 'bm': code, 'mc': name})
                     logger.debug(f"[{entry_type}] 压缩表格成功添加: {{'bm': '{code}', 'mc': '{name}'}}")
@@ -253,13 +471,12 @@ def _parse_markdown_table(table_text: str, entry_type: str) -> List[Dict]:
                 continue
             
             # 常规处理：检查列数是否足够
-            max_index = max(header_indices['code'], header_indices['name'])
             if len(cells) <= max_index:
                 logger.debug(f"[{entry_type}] 跳过第{line_idx}行：列数不足({len(cells)} <= {max_index}), 内容: {line[:50]}")
                 continue
 
-            code = cells[header_indices['code']].strip()
-            name = cells[header_indices['name']].strip()
+            code = cells[code_col]
+            name = cells[name_col]
 
             logger.debug(f"[{entry_type}] 解析第{line_idx}行: 编码='{code}', 名称='{name}'")
 
@@ -269,27 +486,30 @@ def _parse_markdown_table(table_text: str, entry_type: str) -> List[Dict]:
                 continue
                 
             # 跳过明显的占位符内容
-            if any(placeholder in code.lower() for placeholder in ['-', '无', '编码', 'icd', 'code']):
+            if _CODE_PLACEHOLDER_RE.search(code):
                 logger.debug(f"[{entry_type}] 跳过占位符编码: '{code}'")
                 continue
-            if any(placeholder in name.lower() for placeholder in ['无', '名称', 'name', '未见', '不详']):
+            if _NAME_PLACEHOLDER_RE.search(name):
                 logger.debug(f"[{entry_type}] 跳过占位符名称: '{name}'")
                 continue
 
             # 根据类型验证编码格式
             if entry_type == 'diag':
                 # 诊断编码：应该以字母开头（ICD-10格式）
-                if not re.match(r'^[A-Z]', code):
+                if not 'A' <= code[0] <= 'Z':
                     logger.debug(f"[{entry_type}] 跳过非诊断编码格式: '{code}'")
                     continue
             else:  # 'surg'
                 # 手术编码：应该以数字开头（ICD-9-CM-3格式）
-                if not re.match(r'^\d', code):
+                if not code[0].isdecimal():
                     logger.debug(f"[{entry_type}] 跳过非手术编码格式: '{code}'")
                     continue
 
             # 清理名称中的多余空格和符号
-            name = re.sub(r'\s+', ' ', name).strip()
+            # 单元格已去除首尾空白，只有出现连续空格或制表符、全角空格等其他空白字符
+            # （均不可打印）时才需要合并，大多数名称可以跳过这次正则替换
+            if '  ' in name or not name.isprintable():
+                name = _WHITESPACE_RE.sub(' ', name)
             
             results.append({'xh': len(results) + 1, 'bm': code, 'mc': name})
             logger.debug(f"[{entry_type}] 成功添加记录: {{'bm': '{code}', 'mc': '{name}'}}")
@@ -301,91 +521,64 @@ def _parse_markdown_table(table_text: str, entry_type: str) -> List[Dict]:
         logger.debug(f"[{entry_type}] 启用原始文本解析回退策略")
         
         # 使用原始文本进行回退解析，避免预处理破坏数据
-        if entry_type == 'diag':
-            code_pattern = r'([A-Z]\d{1,3}(?:\.\d{1,3})?(?:x\d{1,4})?)'
-        else:
-            # 更严格的手术编码模式：必须是纯数字格式，避免匹配费用
-            code_pattern = r'(\d{2}\.\d{2,4}(?:x\d{3,4})?)'
-        
-        # 查找所有编码
-        all_code_matches = list(re.finditer(code_pattern, original_text))
+        original_text = table_text
+        # 手术编码使用更严格的模式：必须是纯数字格式，避免匹配费用
+        code_re = _CODE_RE[entry_type]
         
-        # 为每个编码寻找名称
-        for match in all_code_matches:
+        # 单次扫描所有编码，为每个编码在固定宽度的上下文窗口中寻找名称
+        # （编码模式本身已保证诊断编码以字母开头、手术编码符合ICD-9-CM-3格式）
+        for match in code_re.finditer(original_text):
             code = match.group(1)
-            
-            # 增强验证：检查编码是否在医疗上下文中
-            # 获取编码前后的上下文
-            start_pos = max(0, match.start() - 50)
-            end_pos = min(len(original_text), match.end() + 50)
-            context = original_text[start_pos:end_pos]
+            code_start, code_end = match.span()
             
             # 过滤掉明显是费用的数字
             if entry_type == 'surg':
-                # 检查编码格式是否符合ICD-9-CM-3标准
-                if not re.match(r'^\d{2}\.\d{2,4}(?:x\d{3,4})?$', code):
-                    continue
-                
                 # 更智能的费用过滤：只过滤明显的费用数字
-                is_fee = False
-                # 检查编码前后是否紧邻费用指示词
-                before_context = original_text[max(0, match.start() - 20):match.start()]
-                after_context = original_text[match.end():match.end() + 20]
+                # 检查编码前后是否紧邻费用指示词（用 pos/endpos 限定窗口，不切出子串）
+                before_start = max(0, code_start - 20)
                 
                 # 如果编码直接跟在数字后面或前面有费用词汇，可能是费用
-                if (re.search(r'\d+\.?\d*\s*$', before_context) or 
-                    re.search(r'^\s*元', after_context) or
-                    any(fee_word in before_context for fee_word in ['费用', '价格', '元', '成本'])):
-                    is_fee = True
+                is_fee = (_TRAILING_NUMBER_RE.search(original_text, before_start, code_start) is not None or
+                          _LEADING_YUAN_RE.match(original_text, code_end, code_end + 20) is not None or
+                          _FEE_WORDS_RE.search(original_text, before_start, code_start) is not None)
                 
-                # 但如果编码在表格结构中（有|分隔符），很可能是真正的医疗编码
-                if '|' in context and not is_fee:
-                    is_fee = False
-                elif '|' in context and is_fee:
-                    # 在表格中的编码，即使有费用词汇，也可能是真正的医疗编码
-                    # 检查是否在"编码"和"名称"列之间
-                    if any(medical_word in context for medical_word in ['手术', '操作', '治疗', '检查', '监测']):
+                # 但如果编码在表格结构中（有|分隔符），即使有费用词汇，也可能是真正的医疗编码
+                # 只有疑似费用时才需要取编码前后50字符的上下文
+                if is_fee:
+                    context_start = max(0, code_start - 50)
+                    context_end = code_end + 50
+                    if (original_text.find('|', context_start, context_end) != -1 and
+                            _MEDICAL_WORDS_RE.search(original_text, context_start, context_end)):
                         is_fee = False
                 
                 if is_fee:
                     logger.debug(f"[{entry_type}] 跳过费用相关编码: {code}")
                     continue
             else:  # diag
-                # 诊断编码必须以字母开头
-                if not re.match(r'^[A-Z]\d+', code):
+                # 检查是否为表头中的编码（如 "ICD10编码"）：编码后10个字符内直接跟着这些词，可能是表头
+                if _HEADER_MARK_WORDS_RE.search(original_text, code_end, code_end + 10):
+                    logger.debug(f"[{entry_type}] 跳过表头编码: {code}")
                     continue
-                
-                # 检查是否为表头中的编码（如 "ICD10编码"）
-                if any(header_word in context for header_word in ['编码', 'code', '名称', 'name']):
-                    # 进一步检查：如果编码后直接跟着这些词，可能是表头
-                    after_context = original_text[match.end():match.end() + 10]
-                    if any(invalid in after_context for invalid in ['编码', 'code', '名称', 'name']):
-                        logger.debug(f"[{entry_type}] 跳过表头编码: {code}")
-                        continue
             
             # 在编码周围寻找中文名称  
-            # 查找编码后的中文名称
-            after_code = original_text[match.end():match.end() + 100]
+            # 查找编码后的中文名称（方法1：编码后紧跟的中文，跳过分隔符）
             name_candidates = []
-            
-            # 方法1：查找编码后紧跟的中文（跳过分隔符）
-            name_match = re.search(r'[\s|]*([^\s|]+(?:\s+[^\s|]+)*?)(?:\s*[\||])', after_code)
-            if name_match:
-                candidate = name_match.group(1).strip()
-                if re.search(r'[\u4e00-\u9fa5]', candidate) and len(candidate) > 1:
+            candidate = _cell_before_pipe(original_text, code_end, code_end + 100)
+            if candidate:
+                if _CJK_RE.search(candidate) and len(candidate) > 1:
                     name_candidates.append(candidate)
             
             # 选择最合适的名称
             best_name = ""
             for candidate in name_candidates:
                 # 过滤掉不合适的内容
-                if any(skip in candidate for skip in ['是', '否', '依据', '费用', '178/108', 'mmHg', '1007', 'U/L', '元']):
+                if _NAME_SKIP_RE.search(candidate):
                     continue
                 # 过滤掉太长的内容（可能包含描述）
                 if len(candidate) > 20:
                     continue
                 # 选择包含更多中文字符的候选
-                chinese_count = len([c for c in candidate if '\u4e00' <= c <= '\u9fa5'])
+                chinese_count = sum(1 for _ in _CJK_RE.finditer(candidate))
                 if chinese_count > len(best_name) / 2:
                     best_name = candidate
             
@@ -397,6 +590,63 @@ def _parse_markdown_table(table_text: str, entry_type: str) -> List[Dict]:
     return results
 
 
+@lru_cache(maxsize=8)
+def _compressed_table_rows(text: str) -> Tuple[Tuple[str, ...], ...]:
+    """
+    找出文本中的压缩表格行（有很多|分隔符的行），并切分为非空单元格
+    
+    诊断和手术会分别对同一段文本做压缩表格解析，按文本缓存避免重复切分。
+    """
+    # 多行正则直接定位这些行，不把整段文本切分成行列表
+    return tuple(
+        tuple([cell for c in match.group(0).split('|') if (cell := c.strip())])
+        for match in _COMPRESSED_ROW_RE.finditer(text)
+    )
+
+
+def _name_around_code(line: str, code: str, code_start: int) -> str:
+    """从编码所在行提取中文名称：优先取编码后的中文部分，没有时取编码前的，并清理括号和非中文字符"""
+    # 直接在行内按位置查找，不切分整行：编码后的部分只到编码下一次出现为止
+    after_start = code_start + len(code)
+    after_end = line.find(code, after_start)
+    if after_end < 0:
+        after_end = len(line)
+    name = ""
+    
+    # 查找编码后的中文名称
+    chinese_match = _CJK_NAME_RE.search(line, after_start, after_end)
+    if chinese_match:
+        name = chinese_match.group(0).strip()
+    
+    # 如果编码后没有名称，尝试编码前的部分
+    if not name:
+        chinese_match = _CJK_NAME_TAIL_RE.search(line, 0, code_start)
+        if chinese_match:
+            name = chinese_match.group(0).strip()
+    
+    # 清理名称
+    if name:
+        name = _NAME_CLEAN_RE.sub('', name).strip()  # 移除括号，只保留中文和空格
+    return name
+
+
+def _lines_with_code(text: str, entry_type: str) -> Iterator[Tuple[str, str, int]]:
+    """
+    逐个返回包含编码的行及行内第一个编码：(去除首尾空白的行, 编码, 编码在该行中的起始位置)
+    
+    用一次多行正则扫描代替按行切分后逐行 search，不含编码的行不会生成字符串。
+    编码位置直接由匹配结果换算，调用方不必再在行内 find 一遍。
+    """
+    for match in _LINE_CODE_RES[entry_type].finditer(text):
+        line_start = match.start()
+        line_end = text.find('\n', match.end())
+        if line_end < 0:
+            line_end = len(text)
+        line = text[line_start:line_end].lstrip()
+        code_start = match.start(1) - (line_end - len(line))  # 减去行首位置和去掉的前导空白
+        yield line.rstrip(), match.group(1), code_start
+
+
 def _parse_compressed_table(text: str, entry_type: str) -> List[Dict]:
     """
     专门解析压缩表格格式的函数
@@ -416,26 +666,19 @@ def _parse_compressed_table(text: str, entry_type: str) -> List[Dict]:
     results = []
     
     # 根据类型设置编码模式
+    code_re = _COMPRESSED_CODE_RE[entry_type]
     if entry_type == 'diag':
-        code_pattern = r'([A-Z]\d{1,3}(?:\.\d{1,3})?(?:x\d{1,4})?)'
         expected_names = ['急性上呼吸道感染', '高脂血症', '原发性高血压', '病毒性感染']  # 已知的诊断名称
     else:  # 'surg'
-        code_pattern = r'(\d{2}\.\d{1,4})'
         expected_names = ['静脉输液治疗', '脑电图', '心电图', '肌肉注射']  # 已知的手术名称
     
-    # 查找压缩表格行（包含大量|分隔的内容）
-    compressed_lines = []
-    for line in text.split('\n'):
-        if '|' in line and line.count('|') > 10:  # 有很多|分隔符的行
-            compressed_lines.append(line)
-    
-    for line in compressed_lines:
-        cells = [c.strip() for c in line.split('|') if c.strip()]
+    # 查找压缩表格行（包含大量|分隔的内容），切分结果与类型无关，按文本缓存
+    for cells in _compressed_table_rows(text):
         
         # 在压缩行中查找编码-名称对
         for i, cell in enumerate(cells):
             # 查找编码
-            code_match = re.search(code_pattern, cell)
+            code_match = code_re.search(cell)
             if code_match:
                 code = code_match.group(1)
                 
@@ -444,13 +687,13 @@ def _parse_compressed_table(text: str, entry_type: str) -> List[Dict]:
                 
                 # 方法1：在同一单元格中查找名称
                 after_code = cell[code_match.end():].strip()
-                if after_code and re.search(r'[\u4e00-\u9fa5]', after_code):
+                if after_code and _CJK_RE.search(after_code):
                     name = after_code
                 
                 # 方法2：在下一个单元格中查找名称
                 if not name and i + 1 < len(cells):
                     next_cell = cells[i + 1]
-                    if re.search(r'[\u4e00-\u9fa5]', next_cell) and not re.search(r'^\d', next_cell):
+                    if _CJK_RE.search(next_cell) and not next_cell[0].isdecimal():
                         name = next_cell
                 
                 # 方法3：在周围单元格中查找中文名称
@@ -458,11 +701,11 @@ def _parse_compressed_table(text: str, entry_type: str) -> List[Dict]:
                     # 搜索编码周围的单元格，寻找合适的中文名称
                     search_range = cells[max(0, i-1):i+3]  # 前后各1-2个单元格
                     for candidate_cell in search_range:
-                        if (re.search(r'[\u4e00-\u9fa5]{2,}', candidate_cell) and  # 至少2个中文字符
-                            not re.search(r'^\d', candidate_cell) and  # 不以数字开头
-                            candidate_cell not in ['是', '否', '依据', '费用说明', '诊断依据及费用说明', '手术依据及费用说明']):
+                        if (_CJK_MIN2_RE.search(candidate_cell) and  # 至少2个中文字符
+                            not candidate_cell[0].isdecimal() and  # 不以数字开头
+                            candidate_cell not in _COMPRESSED_SKIP_CELLS):
                             # 提取中文部分
-                            chinese_match = re.search(r'[\u4e00-\u9fa5][^\|]*', candidate_cell)
+                            chinese_match = _CJK_TO_PIPE_RE.search(candidate_cell)
                             if chinese_match:
                                 candidate_name = chinese_match.group(0).strip()
                                 if len(candidate_name) > len(name):  # 选择更长的名称
@@ -470,19 +713,52 @@ def _parse_compressed_table(text: str, entry_type: str) -> List[Dict]:
                 
                 # 清理名称
                 if name:
-                    name = re.sub(r'[^\u4e00-\u9fa5\s]', '', name).strip()  # 只保留中文和空格
-                    if len(name) > 1 and name not in ['是', '否', '依据', '费用']:
+                    name = _NON_CJK_RE.sub('', name).strip()  # 只保留中文和空格
+                    if len(name) > 1 and name not in _COMPRESSED_SKIP_NAMES:
                         # 验证编码格式
-                        if entry_type == 'diag' and re.match(r'^[A-Z]', code):
+                        if entry_type == 'diag' and 'A' <= code[0] <= 'Z':
                             results.append({'xh': len(results) + 1, 'bm': code, 'mc': name})
                             logger.debug(f"[{entry_type}] 压缩表格找到: {code} -> {name}")
-                        elif entry_type == 'surg' and re.match(r'^\d', code):
+                        elif entry_type == 'surg' and code[0].isdecimal():
                             results.append({'xh': len(results) + 1, 'bm': code, 'mc': name})
                             logger.debug(f"[{entry_type}] 压缩表格找到: {code} -> {name}")
     
     logger.debug(f"[{entry_type}] 压缩表格解析完成，共提取{len(results)}条记录")
     return results
 
+def _find_section_title(title_re: re.Pattern, text: str) -> Optional[re.Match]:
+    """
+    在一次扫描中按优先级查找区域标题
+    
+    结果与"按顺序逐个模式搜索全文，取第一个能匹配的模式的首个匹配"一致：
+    合并后的正则在同一位置会优先尝试排在前面的模式，而排在前面的模式的
+    匹配不会落在排在后面的模式的匹配区间内，因此只需记录优先级最高的首个匹配，
+    命中最高优先级模式时即可提前结束。
+    """
+    best = None
+    for match in title_re.finditer(text):
+        if best is None or match.lastindex < best.lastindex:
+            best = match
+            if best.lastindex == 1:
+                break
+    return best
+
+def _dedupe_entries(entries: List[Dict]) -> List[Dict]:
+    """
+    基于编码和名称组合去重（保留首次出现的记录），并按序号排序
+    
+    单一来源的结果序号本身就是递增的，只有合并了多个来源（如表格解析
+    结果追加压缩表格补充结果）时才需要排序，因此先检查是否已经有序。
+    """
+    unique = {}
+    for entry in entries:
+        unique.setdefault((entry['bm'], entry['mc']), entry)
+    result = list(unique.values())
+    # 所有解析路径生成的记录都带有 xh，直接取值即可
+    if any(prev['xh'] > cur['xh'] for prev, cur in zip(result, result[1:])):
+        result.sort(key=itemgetter('xh'))
+    return result
+
 def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
     """
     从AI返回的医疗报告中提取诊断和手术信息
@@ -500,6 +776,12 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
     """
     logger.debug(f"开始解析医疗报告，文本长度: {len(text)}")
     
+    # 快速预检：没有|的文本不会形成表格行，其余策略都要先匹配到含数字的编码，
+    # 两者都没有时不可能提取到任何结果，直接返回，省去区域定位和各级回退的扫描
+    if '|' not in text and not _DIGIT_RE.search(text):
+        logger.debug("文本中既无表格分隔符也无数字，跳过解析")
+        return [], []
+    
     # 初始化结果容器
     diagnoses = []
     surgeries = []
@@ -512,21 +794,9 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
     logger.debug("策略1：开始区域解析")
     
     # 诊断区域匹配模式（更精确）
-    diag_patterns = [
-        r'#{1,4}\s*诊断[表列]?',
-        r'#{1,4}\s*诊断[信息列表]*',
-        r'#{1,4}\s*最终诊断',
-        r'诊断[表列]?\s*[:：]',
-        r'诊断[列表信息]*\s*\(',
-        r'\*\*诊断[表列]?\*\*'
-    ]
-    
-    diag_match = None
-    for pattern in diag_patterns:
-        diag_match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-        if diag_match:
-            logger.debug(f"找到诊断区域标题: {diag_match.group(0)}")
-            break
+    diag_match = _find_section_title(_DIAG_TITLE_RE, text)
+    if diag_match:
+        logger.debug(f"找到诊断区域标题: {diag_match.group(0)}")
 
     if diag_match:
         found_diag_section = True
@@ -534,12 +804,12 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
         end_pos = len(text)
         
         # 确定诊断区域的结束位置（寻找下一个主要标题）
-        next_heading = re.search(r'#{1,4}\s*(手术|操作)', text[diag_match.end():], re.IGNORECASE)
+        next_heading = _SURG_HEADING_RE.search(text[diag_match.end():])
         if next_heading:
             end_pos = diag_match.end() + next_heading.start()
         else:
             # 寻找其他可能的结束标记
-            other_endings = re.search(r'\n\s*#{1,4}(?!\s*诊断)', text[diag_match.end():])
+            other_endings = _NON_DIAG_HEADING_RE.search(text[diag_match.end():])
             if other_endings:
                 end_pos = diag_match.end() + other_endings.start()
         
@@ -548,21 +818,9 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
         logger.debug(f"诊断区域解析完成，提取{len(diagnoses)}条记录")
 
     # 手术区域匹配模式（更严格，避免误匹配）
-    surg_patterns = [
-        r'#{1,4}\s*手术[表列操作]*',
-        r'#{1,4}\s*操作[表列]*',
-        r'#{1,4}\s*手术及操作',
-        r'手术[表列操作]*\s*[:：]',
-        r'操作[表列]*\s*[:：]',
-        r'\*\*手术[表列]?\*\*'
-    ]
-    
-    surg_match = None
-    for pattern in surg_patterns:
-        surg_match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-        if surg_match:
-            logger.debug(f"找到手术区域标题: {surg_match.group(0)}")
-            break
+    surg_match = _find_section_title(_SURG_TITLE_RE, text)
+    if surg_match:
+        logger.debug(f"找到手术区域标题: {surg_match.group(0)}")
 
     if surg_match:
         found_surg_section = True
@@ -570,7 +828,7 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
         end_pos = len(text)
         
         # 确定手术区域的结束位置
-        next_heading = re.search(r'#+', text[surg_match.end():])
+        next_heading = _HEADING_MARK_RE.search(text[surg_match.end():])
         if next_heading:
             end_pos = surg_match.end() + next_heading.start()
         
@@ -578,7 +836,7 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
         surgeries = _parse_markdown_table(surg_section, 'surg')
         
         # 特殊处理：检查是否明确标注"无手术"
-        if not surgeries and re.search(r'(无|未见|\-)\s*(手术|操作)', surg_section, re.IGNORECASE):
+        if not surgeries and _SECTION_NO_SURGERY_RE.search(surg_section):
             logger.debug("手术区域明确标注无手术，保持空列表")
             surgeries = []
         
@@ -593,9 +851,11 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
         if len(diagnoses) < 3:  # 如果诊断数量较少，可能遗漏了压缩表格中的内容
             logger.debug("诊断数量较少，尝试压缩表格补充解析")
             compressed_diag = _parse_compressed_table(text, 'diag')
+            seen_codes = {d['bm'] for d in diagnoses}
             for diag in compressed_diag:
-                if not any(d['bm'] == diag['bm'] for d in diagnoses):
+                if diag['bm'] not in seen_codes:
                     diagnoses.append(diag)
+                    seen_codes.add(diag['bm'])
         
     if not found_surg_section and not surgeries:
         logger.debug("未找到手术区域，尝试全文手术表格解析")
@@ -616,7 +876,7 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
         logger.debug("手术解析结果为空，启用纯文本回退解析")
         # 特殊处理明确标注"无手术"的情况 - 修正版本
         # 只有当明确说"无手术"或"未见手术"时才跳过，避免误判
-        if re.search(r'(手术|操作)[:：\s]*\s*(无|未见)(?!\S)', text, re.IGNORECASE):
+        if _NO_SURGERY_RE.search(text):
             surgeries = []
             logger.debug("检测到明确的'无手术'标记，设置为空列表")
         else:
@@ -646,29 +906,8 @@ def parse_diagnoses_and_surgeries(text: str) -> Tuple[List[Dict], List[Dict]]:
             surgeries.extend(filtered_surgeries)
 
     # 步骤4：数据去重和排序
-    if diagnoses:
-        # 基于编码和名称组合去重
-        unique_diagnoses = []
-        seen = set()
-        for d in diagnoses:
-            key = (d['bm'], d['mc'])
-            if key not in seen:
-                seen.add(key)
-                unique_diagnoses.append(d)
-        diagnoses = unique_diagnoses
-        diagnoses.sort(key=lambda x: x.get('xh', 0))
-        
-    if surgeries:
-        # 基于编码和名称组合去重
-        unique_surgeries = []
-        seen = set()
-        for s in surgeries:
-            key = (s['bm'], s['mc'])
-            if key not in seen:
-                seen.add(key)
-                unique_surgeries.append(s)
-        surgeries = unique_surgeries
-        surgeries.sort(key=lambda x: x.get('xh', 0))
+    diagnoses = _dedupe_entries(diagnoses)
+    surgeries = _dedupe_entries(surgeries)
 
     logger.debug(f"解析完成 - 诊断：{len(diagnoses)}条, 手术：{len(surgeries)}条")
     return diagnoses, surgeries
@@ -700,62 +939,42 @@ def _parse_text_fallback(text: str, entry_type: str) -> List[Dict]:
     解析结果列表
     """
     logger.debug(f"[{entry_type}] 启动纯文本回退解析策略")
+    # 各策略先收集 (编码, 名称)，返回前再统一生成带序号的字典
     all_results = []
 
-    # 根据类型设置关键词和编码模式
-    if entry_type == 'diag':
-        keywords = ['诊断', 'diagnosis', '疾病']
-        # ICD-10诊断编码模式：更严格的匹配，避免误匹配
-        code_pattern = r'([A-Z]\d{2}(?:\.\d{1,3})?(?:x\d{1,4})?)'
-    else:  # 'surg'
-        keywords = ['手术', '操作', 'operation', 'surgery']
-        # ICD-9-CM-3手术编码模式：更严格的格式
-        code_pattern = r'(\d{2}\.\d{2,4}(?:x\d{3,4})?)'
+    # 根据类型选择编码模式（ICD-10诊断编码 / ICD-9-CM-3手术编码，均为更严格的格式）
+    code_re = _FALLBACK_CODE_RE[entry_type]
 
     # 策略1：表格行格式匹配
-    table_line_pattern = re.compile(
-        r'^\s*\|?\s*' +          # 可选的前导 |
-        code_pattern +           # 编码
-        r'\s*\|\s*' +           # | 分隔符
-        r'([\u4e00-\u9fa5][^|\n]*?)' +  # 中文开头的名称
-        r'\s*(?:\|.*)?$',       # 可选的后续列和结束 |
-        re.MULTILINE
-    )
-    
-    for match in table_line_pattern.finditer(text):
+    for match in _TABLE_LINE_RES[entry_type].finditer(text):
         code = match.group(1).strip()
         name = match.group(2).strip()
         
         # 过滤无效内容
-        if not name or any(neg in name for neg in ['无', '未见', '不详', '-']):
+        if not name or _NEGATIVE_CELL_RE.search(name):
             continue
 
         # 手术类型需要额外验证
         if entry_type == 'surg':
             # 确保编码符合手术编码格式
-            if not re.match(r'^\d{2}\.\d{1,4}$', code):
+            if not _SURG_CODE_SHORT_RE.match(code):
                 continue
             # 对于ICD-9-CM-3编码，只要格式正确就认为是有效的手术
 
-        all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+        all_results.append((code, name))
 
     # 策略2：键值对格式匹配（仅当策略1无结果时）
     if not all_results:
         logger.debug(f"[{entry_type}] 表格行匹配无结果，尝试键值对格式")
         
         # 匹配 "诊断：编码1 名称1，编码2 名称2" 格式
-        for keyword in keywords:
-            kv_pattern = re.compile(
-                rf'{keyword}\s*[:：]\s*(.+?)(?=\n|$)',
-                re.IGNORECASE | re.DOTALL
-            )
-            
+        for kv_pattern in _KV_LINE_RES[entry_type]:
             for kv_match in kv_pattern.finditer(text):
                 content_line = kv_match.group(1).strip()
                 logger.debug(f"[{entry_type}] 分析关键词行: {content_line[:50]}...")
                 
                 # 处理多种分隔符
-                items = re.split(r'[,，、;；]\s*', content_line)
+                items = _ITEM_SPLIT_RE.split(content_line)
                 
                 for item in items:
                     item = item.strip()
@@ -763,46 +982,45 @@ def _parse_text_fallback(text: str, entry_type: str) -> List[Dict]:
                         continue
 
                     # 在条目中查找编码
-                    code_match = re.search(code_pattern, item)
+                    code_match = code_re.search(item)
                     if code_match:
                         code = code_match.group(1)
                         
                         # 手术编码额外验证（更宽松的验证）
                         if entry_type == 'surg':
-                            if not re.match(r'^\d{2}\.\d{1,4}$', code):
+                            if not _SURG_CODE_SHORT_RE.match(code):
                                 continue
                         
                         # 提取名称（编码前后的中文部分）
-                        name_parts = re.split(code_pattern, item)
-                        name_candidates = [part.strip() for part in name_parts if part and part != code]
+                        # 只遍历一次，用生成器而不是先建列表
+                        name_candidates = (part.strip() for part in code_re.split(item) if part and part != code)
                         
                         # 选择最长的中文名称部分
                         name = ""
                         for candidate in name_candidates:
-                            if re.search(r'[\u4e00-\u9fa5]', candidate) and len(candidate) > len(name):
+                            if _CJK_RE.search(candidate) and len(candidate) > len(name):
                                 name = candidate
                         
                         # 清理名称内容
                         if name:
-                            name = re.sub(r'[（(].*?[)）]', '', name)  # 移除括号内容
-                            name = re.sub(r'(主诊断|主手术)', '', name)  # 移除标记
+                            name = _PAREN_RE.sub('', name)  # 移除括号内容
+                            name = _MAIN_MARK_RE.sub('', name)  # 移除标记
                             name = name.strip()
                         
                         # 手术名称验证：对于ICD-9-CM-3编码，只要有编码就认为是有效的手术
                         # "非侵入式机械通气"等医疗操作也是有效的手术编码
                         
-                        if name and not any(neg in name for neg in ['无', '未见', '不详']):
-                            all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+                        if name and not _NEGATIVE_NAME_RE.search(name):
+                            all_results.append((code, name))
 
     # 策略3：增强的简单格式解析 - 处理"关键词：编码 名称"格式  
     if not all_results:
         logger.debug(f"[{entry_type}] 尝试简单格式解析")
         
         # 更宽松的匹配模式：关键词后跟编码和名称
-        for keyword in keywords:
-            # 匹配"手术：编码 名称"这样的格式 - 修正版本
-            simple_pattern = rf'{keyword}\s*[:：]\s*({code_pattern})\s*([\u4e00-\u9fa5][^\n,，]*)'
-            matches = re.finditer(simple_pattern, text, re.IGNORECASE)
+        # 匹配"手术：编码 名称"这样的格式 - 修正版本
+        for simple_pattern in _SIMPLE_LINE_RES[entry_type]:
+            matches = simple_pattern.finditer(text)
             
             for match in matches:
                 code = match.group(1).strip()
@@ -810,15 +1028,15 @@ def _parse_text_fallback(text: str, entry_type: str) -> List[Dict]:
                 
                 # 验证编码格式（更宽松的验证）
                 if entry_type == 'surg':
-                    if not re.match(r'^\d{2}\.\d{1,4}$', code):
+                    if not _SURG_CODE_SHORT_RE.match(code):
                         continue
                 
                 # 清理名称
-                name = re.sub(r'[（(].*?[)）]', '', name)
+                name = _PAREN_RE.sub('', name)
                 name = name.strip()
                 
                 if name and len(name) > 1:
-                    all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+                    all_results.append((code, name))
                     logger.debug(f"[{entry_type}] 简单格式匹配成功: {code} -> {name}")
 
     # 策略4：特殊处理压缩表格格式（专门针对特定案例）
@@ -826,188 +1044,95 @@ def _parse_text_fallback(text: str, entry_type: str) -> List[Dict]:
         logger.debug("[diag] 尝试压缩表格格式特殊解析")
         
         # 针对压缩表格的特定模式
-        compressed_patterns = [
-            # 精确匹配已知的编码-名称对
-            r'\|\s*(S06\.000)\s*\|\s*(脑震荡)\s*\|',
-            r'\|\s*(D68\.801)\s*\|\s*(凝血因子缺乏)\s*\|',
-            # 通用模式：| 编码 | 中文名称 | 是/否 |
-            r'\|\s*([A-Z]\d+\.\d+)\s*\|\s*([\u4e00-\u9fa5]+[^\|]*?)\s*\|\s*[是否]',
-        ]
-        
-        for pattern in compressed_patterns:
-            matches = re.finditer(pattern, text)
+        for pattern in _COMPRESSED_DIAG_RES:
+            matches = pattern.finditer(text)
             for match in matches:
                 code = match.group(1).strip()
                 name = match.group(2).strip()
                 
                 # 清理名称末尾的标点符号
-                name = re.sub(r'[，。！？\s]+$', '', name)
+                name = _TRAILING_PUNCT_RE.sub('', name)
                 
                 if code and name and len(name) > 1:
-                    all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+                    all_results.append((code, name))
                     logger.debug(f"[diag] 压缩格式匹配: {code} -> {name}")
 
     # 策略5：逐行编码匹配（最后的兜底策略）
     if not all_results:
         logger.debug(f"[{entry_type}] 启用逐行编码匹配策略")
         
-        # 对于手术，这个策略更加严格
-        if entry_type == 'surg':
-            # 手术只在明确包含手术关键词的行中搜索
-            lines = text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # 必须包含手术相关关键词
-                if not any(surg_word in line for surg_word in ['手术', '操作', '切除', '置换', '修复', '引流', '吻合']):
+        for line, code, code_start in _lines_with_code(text, entry_type):
+            if entry_type == 'surg':
+                # 对于手术，这个策略更加严格：只在明确包含手术关键词的行中搜索，
+                # 编码必须符合严格格式，且行内不能有费用相关词汇（避免匹配费用数字）
+                if (not _SURG_LINE_WORDS_RE.search(line) or
+                        not _SURG_CODE_STRICT_RE.match(code) or
+                        _LINE_FEE_WORDS_RE.search(line)):
                     continue
-                
-                # 查找包含编码的行
-                code_match = re.search(code_pattern, line)
-                if code_match:
-                    code = code_match.group(1)
-                    
-                    # 验证手术编码格式（更严格的验证）
-                    if not re.match(r'^\d{2}\.\d{2,4}$', code):
-                        continue
-                    
-                    # 检查是否包含费用相关词汇，避免匹配费用数字
-                    if any(fee_word in line for fee_word in ['元', '费用', '元（', '元）', '元，', '元。']):
-                        continue
-                    
-                    # 提取名称（优先取编码后的中文部分）
-                    parts = line.split(code)
-                    name = ""
-                    
-                    # 查找编码后的中文名称
-                    if len(parts) > 1:
-                        after_code = parts[1].strip()
-                        chinese_match = re.search(r'[\u4e00-\u9fa5][^0-9A-Z]*', after_code)
-                        if chinese_match:
-                            name = chinese_match.group(0).strip()
-                    
-                    # 如果编码后没有名称，尝试编码前的部分
-                    if not name and len(parts) > 0:
-                        before_code = parts[0].strip()
-                        chinese_match = re.search(r'[\u4e00-\u9fa5][^0-9A-Z]*$', before_code)
-                        if chinese_match:
-                            name = chinese_match.group(0).strip()
-                    
-                    # 清理名称
-                    if name:
-                        name = re.sub(r'[（(].*?[)）]', '', name)  # 移除括号
-                        name = re.sub(r'[^\u4e00-\u9fa5\s]', '', name).strip()  # 只保留中文和空格
-                    
-                    # 最终验证
-                    if (name and len(name) > 1 and 
-                        not any(neg in name for neg in ['无', '未见', '不详']) and
-                        any(surg_word in name for surg_word in ['手术', '操作', '切除', '置换', '修复', '引流', '吻合', '治疗'])):
-                        all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
-        else:
-            # 诊断的逐行匹配（保持原有逻辑）
-            lines = text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if not line:
+            else:
+                # 检查是否为无效的编码（如 "D10编码"）：编码后10个字符内直接跟着这些词，可能是表头
+                # （窗口内命中必然整行命中，因此不必先对整行扫描一遍，也不切出窗口子串）
+                after_code_pos = code_start + len(code)
+                if _HEADER_MARK_WORDS_RE.search(line, after_code_pos, after_code_pos + 10):
                     continue
-                
-                # 查找包含编码的行
-                code_match = re.search(code_pattern, line)
-                if code_match:
-                    code = code_match.group(1)
-                    
-                    # 验证诊断编码格式
-                    if not re.match(r'^[A-Z]\d{2}', code):
-                        continue
-                    
-                    # 检查是否为无效的编码（如 "D10编码"）
-                    if any(invalid in line for invalid in ['编码', 'code', '名称', 'name']):
-                        # 进一步检查：如果编码后直接跟着这些词，可能是表头
-                        after_code_pos = line.find(code) + len(code)
-                        if after_code_pos < len(line):
-                            after_code = line[after_code_pos:after_code_pos + 10]
-                            if any(invalid in after_code for invalid in ['编码', 'code', '名称', 'name']):
-                                continue
-                    
-                    # 提取名称（优先取编码后的中文部分）
-                    parts = line.split(code)
-                    name = ""
-                    
-                    # 查找编码后的中文名称
-                    if len(parts) > 1:
-                        after_code = parts[1].strip()
-                        chinese_match = re.search(r'[\u4e00-\u9fa5][^0-9A-Z]*', after_code)
-                        if chinese_match:
-                            name = chinese_match.group(0).strip()
-                    
-                    # 如果编码后没有名称，尝试编码前的部分
-                    if not name and len(parts) > 0:
-                        before_code = parts[0].strip()
-                        chinese_match = re.search(r'[\u4e00-\u9fa5][^0-9A-Z]*$', before_code)
-                        if chinese_match:
-                            name = chinese_match.group(0).strip()
-                    
-                    # 清理名称
-                    if name:
-                        name = re.sub(r'[（(].*?[)）]', '', name)  # 移除括号
-                        name = re.sub(r'[^\u4e00-\u9fa5\s]', '', name).strip()  # 只保留中文和空格
-                    
-                    if name and len(name) > 1 and not any(neg in name for neg in ['无', '未见', '不详']):
-                        all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+            
+            name = _name_around_code(line, code, code_start)
+            
+            # 最终验证（手术名称还必须包含手术相关词汇）
+            if (name and len(name) > 1 and
+                    not _NEGATIVE_NAME_RE.search(name) and
+                    (entry_type != 'surg' or _SURG_NAME_WORDS_RE.search(name))):
+                all_results.append((code, name))
 
     # 策略5：特殊编码补充（针对已知遗漏的编码）
     if entry_type == 'diag' and len(all_results) < 5:
-        # 检查是否遗漏了常见的诊断编码
-        special_patterns = [
-            (r'\|\s*(I10)\s*\|\s*(原发性高血压)', 'I10', '原发性高血压'),
-            (r'(I10)\s+原发性高血压', 'I10', '原发性高血压'),
-            (r'高血压.*?(I10)', 'I10', '原发性高血压'),
-        ]
-        
-        for pattern, code, name in special_patterns:
-            if re.search(pattern, text) and not any(r['bm'] == code for r in all_results):
-                all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+        # 检查是否遗漏了常见的诊断编码（已有的编码放进集合，先查集合再做正则搜索）
+        seen_codes = {bm for bm, _ in all_results}
+        for pattern, code, name in _SPECIAL_DIAG_PATTERNS:
+            if code not in seen_codes and code in text and pattern.search(text):
+                all_results.append((code, name))
+                seen_codes.add(code)
                 logger.debug(f"[{entry_type}] 特殊补充匹配: {code} -> {name}")
 
     elif entry_type == 'surg' and len(all_results) == 0:
         # 检查是否遗漏了常见的手术编码
-        special_surg_patterns = [
-            (r'\|\s*(99\.15)\s*\|\s*(静脉输液治疗)', '99.15', '静脉输液治疗'),
-            (r'\|\s*(89\.14)\s*\|\s*(脑电图)', '89.14', '脑电图'), 
-            (r'\|\s*(89\.52)\s*\|\s*(心电图)', '89.52', '心电图'),
-            (r'\|\s*(99\.29)\s*\|\s*(肌肉注射)', '99.29', '肌肉注射'),
-        ]
-        
-        for pattern, code, name in special_surg_patterns:
-            if re.search(pattern, text) and not any(r['bm'] == code for r in all_results):
-                all_results.append({'xh': len(all_results) + 1, 'bm': code, 'mc': name})
+        seen_codes = set()  # 进入此分支时结果为空
+        for pattern, code, name in _SPECIAL_SURG_PATTERNS:
+            if code not in seen_codes and code in text and pattern.search(text):
+                all_results.append((code, name))
+                seen_codes.add(code)
                 logger.debug(f"[{entry_type}] 特殊补充匹配: {code} -> {name}")
 
     logger.debug(f"[{entry_type}] 纯文本回退解析完成，提取{len(all_results)}条记录")
-    return all_results
+    return [{'xh': xh, 'bm': code, 'mc': name} for xh, (code, name) in enumerate(all_results, 1)]
 
 
 # =============================================================================
 # 辅助函数和兼容性接口
 # =============================================================================
 
+@lru_cache(maxsize=32)
+def _parse_cached(text: str) -> Tuple[List[Dict], List[Dict]]:
+    """按文本缓存完整解析结果，调用方不得修改返回的列表（parse_table 会复制后再返回）"""
+    return parse_diagnoses_and_surgeries(text)
+
+
 def parse_table(text: str, table_type: str) -> List[Dict]:
     """
     解析指定类型的医疗表格（兼容性接口）
     
+    同一文本分别取诊断和手术时只完整解析一次（按文本缓存）。
+    
     参数:
         text: 文本内容
     table_type: 表格类型（'诊断' 或 '手术'）
         
     返回: 解析结果列表
     """
-    diagnoses, surgeries = parse_diagnoses_and_surgeries(text)
-    if table_type == '诊断':
-        return diagnoses
-    else:
-        return surgeries
+    diagnoses, surgeries = _parse_cached(text)
+    entries = diagnoses if table_type == '诊断' else surgeries
+    # 返回副本，避免调用方修改结果时污染缓存
+    return [dict(entry) for entry in entries]
 
 def restructure_and_validate_data(diagnoses: List[Dict], surgeries: List[Dict]) -> Tuple[List[Dict], List[Dict], List[Dict]]:
     """
@@ -1034,18 +1159,31 @@ class MedicalReportParser:
     parse_diagnoses_and_surgeries() 函数获得更好的解析效果。
     """
     
+    # 模式与实例无关，作为类属性只在模块加载时编译一次
+    # （便捷函数每次调用都会新建实例），仍可通过 self.xxx 访问
+    # 表格识别模式
+    diagnosis_table_pattern = re.compile(r'诊断表|诊断名称|诊断编码|主要诊断|其他诊断', re.IGNORECASE)
+    surgery_table_pattern = re.compile(r'手术表|手术及操作名称|手术及操作编码|手术操作', re.IGNORECASE)
+    # 两类标题词合并的预检模式：大多数行不含任何标题词，一次扫描即可排除
+    section_heading_pattern = re.compile(
+        diagnosis_table_pattern.pattern + '|' + surgery_table_pattern.pattern, re.IGNORECASE)
+    
+    # 编码匹配模式
+    # 可选小数部分用单个分支表示，与原先按长到短排列的多分支写法匹配结果相同
+    diagnosis_code_pattern = re.compile(r'[A-Z]\d{2}(?:\.\d+)?')  # ICD-10
+    surgery_code_pattern = re.compile(r'\d{2}(?:\.\d{1,2})?')  # ICD-9-CM-3
+    
+    # 表格行识别
+    table_row_pattern = re.compile(r'^\s*\d+\s+')
+    
+    # 含编码的表格数据行：行首符合 table_row_pattern（限定在行内），整行为 group(0)，
+    # 惰性前缀保证 group(1) 是行内第一个编码，一次多行扫描代替切分、过滤再逐行搜索
+    diagnosis_row_pattern = re.compile(
+        r'^(?=[^\S\n]*\d+[^\S\n]+)[^\n]*?(' + diagnosis_code_pattern.pattern + r')[^\n]*', re.MULTILINE)
+    surgery_row_pattern = re.compile(
+        r'^(?=[^\S\n]*\d+[^\S\n]+)[^\n]*?(' + surgery_code_pattern.pattern + r')[^\n]*', re.MULTILINE)
+    
     def __init__(self):
-        # 表格识别模式
-        self.diagnosis_table_pattern = re.compile(r'诊断表|诊断名称|诊断编码|主要诊断|其他诊断', re.IGNORECASE)
-        self.surgery_table_pattern = re.compile(r'手术表|手术及操作名称|手术及操作编码|手术操作', re.IGNORECASE)
-        
-        # 编码匹配模式
-        self.diagnosis_code_pattern = re.compile(r'([A-Z]\d{2}\.\d+|[A-Z]\d{2})')  # ICD-10
-        self.surgery_code_pattern = re.compile(r'(\d{2}\.\d{2}|\d{2}\.\d{1}|\d{2})')  # ICD-9-CM-3
-        
-        # 表格行识别
-        self.table_row_pattern = re.compile(r'^\s*\d+\s+')
-        
         logger.info("传统医疗报告解析器初始化完成")
 
     def extract_sections(self, text):
@@ -1057,21 +1195,24 @@ class MedicalReportParser:
         
         in_diagnosis = False
         in_surgery = False
+        row_match = self.table_row_pattern.match
         
-        for line in lines:
-            # 判断当前行是否为诊断表开始
-            if self.diagnosis_table_pattern.search(line) and not in_diagnosis:
-                in_diagnosis = True
-                in_surgery = False
-                diagnosis_section.append(line)
-                continue
-            
-            # 判断当前行是否为手术表开始
-            if self.surgery_table_pattern.search(line) and not in_surgery:
-                in_surgery = True
-                in_diagnosis = False
-                surgery_section.append(line)
-                continue
+        for idx, line in enumerate(lines):
+            # 行内出现标题词时再分别判断（同一行可能同时含两类标题词，诊断优先）
+            if self.section_heading_pattern.search(line):
+                # 判断当前行是否为诊断表开始
+                if not in_diagnosis and self.diagnosis_table_pattern.search(line):
+                    in_diagnosis = True
+                    in_surgery = False
+                    diagnosis_section.append(line)
+                    continue
+                
+                # 判断当前行是否为手术表开始
+                if not in_surgery and self.surgery_table_pattern.search(line):
+                    in_surgery = True
+                    in_diagnosis = False
+                    surgery_section.append(line)
+                    continue
             
             # 收集诊断表内容
             if in_diagnosis and not in_surgery:
@@ -1079,8 +1220,8 @@ class MedicalReportParser:
                 
                 # 如果遇到空行且已经收集了一些内容，可能表示表格结束
                 if not line.strip() and len(diagnosis_section) > 2:
-                    # 检查是否确实结束了表格
-                    if not any(self.table_row_pattern.match(l) for l in lines[lines.index(line)+1:lines.index(line)+3] if lines.index(line)+3 < len(lines)):
+                    # 检查是否确实结束了表格（后面不足3行时视为结束）
+                    if not (idx + 3 < len(lines) and any(row_match(l) for l in lines[idx + 1:idx + 3])):
                         in_diagnosis = False
             
             # 收集手术表内容
@@ -1089,8 +1230,8 @@ class MedicalReportParser:
                 
                 # 如果遇到空行且已经收集了一些内容，可能表示表格结束
                 if not line.strip() and len(surgery_section) > 2:
-                    # 检查是否确实结束了表格
-                    if not any(self.table_row_pattern.match(l) for l in lines[lines.index(line)+1:lines.index(line)+3] if lines.index(line)+3 < len(lines)):
+                    # 检查是否确实结束了表格（后面不足3行时视为结束）
+                    if not (idx + 3 < len(lines) and any(row_match(l) for l in lines[idx + 1:idx + 3])):
                         in_surgery = False
         
         diagnosis_text = '\n'.join(diagnosis_section)
@@ -1108,34 +1249,27 @@ class MedicalReportParser:
             return []
         
         diagnoses = []
-        lines = diagnosis_text.split('\n')
-        
-        # 跳过表头行
-        data_lines = [line for line in lines if self.table_row_pattern.match(line)]
         
-        for line in data_lines:
-            # 提取编码
-            code_match = self.diagnosis_code_pattern.search(line)
-            if not code_match:
-                continue
-                
-            code = code_match.group(1)
+        # 只处理以序号开头且含编码的数据行（跳过表头行）
+        for row_match in self.diagnosis_row_pattern.finditer(diagnosis_text):
+            line = row_match.group(0)
+            code = row_match.group(1)
             
-            # 提取名称 (在编码后面的部分)
-            line_parts = line.split(code)
-            if len(line_parts) > 1:
-                name = line_parts[1].strip()
+            # 提取名称 (在编码后面、编码下一次出现之前的部分)
+            before_code, sep, after_code = line.partition(code)
+            if sep:
+                name = after_code.partition(code)[0].strip()
                 # 如果名称以标点符号开始，去除
-                name = re.sub(r'^[\s\:\：\,\，\.\。]+', '', name)
+                name = _LEADING_PUNCT_RE.sub('', name)
                 # 如果名称为空，尝试从前面部分提取
-                if not name and len(line_parts[0]) > 5:
+                if not name and len(before_code) > 5:
                     # 去除序号和空格后尝试提取名称
-                    potential_name = re.sub(r'^\s*\d+\s+', '', line_parts[0])
+                    potential_name = _LEADING_INDEX_RE.sub('', before_code)
                     if potential_name:
                         name = potential_name.strip()
             else:
                 # 如果无法从编码分割获取名称，尝试其他方法
-                name_match = re.search(r'\d+\s+(.*?)(?=\s+[A-Z]\d{2}|\s*$)', line)
+                name_match = _LEGACY_DIAG_NAME_RE.search(line)
                 name = name_match.group(1).strip() if name_match else "未知诊断名称"
             
             diagnoses.append({
@@ -1153,34 +1287,27 @@ class MedicalReportParser:
             return []
         
         surgeries = []
-        lines = surgery_text.split('\n')
-        
-        # 跳过表头行
-        data_lines = [line for line in lines if self.table_row_pattern.match(line)]
         
-        for line in data_lines:
-            # 提取编码
-            code_match = self.surgery_code_pattern.search(line)
-            if not code_match:
-                continue
-                
-            code = code_match.group(1)
+        # 只处理以序号开头且含编码的数据行（跳过表头行）
+        for row_match in self.surgery_row_pattern.finditer(surgery_text):
+            line = row_match.group(0)
+            code = row_match.group(1)
             
-            # 提取名称 (在编码后面的部分)
-            line_parts = line.split(code)
-            if len(line_parts) > 1:
-                name = line_parts[1].strip()
+            # 提取名称 (在编码后面、编码下一次出现之前的部分)
+            before_code, sep, after_code = line.partition(code)
+            if sep:
+                name = after_code.partition(code)[0].strip()
                 # 如果名称以标点符号开始，去除
-                name = re.sub(r'^[\s\:\：\,\，\.\。]+', '', name)
+                name = _LEADING_PUNCT_RE.sub('', name)
                 # 如果名称为空，尝试从前面部分提取
-                if not name and len(line_parts[0]) > 5:
+                if not name and len(before_code) > 5:
                     # 去除序号和空格后尝试提取名称
-                    potential_name = re.sub(r'^\s*\d+\s+', '', line_parts[0])
+                    potential_name = _LEADING_INDEX_RE.sub('', before_code)
                     if potential_name:
                         name = potential_name.strip()
             else:
                 # 如果无法从编码分割获取名称，尝试其他方法
-                name_match = re.search(r'\d+\s+(.*?)(?=\s+\d{2}\.\d+|\s+\d{2}|\s*$)', line)
+                name_match = _LEGACY_SURG_NAME_RE.search(line)
                 name = name_match.group(1).strip() if name_match else "未知手术名称"
             
             surgeries.append({
@@ -1216,7 +1343,7 @@ class MedicalReportParser:
             surgery_df = pd.DataFrame(result['surgeries'])
             
             # 创建Excel写入器
-            with pd.ExcelWriter(output_file) as writer:
+            with pd.ExcelWriter(output_file, engine=_EXCEL_ENGINE) as writer:
                 diagnosis_df.to_excel(writer, sheet_name='诊断', index=False)
                 surgery_df.to_excel(writer, sheet_name='手术', index=False)
             
@@ -12,15 +12,16 @@ import pymssql
 import logging
 import re
 import argparse
-from datetime import datetime
 import time
 import os
 import configparser
 from aifz_parser import parse_diagnoses_and_surgeries, restructure_and_validate_data
-import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
-from queue import Queue, Empty
+from queue import Empty, LifoQueue, Full
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from typing import List, Dict, Tuple, Any, Optional
 import sys
 
@@ -35,6 +36,7 @@ STRIP_LEADING_MODS_RE = re.compile(r'^[\s,，、的]+')
 STRIP_TRAILING_MODS_RE = re.compile(r'[\s,，、的]+$')
 STRIP_EXTRA_SPACES_RE = re.compile(r'\s+')
 CLEAN_NON_CHINESE_RE = re.compile(r'[^\u4e00-\u9fa5]')
+WORD_RE = re.compile(r'\w+')
 
 
 # --- 配置部分 ---
@@ -109,6 +111,14 @@ def load_thread_config():
             'max_delay': 30
         }
 
+def _config_mtime():
+    """返回 config.ini 的修改时间，文件不存在时返回 None"""
+    try:
+        return os.path.getmtime(os.path.join(os.path.dirname(__file__), 'config.ini'))
+    except OSError:
+        return None
+
+_DB_CONFIG_MTIME = _config_mtime()
 DB_CONFIG = load_db_config()
 THREAD_CONFIG = load_thread_config()
 
@@ -128,6 +138,11 @@ def fix_db_read_encoding(text):
     """
     if not text or not isinstance(text, str):
         return text
+    return _decode_latin1_as_gbk(text)
+
+@lru_cache(maxsize=200_000)
+def _decode_latin1_as_gbk(text):
+    """fix_db_read_encoding 的实际转换，按字符串缓存（同一名称在候选打分和结果回填中会被反复修复）"""
     try:
         # 将错误解码的字符串重新编码为字节，然后用正确的编码(gbk)解码
         return text.encode('latin1').decode('gbk')
@@ -137,30 +152,37 @@ def fix_db_read_encoding(text):
 
 def get_db_connection():
     """建立并返回一个数据库连接"""
+    global DB_CONFIG, _DB_CONFIG_MTIME
     try:
-        # 确保每次连接时都重新加载配置，以应对可能的动态变化
-        conn = pymssql.connect(**load_db_config())
+        # 配置文件被修改过才重新加载，以应对可能的动态变化，不再每次连接都重新解析
+        mtime = _config_mtime()
+        if mtime is None or mtime != _DB_CONFIG_MTIME:
+            DB_CONFIG = load_db_config()
+            _DB_CONFIG_MTIME = mtime
+        conn = pymssql.connect(**DB_CONFIG)
         logging.debug("数据库连接成功。")
         return conn
     except Exception as e:
         logging.error(f"数据库连接失败: {e}")
         raise
 
+@lru_cache(maxsize=200_000)
 def longest_common_substring(s1, s2):
-    """返回s1和s2的最长公共子串长度"""
+    """
+    返回s1和s2的最长公共子串长度
+    
+    依次以s1的每个位置为起点，只尝试把当前最优长度再加一：若从该起点取最优长度+1的子串
+    不在s2中，更长的也不可能在。总共只做约 len(s1)+结果长度 次C层面的子串查找，
+    代替逐字符的二维DP；同一对名称会在候选打分中反复比较，结果按参数缓存。
+    """
     if not s1 or not s2:
         return 0
+    best = 0
     m = len(s1)
-    n = len(s2)
-    dp = [[0]*(n+1) for _ in range(m+1)]
-    max_len = 0
     for i in range(m):
-        for j in range(n):
-            if s1[i] == s2[j]:
-                dp[i+1][j+1] = dp[i][j] + 1
-                if dp[i+1][j+1] > max_len:
-                    max_len = dp[i+1][j+1]
-    return max_len
+        while i + best < m and s1[i:i + best + 1] in s2:
+            best += 1
+    return best
 
 def jaccard_score(s1, s2):
     """Jaccard分词相似度+最长公共子串，返回(主分,次分)"""
@@ -169,7 +191,8 @@ def jaccard_score(s1, s2):
     if not set1 or not set2:
         return (0, 0)
     intersection = len(set1 & set2)
-    union = len(set1 | set2)
+    # 并集大小由交集推出，不再额外构建并集
+    union = len(set1) + len(set2) - intersection
     jaccard = intersection / union if union else 0
     lcs = longest_common_substring(s1, s2)
     return (jaccard, lcs)
@@ -185,57 +208,112 @@ def best_match_with_lcs_priority(name, candidates, fix_func):
     if not candidates:
         return None
     name = fix_func(name)
-    # 计算每个候选与原始名称的最长连续子串长度
-    lcs_len = [(r, longest_common_substring(name, fix_func(r['glmc']))) for r in candidates]
-    max_lcs = max([l for r, l in lcs_len], default=0)
-    filtered = [r for r, l in lcs_len if l == max_lcs and l >= 3]
-    if filtered:
-        scored = [(r, jaccard_score(name, fix_func(r['glmc']))) for r in filtered]
-        scored.sort(key=lambda x: (x[1][0], x[1][1]), reverse=True)
-        return scored[0][0]
-    # 否则全量排序
-    scored = [(r, jaccard_score(name, fix_func(r['glmc']))) for r in candidates]
-    scored.sort(key=lambda x: (x[1][0], x[1][1]), reverse=True)
-    return scored[0][0]
+    # 原始名称只分词一次，每个候选名称只修复编码一次；LCS 在筛选时已算出，打分时直接复用
+    name_tokens = smart_tokenize(name)
+    lcs_len = []
+    for r in candidates:
+        candidate_name = fix_func(r['glmc'])
+        lcs_len.append((r, candidate_name, longest_common_substring(name, candidate_name)))
+    max_lcs = max([l for _, _, l in lcs_len], default=0)
+    # 有长度>=3的最长连续子串时只在这些候选中排序，否则全量排序
+    filtered = [item for item in lcs_len if item[2] == max_lcs and max_lcs >= 3] or lcs_len
+
+    def score(item):
+        # 与 jaccard_score(name, 候选名称) 的 (主分, 次分) 相同
+        _, candidate_name, lcs = item
+        candidate_tokens = smart_tokenize(candidate_name)
+        if not name_tokens or not candidate_tokens:
+            return (0, 0)
+        intersection = len(name_tokens & candidate_tokens)
+        return (intersection / (len(name_tokens) + len(candidate_tokens) - intersection), lcs)
+
+    # max 返回第一个最高分，与按分数稳定降序排序后取第一个相同
+    return max(filtered, key=score)[0]
+
+_JIEBA = None                # 已初始化的 jieba 模块；jieba 不可用时为 False
+_JIEBA_LOCK = threading.Lock()
+TOKENIZE_CACHE_SIZE = 100_000
+SEARCH_STOP_WORDS = frozenset({'的', '性', '型', '综合征', '其他', '和', '伴有', '继发', '原发'})
+
+def _get_jieba():
+    """
+    返回初始化好的 jieba 模块，jieba 未安装时返回 None。
+    系统模式读取、日志抑制和词典加载只在首次调用时做一次（加锁保证多线程下只初始化一遍），
+    不再在每次分词时重读 config.ini 和替换 sys.stderr。
+    """
+    global _JIEBA
+    if _JIEBA is None:
+        with _JIEBA_LOCK:
+            if _JIEBA is None:
+                # 优先使用核心分词在C中实现、接口和分词结果与 jieba 相同的 jieba_fast，未安装时回退到 jieba
+                try:
+                    import jieba_fast as jieba
+                except ImportError:
+                    try:
+                        import jieba
+                    except ImportError:
+                        jieba = None
+                if jieba is None:
+                    _JIEBA = False
+                else:
+                    system_mode = 'RELEASE'  # 默认为RELEASE模式
+                    try:
+                        config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
+                        if os.path.exists(config_path):
+                            config = configparser.ConfigParser()
+                            config.read(config_path, encoding='utf-8')
+                            if 'system' in config:
+                                system_mode = config['system'].get('mode', 'RELEASE')
+                    except Exception:
+                        pass  # 如果配置读取失败，保持默认值
+                    if system_mode == 'RELEASE':
+                        # 在RELEASE模式下抑制jieba的日志和加载词典时的输出
+                        jieba.setLogLevel(60)  # 设置为CRITICAL级别，抑制所有日志
+                        from io import StringIO
+                        old_stderr = sys.stderr
+                        sys.stderr = StringIO()
+                        try:
+                            jieba.initialize()
+                        finally:
+                            # 恢复标准错误输出
+                            sys.stderr = old_stderr
+                    else:
+                        jieba.initialize()
+                    _JIEBA = jieba
+    return _JIEBA or None
 
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
 def smart_tokenize(text):
-    """智能分词，返回关键词集合"""
-    try:
-        # 检查系统模式
-        import os
-        system_mode = 'RELEASE'  # 默认为RELEASE模式
-        try:
-            import configparser
-            config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
-            if os.path.exists(config_path):
-                config = configparser.ConfigParser()
-                config.read(config_path, encoding='utf-8')
-                if 'system' in config:
-                    system_mode = config['system'].get('mode', 'RELEASE')
-        except Exception:
-            pass  # 如果配置读取失败，保持默认值
-        
-        # 在RELEASE模式下禁用jieba的输出
-        if system_mode == 'RELEASE':
-            import sys
-            from io import StringIO
-            old_stderr = sys.stderr
-            sys.stderr = StringIO()
-            
-        try:
-            import jieba
-            # 在RELEASE模式下设置jieba的日志级别
-            if system_mode == 'RELEASE':
-                jieba.setLogLevel(60)  # 设置为CRITICAL级别，抑制所有日志
-            
-            return set(jieba.lcut(text, cut_all=False))
-        finally:
-            if system_mode == 'RELEASE':
-                # 恢复标准错误输出
-                sys.stderr = old_stderr
-    except ImportError:
+    """智能分词，返回关键词集合（不可变集合，结果按文本缓存）"""
+    jieba = _get_jieba()
+    if jieba is None:
         # 简单的回退，可以根据需要变得更复杂
-        return set(re.findall(r'\w+', text))
+        return frozenset(WORD_RE.findall(text))
+    return frozenset(jieba.lcut(text, cut_all=False))
+
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
+def _search_terms(cleaned_name):
+    """对清理后的名称分词并生成按长度降序的检索词元组，结果按名称缓存"""
+    jieba = _get_jieba()
+    if jieba is None:
+        # jieba不可用时的降级策略
+        logging.warning("jieba库未安装，关键词生成策略降级，可能影响匹配精度。")
+        # 移除所有非汉字字符，然后返回整个字符串作为唯一关键词
+        clean_name = CLEAN_NON_CHINESE_RE.sub('', cleaned_name)
+        return (clean_name,) if clean_name else ()
+
+    # 使用搜索引擎模式，能更好地切分长词
+    terms = jieba.lcut_for_search(cleaned_name)
+    # 过滤掉停用词和单个字符
+    meaningful_terms = [t for t in terms if t not in SEARCH_STOP_WORDS and len(t) > 1]
+
+    # 将处理后的完整名称作为最重要的关键词
+    result_terms = {cleaned_name}
+    result_terms.update(meaningful_terms)
+
+    # 按长度降序排序，较长的词通常更具特异性
+    # 过滤掉空字符串
+    return tuple(sorted([term for term in result_terms if term], key=len, reverse=True))
 
 def generate_search_terms(name):
     """
@@ -247,64 +325,147 @@ def generate_search_terms(name):
     if not cleaned_name:
         return []
 
-    # 2. 移除常见的、意义不大的通用词汇和限定词
+    # 2. 移除常见的、意义不大的通用词汇和限定词（SEARCH_STOP_WORDS）
     # '未特指' 已被 strip_stars_and_brackets 处理，但保留在停用词中无害
-    stop_words = {'的', '性', '型', '综合征', '其他', '和', '伴有', '继发', '原发'}
-    
     # 3. 优先使用jieba分词
-    try:
-        # 检查系统模式
-        import os
-        system_mode = 'RELEASE'  # 默认为RELEASE模式
-        try:
-            import configparser
-            config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
-            if os.path.exists(config_path):
-                config = configparser.ConfigParser()
-                config.read(config_path, encoding='utf-8')
-                if 'system' in config:
-                    system_mode = config['system'].get('mode', 'RELEASE')
-        except Exception:
-            pass  # 如果配置读取失败，保持默认值
-        
-        # 在RELEASE模式下禁用jieba的输出
-        if system_mode == 'RELEASE':
-            import sys
-            from io import StringIO
-            old_stderr = sys.stderr
-            sys.stderr = StringIO()
-            
-        try:
-            import jieba
-            # 在RELEASE模式下设置jieba的日志级别
-            if system_mode == 'RELEASE':
-                jieba.setLogLevel(60)  # 设置为CRITICAL级别，抑制所有日志
-                
-            # 使用搜索引擎模式，能更好地切分长词
-            terms = jieba.lcut_for_search(cleaned_name)
-            # 过滤掉停用词和单个字符
-            meaningful_terms = [t for t in terms if t not in stop_words and len(t) > 1]
-            
-            # 4. 构造结果列表
-            # 将处理后的完整名称作为最重要的关键词
-            result_terms = {cleaned_name}
-            result_terms.update(meaningful_terms)
-            
-            # 按长度降序排序，较长的词通常更具特异性
-            # 过滤掉空字符串
-            sorted_terms = sorted([term for term in result_terms if term], key=len, reverse=True)
-            return sorted_terms
-        finally:
-            if system_mode == 'RELEASE':
-                # 恢复标准错误输出
-                sys.stderr = old_stderr
+    return list(_search_terms(cleaned_name))
 
-    except ImportError:
-        # jieba不可用时的降级策略
-        logging.warning("jieba库未安装，关键词生成策略降级，可能影响匹配精度。")
-        # 移除所有非汉字字符，然后返回整个字符串作为唯一关键词
-        clean_name = CLEAN_NON_CHINESE_RE.sub('', cleaned_name)
-        return [clean_name] if clean_name else []
+def _as_sp_executesql(sql: str) -> str:
+    """
+    把只含一个 %s 参数的查询改写为 sp_executesql 参数化调用，参数以 @p 传入。
+    pymssql 在客户端把参数拼成字面量，不同名称会生成各自的即席计划；改写后语句文本固定，服务器可复用同一个执行计划。
+    pymssql 本身就把 str 参数作为 N'...' 发送，因此声明为 nvarchar 不改变比较语义。
+    """
+    body = sql.replace("'", "''").replace('%s', '@p')
+    return f"EXEC sp_executesql N'{body}', N'@p nvarchar(4000)', @p = %s"
+
+NAME_TABLES = ('MED_LCYBZDDYK', 'MED_LCYBSSDYK')
+
+# 高频单值查询在模块加载时改写好，匹配函数只选取对应的语句并绑定名称/编码
+EXACT_NAME_QUERIES = {
+    table: _as_sp_executesql(f"SELECT glbm, glmc FROM {table} WITH (NOLOCK) WHERE glmc = %s") for table in NAME_TABLES
+}
+CODE_PREFIX_QUERIES = {
+    table: _as_sp_executesql(f"SELECT TOP 1 glbm, glmc FROM {table} WITH (NOLOCK) WHERE glbm LIKE %s") for table in NAME_TABLES
+}
+
+NAME_BATCH_SIZE = 500  # 批量名称查询每条SQL携带的名称数（每个名称占2个参数，低于SQL Server 2100个参数的上限）
+
+def _batched_name_query(cursor, table_name: str, values: List[str], condition: str) -> List[List[Dict]]:
+    """
+    用 VALUES 派生表连接一次查询多个名称条件，返回与 values 一一对应的结果行列表。
+    condition 为连接条件（如 "t.glmc = v.n"、"t.glmc LIKE v.n"），比较仍在数据库端按列的排序规则进行，
+    与逐个执行 "glmc = %s" / "glmc LIKE %s" 的匹配结果相同；结果行额外带有 isgray/isexcept 供调用方过滤。
+    """
+    grouped = [[] for _ in values]
+    for start in range(0, len(values), NAME_BATCH_SIZE):
+        chunk = values[start:start + NAME_BATCH_SIZE]
+        value_rows = ', '.join(['(%s, %s)'] * len(chunk))
+        params = tuple(p for i, value in enumerate(chunk, start) for p in (i, value))
+        cursor.execute(
+            f"SELECT v.i, t.glbm, t.glmc, t.isgray, t.isexcept FROM (VALUES {value_rows}) AS v(i, n) "
+            f"JOIN {table_name} t WITH (NOLOCK) ON {condition}",
+            params
+        )
+        for row in cursor.fetchall():
+            grouped[row['i']].append(row)
+    return grouped
+
+def _batched_first_like(cursor, table_name: str, patterns: List[str], use_flags: bool) -> List[Optional[Dict]]:
+    """
+    用 CROSS APPLY 在一次查询中对每个 LIKE 模式各取 TOP 1 行，返回与 patterns 一一对应的结果（无匹配为 None），
+    与逐个执行 "SELECT TOP 1 glbm, glmc ... WHERE glmc LIKE %s" 的结果相同。
+    use_flags 为 True 时附加 isgray = 0 AND isexcept = 0 条件。
+    """
+    flag_condition = " AND isgray = 0 AND isexcept = 0" if use_flags else ""
+    firsts = [None] * len(patterns)
+    for start in range(0, len(patterns), NAME_BATCH_SIZE):
+        chunk = patterns[start:start + NAME_BATCH_SIZE]
+        value_rows = ', '.join(['(%s, %s)'] * len(chunk))
+        params = tuple(p for i, pattern in enumerate(chunk, start) for p in (i, pattern))
+        cursor.execute(
+            f"SELECT v.i, t.glbm, t.glmc FROM (VALUES {value_rows}) AS v(i, n) "
+            f"CROSS APPLY (SELECT TOP 1 glbm, glmc FROM {table_name} WITH (NOLOCK) "
+            f"WHERE glmc LIKE v.n{flag_condition}) t",
+            params
+        )
+        for row in cursor.fetchall():
+            firsts[row['i']] = {'glbm': row['glbm'], 'glmc': row['glmc']}
+    return firsts
+
+# 精确名称匹配结果的进程级缓存：{(表名, 名称): 匹配行列表}，按LRU淘汰。
+# 同一疾病名称在不同病案中反复出现，缓存后不再重复查询；对照表的修改在 clear_name_match_caches 清空缓存后生效
+# （独立运行时每轮预处理开始前清空，aifz_main 服务中每小时维护时清空）。
+EXACT_NAME_CACHE_SIZE = 50000
+_EXACT_NAME_CACHE: "OrderedDict[Tuple[str, str], List[Dict]]" = OrderedDict()
+_EXACT_NAME_CACHE_LOCK = threading.Lock()
+
+def _fetch_exact_name_matches(cursor, table_name: str, names) -> Dict[str, List[Dict]]:
+    """
+    取回多个名称的精确匹配行，返回 {名称: 匹配行列表}（未匹配的名称对应空列表）。
+    已缓存的名称直接使用缓存，其余名称用一次往返批量查询后写入缓存。
+    """
+    unique_names = list(dict.fromkeys(n for n in names if n))
+    matches = {}
+    missing = []
+    with _EXACT_NAME_CACHE_LOCK:
+        for n in unique_names:
+            key = (table_name, n)
+            rows = _EXACT_NAME_CACHE.get(key)
+            if rows is None:
+                missing.append(n)
+            else:
+                _EXACT_NAME_CACHE.move_to_end(key)
+                matches[n] = rows
+    if missing:
+        fetched = dict(zip(missing, _batched_name_query(cursor, table_name, missing, 't.glmc = v.n')))
+        matches.update(fetched)
+        with _EXACT_NAME_CACHE_LOCK:
+            for n, rows in fetched.items():
+                _EXACT_NAME_CACHE[(table_name, n)] = rows
+            while len(_EXACT_NAME_CACHE) > EXACT_NAME_CACHE_SIZE:
+                _EXACT_NAME_CACHE.popitem(last=False)
+    return matches
+
+# 逐字递减类匹配结果的进程级缓存：{(函数名, 参数...): 匹配结果或None}，按LRU淘汰，与精确匹配缓存同时清空
+MATCH_RESULT_CACHE_SIZE = 50000
+_MATCH_RESULT_CACHE: "OrderedDict[Tuple, Optional[Dict]]" = OrderedDict()
+_MATCH_RESULT_CACHE_LOCK = threading.Lock()
+_CACHE_MISS = object()
+
+def _cache_match_result(func):
+    """按除游标外的参数缓存匹配函数的结果（包括未匹配的 None），命中时不再查询数据库"""
+    @wraps(func)
+    def wrapper(cursor, *args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        with _MATCH_RESULT_CACHE_LOCK:
+            result = _MATCH_RESULT_CACHE.get(key, _CACHE_MISS)
+            if result is not _CACHE_MISS:
+                _MATCH_RESULT_CACHE.move_to_end(key)
+                return result
+        result = func(cursor, *args, **kwargs)
+        with _MATCH_RESULT_CACHE_LOCK:
+            _MATCH_RESULT_CACHE[key] = result
+            while len(_MATCH_RESULT_CACHE) > MATCH_RESULT_CACHE_SIZE:
+                _MATCH_RESULT_CACHE.popitem(last=False)
+        return result
+    return wrapper
+
+def clear_name_match_caches():
+    """清空名称匹配相关的进程级缓存（对照表可能已更新时调用）"""
+    with _EXACT_NAME_CACHE_LOCK:
+        _EXACT_NAME_CACHE.clear()
+    with _MATCH_RESULT_CACHE_LOCK:
+        _MATCH_RESULT_CACHE.clear()
+
+def _without_flagged(rows: List[Dict]) -> List[Dict]:
+    """过滤掉灰码和除外码，等价于查询条件 AND isgray = 0 AND isexcept = 0"""
+    return [r for r in rows if r['isgray'] == 0 and r['isexcept'] == 0]
+
+def _exact_lookup_names(name):
+    """find_best_name_match 精确匹配阶段依次查询的名称：(修复编码后的名称, 去括号后的名称)"""
+    original_name_fixed = fix_db_read_encoding(name)
+    return original_name_fixed, STRIP_PAREN_RE.sub('', original_name_fixed).strip()
 
 def find_match_by_stripping_aggressively(cursor, name, table_name, use_flags=True):
     """
@@ -315,97 +476,101 @@ def find_match_by_stripping_aggressively(cursor, name, table_name, use_flags=Tru
     if not name or len(name) < 3:
         return None
 
-    current_name = name
-    while len(current_name) >= 2: # Minimum length for a meaningful match
-        # Use a contains query, as the core term might be surrounded by other words
-        query = f"SELECT TOP 1 glbm, glmc FROM {table_name} WITH (NOLOCK) WHERE glmc LIKE %s"
-        if use_flags:
-            # This flag is not used in the simplified find_best_name_match, but we add it for robustness
-            # in case it's used by the calling context (e.g., the non-simplified logic).
-            query += " AND isgray = 0 AND isexcept = 0"
-        
-        cursor.execute(query, (f'%{current_name}%',))
-        result = cursor.fetchone()
-        
+    # All head/tail stripped variants down to the minimum length of 2, longest first
+    variants = [name[k:len(name) - k] for k in range((len(name) - 2) // 2 + 1)]
+    # Use a contains query, as the core term might be surrounded by other words.
+    # All variants are looked up in one round trip and then checked in order.
+    # The flags are not used in the simplified find_best_name_match, but we add them for robustness
+    # in case they're used by the calling context (e.g., the non-simplified logic).
+    firsts = _batched_first_like(cursor, table_name, [f'%{v}%' for v in variants], use_flags)
+
+    for current_name, result in zip(variants, firsts):
         if result:
             matched_name = fix_db_read_encoding(result['glmc'])
             jaccard_sim, _ = jaccard_score(name, matched_name)
             # Add a sanity check to ensure the match is not completely random
             if jaccard_sim > 0.2: # A reasonably high threshold for this aggressive strategy
-                logging.debug(f"头尾缩减匹配成功: '{name}' -> '{current_name}' -> '{matched_name}' (相似度: {jaccard_sim:.2f})")
+                logging.debug("头尾缩减匹配成功: '%s' -> '%s' -> '%s' (相似度: %.2f)", name, current_name, matched_name, jaccard_sim)
                 return result
             else:
-                 logging.debug(f"头尾缩减匹配 '{name}' -> '{current_name}' -> '{matched_name}' 因相似度低({jaccard_sim:.2f})被拒绝")
+                 logging.debug("头尾缩减匹配 '%s' -> '%s' -> '%s' 因相似度低(%.2f)被拒绝", name, current_name, matched_name, jaccard_sim)
 
-        # If not found, strip one char from both ends
-        if len(current_name) > 2:
-            current_name = current_name[1:-1]
-        else:
-            break # Stop if the string becomes too short
-            
     return None
 
-def find_best_name_match(cursor, name, code, table_name, is_main, use_flags=True):
+def find_best_name_match(cursor, name, code, table_name, is_main, use_flags=True, exact_matches=None,
+                          retry_without_flags=False):
     """
     通用名称匹配，按优先级：
     1. 整字准确匹配
     2. 去括号名称准确匹配
     3. 基于关键词的模糊匹配（优化版）
     4. 编码模糊匹配
+
+    exact_matches 为调用方用 _fetch_exact_name_matches 预取的 {名称: 匹配行列表}，
+    其中已有的名称不再单独查询数据库。
+    retry_without_flags 为 True 时，所有策略都失败后再不带 isgray/isexcept 条件重试头尾缩减匹配。
+    use_flags 只影响头尾缩减匹配，因此这与再用 use_flags=False 完整调用一次的结果相同，但不重复前面的查询。
     """
     if not name:
         return None
 
-    original_name_fixed = fix_db_read_encoding(name)
-    name_no_brackets = re.sub(r"[（(].*?[)）]", "", original_name_fixed).strip()
+    original_name_fixed, name_no_brackets = _exact_lookup_names(name)
 
     # 1. & 2. 整字和去括号准确匹配
     for n in [original_name_fixed, name_no_brackets]:
         if not n: continue
-        query = f"SELECT glbm, glmc FROM {table_name} WITH (NOLOCK) WHERE glmc = %s"
-        # ... (此处省略了原有的 isgray/isexcept 条件，因为它们使逻辑过于复杂，暂时简化)
-        cursor.execute(query, (n,))
-        result = cursor.fetchone()
+        if exact_matches is not None and n in exact_matches:
+            rows = exact_matches[n]
+            result = rows[0] if rows else None
+        else:
+            # ... (此处省略了原有的 isgray/isexcept 条件，因为它们使逻辑过于复杂，暂时简化)
+            cursor.execute(EXACT_NAME_QUERIES[table_name], (n,))
+            result = cursor.fetchone()
         if result:
-            logging.debug(f"精确匹配成功 ('{n}'): '{original_name_fixed}' -> '{fix_db_read_encoding(result['glmc'])}'")
+            logging.debug("精确匹配成功 ('%s'): '%s' -> '%s'", n, original_name_fixed, fix_db_read_encoding(result['glmc']))
             return result
 
     # 3. 基于关键词的模糊匹配 (优化版)
     search_terms = generate_search_terms(original_name_fixed)
-    logging.debug(f"为 '{original_name_fixed}' 生成的搜索关键词: {search_terms}")
+    logging.debug("为 '%s' 生成的搜索关键词: %s", original_name_fixed, search_terms)
     
-    # 收集所有可能的候选
+    # 收集所有可能的候选：所有关键词合并为一次查询，结果按关键词顺序拼接（与逐个查询相同）
     all_candidates = []
-    for term in search_terms:
-        query = f"SELECT glbm, glmc FROM {table_name} WITH (NOLOCK) WHERE glmc LIKE %s"
-        cursor.execute(query, (f'%{term}%',))
-        all_candidates.extend(cursor.fetchall())
+    for rows in _batched_name_query(cursor, table_name, [f'%{term}%' for term in search_terms], 't.glmc LIKE v.n'):
+        all_candidates.extend(rows)
     
     if not all_candidates:
-        logging.debug(f"为 '{original_name_fixed}' 未找到任何模糊匹配候选。")
+        logging.debug("为 '%s' 未找到任何模糊匹配候选。", original_name_fixed)
         return None
 
     # 去重
     unique_candidates = {r['glbm']: r for r in all_candidates}.values()
 
-    scored_candidates = []
+    # 原始名称只分词一次；每个候选也只分词一次，同一组关键词同时用于Jaccard和关键词加分
+    # （两者同为关键词集合的交并比，原先分别调用 jaccard_score 和 smart_tokenize 各分词一遍）
+    core_keywords = smart_tokenize(original_name_fixed)
+    core_len = len(original_name_fixed)
+    # 单遍取最高分（同分取先出现者，与稳定降序排序后取第一个相同），不再构建并排序整个列表
+    best_candidate, best_name, best_score = None, None, None
     for r in unique_candidates:
         candidate_name = fix_db_read_encoding(r['glmc'])
-        jaccard, lcs = jaccard_score(original_name_fixed, candidate_name)
-        
-        core_keywords = smart_tokenize(original_name_fixed)
         candidate_keywords = smart_tokenize(candidate_name)
-        keyword_bonus = len(core_keywords.intersection(candidate_keywords)) / len(core_keywords.union(candidate_keywords))
+        if core_keywords and candidate_keywords:
+            common = len(core_keywords & candidate_keywords)
+            jaccard = common / (len(core_keywords) + len(candidate_keywords) - common)
+            lcs = longest_common_substring(original_name_fixed, candidate_name)
+        else:
+            # 与 jaccard_score 一致：任一方没有关键词时两项均为0
+            jaccard, lcs = 0, 0
+        keyword_bonus = jaccard
 
-        final_score = 0.6 * jaccard + 0.2 * (lcs / max(len(original_name_fixed), len(candidate_name), 1)) + 0.2 * keyword_bonus
-        scored_candidates.append((r, final_score))
+        final_score = 0.6 * jaccard + 0.2 * (lcs / max(core_len, len(candidate_name), 1)) + 0.2 * keyword_bonus
+        if best_score is None or final_score > best_score:
+            best_candidate, best_name, best_score = r, candidate_name, final_score
 
-    if scored_candidates:
-        scored_candidates.sort(key=lambda x: x[1], reverse=True)
-        best_candidate, best_score = scored_candidates[0]
-        
+    if best_candidate is not None:
         if best_score > 0.3: # 阈值可调
-            logging.debug(f"模糊匹配成功: '{original_name_fixed}' -> '{fix_db_read_encoding(best_candidate['glmc'])}' (分数: {best_score:.4f})")
+            logging.debug("模糊匹配成功: '%s' -> '%s' (分数: %.4f)", original_name_fixed, best_name, best_score)
             return best_candidate
 
     # 3.5. Last resort: Aggressive stripping match
@@ -416,8 +581,7 @@ def find_best_name_match(cursor, name, code, table_name, is_main, use_flags=True
     # 4. 编码模糊匹配 (如果前面的策略都失败了，使用更安全的前缀匹配和名称相似度检查)
     if code:
         # Use a safer prefix match instead of contains match
-        query = f"SELECT TOP 1 glbm, glmc FROM {table_name} WITH (NOLOCK) WHERE glbm LIKE %s"
-        cursor.execute(query, (f'{code}%',))
+        cursor.execute(CODE_PREFIX_QUERIES[table_name], (f'{code}%',))
         result = cursor.fetchone()
         if result:
             # Sanity check: the matched name should have *some* similarity to the original
@@ -425,37 +589,64 @@ def find_best_name_match(cursor, name, code, table_name, is_main, use_flags=True
             jaccard_sim, _ = jaccard_score(original_name_fixed, matched_name)
             # A low threshold to prevent completely unrelated matches like '生物反馈' vs 'ECT'
             if jaccard_sim > 0.1:
-                logging.debug(f"编码前缀匹配成功: '{code}' -> '{matched_name}' (相似度: {jaccard_sim:.2f})")
+                logging.debug("编码前缀匹配成功: '%s' -> '%s' (相似度: %.2f)", code, matched_name, jaccard_sim)
                 return result
             else:
-                logging.debug(f"编码前缀匹配 '{code}' -> '{matched_name}' 因名称相似度过低({jaccard_sim:.2f})而被拒绝。")
+                logging.debug("编码前缀匹配 '%s' -> '%s' 因名称相似度过低(%.2f)而被拒绝。", code, matched_name, jaccard_sim)
+
+    if retry_without_flags and use_flags:
+        aggressive_match = find_match_by_stripping_aggressively(cursor, original_name_fixed, table_name, False)
+        if aggressive_match:
+            return aggressive_match
 
-    logging.debug(f"为 '{original_name_fixed}' 未找到任何高质量匹配。")
+    logging.debug("为 '%s' 未找到任何高质量匹配。", original_name_fixed)
     return None
 
 def strip_stars_and_brackets(name):
     """使用预编译的正则表达式去除头尾*、括号内容、以及所有'未特指'相关修饰短语，返回核心疾病名称。"""
     if not isinstance(name, str):
         return name
-    name = STRIP_STARS_RE.sub('', name)
-    name = STRIP_PAREN_RE.sub('', name)
-    name = STRIP_UNSPECIFIED_RE.sub('', name)
+    return _strip_core_name(name)
+
+@lru_cache(maxsize=100_000)
+def _strip_core_name(name):
+    """strip_stars_and_brackets 的实际处理，按名称缓存；不含相应字符时跳过对应的替换"""
+    # 各步替换依次作用于上一步的结果（如去掉'未特指'后才露出首尾修饰词），不能合并为一次替换
+    if '*' in name:
+        name = STRIP_STARS_RE.sub('', name)
+    if '(' in name or '（' in name:
+        name = STRIP_PAREN_RE.sub('', name)
+    if '未特指' in name:
+        name = STRIP_UNSPECIFIED_RE.sub('', name)
     name = STRIP_LEADING_MODS_RE.sub('', name)
     name = STRIP_TRAILING_MODS_RE.sub('', name)
     name = STRIP_EXTRA_SPACES_RE.sub('', name)
     return name.strip()
 
+# 主诊断模糊搜索：带出标志位，由调用方在 Python 中优先选择未标记灰码/除外码的行
+DIAG_LIKE_WITH_FLAGS_QUERY = _as_sp_executesql(
+    "SELECT glbm, glmc, isgray, isexcept FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glmc LIKE %s"
+)
+# 主诊断编码搜索：未标记灰码/除外码的行排在前面，一次查询即等价于先带标志位、再不带标志位各查一次
+DIAG_CODE_LIKE_QUERY = _as_sp_executesql(
+    "SELECT TOP 1 glbm, glmc FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glbm LIKE %s "
+    "ORDER BY CASE WHEN isgray = 0 AND isexcept = 0 THEN 0 ELSE 1 END"
+)
+
 def reconstruct_diagnoses(cursor, initial_diagnoses):
     """重构诊断列表"""
     final_diagnoses = []
     
-    cursor.execute("SELECT 疾病编码 FROM [XX_DRGS_WJ_2.0_MCC] WITH (NOLOCK)")
-    mcc_results = cursor.fetchall()
-    mcc_codes = {r['疾病编码'] for r in mcc_results} if mcc_results else set()
-
-    cursor.execute("SELECT 疾病编码 FROM [XX_DRGS_WJ_2.0_CC] WITH (NOLOCK)")
-    cc_results = cursor.fetchall()
-    cc_codes = {r['疾病编码'] for r in cc_results} if cc_results else set()
+    # 预先用一次查询取回本病案所有诊断名称的精确匹配结果，代替逐个名称、逐个标志位的查询
+    lookup_names = []
+    for diag in initial_diagnoses:
+        if not diag.get('mc'):
+            continue
+        if diag.get('xh') == 1:
+            lookup_names.extend((strip_stars_and_brackets(diag['mc']), diag['mc']))
+        else:
+            lookup_names.extend(_exact_lookup_names(diag['mc']))
+    exact_matches = _fetch_exact_name_matches(cursor, 'MED_LCYBZDDYK', lookup_names)
 
     for diag in initial_diagnoses:
         # 如果编码或名称是占位符"无"或为空，则跳过
@@ -473,10 +664,9 @@ def reconstruct_diagnoses(cursor, initial_diagnoses):
             # 1. 按去括号和*后的名称进行完全匹配
             if name_without_paren and name_without_paren != original_name:
                 for use_flags in [True, False]:
-                    query = f"""SELECT glbm, glmc FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glmc = %s 
-                                {'AND isgray = 0 AND isexcept = 0' if use_flags else ''}"""
-                    cursor.execute(query, (name_without_paren,))
-                    results = cursor.fetchall()
+                    results = exact_matches[name_without_paren]
+                    if use_flags:
+                        results = _without_flagged(results)
                     if not results: continue
 
                     # 首字母偏好
@@ -491,10 +681,9 @@ def reconstruct_diagnoses(cursor, initial_diagnoses):
             # 2. 按原始名称进行完全匹配
             if not found_match:
                 for use_flags in [True, False]:
-                    query = f"""SELECT glbm, glmc FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glmc = %s 
-                                {'AND isgray = 0 AND isexcept = 0' if use_flags else ''}"""
-                    cursor.execute(query, (original_name,))
-                    results = cursor.fetchall()
+                    results = exact_matches[original_name]
+                    if use_flags:
+                        results = _without_flagged(results)
                     if not results: continue
 
                     # 首字母偏好
@@ -508,12 +697,10 @@ def reconstruct_diagnoses(cursor, initial_diagnoses):
                         break
             # 3. 如果完全匹配失败，进行模糊匹配
             if not found_match:
-                # 按原始名称模糊搜索
-                for use_flags in [True, False]:
-                    query = f"""SELECT glbm, glmc FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glmc LIKE %s 
-                                {'AND isgray = 0 AND isexcept = 0' if use_flags else ''}"""
-                    cursor.execute(query, (f'%{original_name}%',))
-                    results = cursor.fetchall()
+                # 按原始名称模糊搜索（一次查询带出标志位，先在未标记灰码/除外码的行中选，再在全部行中选）
+                cursor.execute(DIAG_LIKE_WITH_FLAGS_QUERY, (f'%{original_name}%',))
+                rows = cursor.fetchall()
+                for results in (_without_flagged(rows), rows):
                     if not results: continue
 
                     # 首字母偏好
@@ -527,11 +714,9 @@ def reconstruct_diagnoses(cursor, initial_diagnoses):
                         break
                 # 如果按原名没找到，按去括号和*后的名称模糊搜索
                 if not found_match and name_without_paren and name_without_paren != original_name:
-                    for use_flags in [True, False]:
-                        query = f"""SELECT glbm, glmc FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glmc LIKE %s 
-                                    {'AND isgray = 0 AND isexcept = 0' if use_flags else ''}"""
-                        cursor.execute(query, (f'%{name_without_paren}%',))
-                        results = cursor.fetchall()
+                    cursor.execute(DIAG_LIKE_WITH_FLAGS_QUERY, (f'%{name_without_paren}%',))
+                    rows = cursor.fetchall()
+                    for results in (_without_flagged(rows), rows):
                         if not results: continue
                         # 首字母偏好
                         if diag.get('bm'):
@@ -544,40 +729,27 @@ def reconstruct_diagnoses(cursor, initial_diagnoses):
                             break
             # 4. 如果还是没找到, 按编码搜索
             if not found_match:
-                for use_flags in [True, False]:
-                    query = f"""SELECT TOP 1 glbm, glmc FROM MED_LCYBZDDYK WITH (NOLOCK) WHERE glbm LIKE %s
-                                {'AND isgray = 0 AND isexcept = 0' if use_flags else ''}"""
-                    cursor.execute(query, (f'%{diag["bm"]}%',))
-                    found_match = cursor.fetchone()
-                    if found_match: break
+                cursor.execute(DIAG_CODE_LIKE_QUERY, (f'%{diag["bm"]}%',))
+                found_match = cursor.fetchone()
             # 5. 如果编码匹配也失败，尝试逐字递减匹配
             if not found_match:
-                for use_flags in [True, False]:
-                    found_match = find_match_by_decreasing_chars(cursor, original_name, True, 'MED_LCYBZDDYK', use_flags)
-                    if found_match: break
+                found_match = find_match_by_decreasing_chars(cursor, original_name, True, 'MED_LCYBZDDYK', None)
                 # 如果原始名称逐字递减失败，尝试去括号和*后的名称
                 if not found_match and name_without_paren and name_without_paren != original_name:
-                    for use_flags in [True, False]:
-                        found_match = find_match_by_decreasing_chars(cursor, name_without_paren, True, 'MED_LCYBZDDYK', use_flags)
-                        if found_match: break
+                    found_match = find_match_by_decreasing_chars(cursor, name_without_paren, True, 'MED_LCYBZDDYK', None)
             # 6. 如果逐字递减匹配也失败，尝试从首字递减模糊匹配
             if not found_match:
-                for use_flags in [True, False]:
-                    found_match = find_match_by_decreasing_chars_from_start(cursor, original_name, True, 'MED_LCYBZDDYK', use_flags)
-                    if found_match: break
+                found_match = find_match_by_decreasing_chars_from_start(cursor, original_name, True, 'MED_LCYBZDDYK', None)
                 # 如果原始名称从首字递减失败，尝试去括号和*后的名称
                 if not found_match and name_without_paren and name_without_paren != original_name:
-                    for use_flags in [True, False]:
-                        found_match = find_match_by_decreasing_chars_from_start(cursor, name_without_paren, True, 'MED_LCYBZDDYK', use_flags)
-                        if found_match: break
+                    found_match = find_match_by_decreasing_chars_from_start(cursor, name_without_paren, True, 'MED_LCYBZDDYK', None)
             if found_match:
                 final_diagnoses.append({'xh': diag['xh'], 'bm': found_match['glbm'], 'mc': fix_db_read_encoding(found_match['glmc'])})
             else:
                 final_diagnoses.append(diag)
         else: # 其他诊断
-            match = find_best_name_match(cursor, diag['mc'], diag['bm'], 'MED_LCYBZDDYK', True)
-            if not match:
-                match = find_best_name_match(cursor, diag['mc'], diag['bm'], 'MED_LCYBZDDYK', False)
+            # find_best_name_match 不使用 is_main，原先失败后以 is_main=False 重试只是重复同样的查询
+            match = find_best_name_match(cursor, diag['mc'], diag['bm'], 'MED_LCYBZDDYK', True, exact_matches=exact_matches)
             if match:
                 final_diagnoses.append({'xh': diag['xh'], 'bm': match['glbm'], 'mc': fix_db_read_encoding(match['glmc'])})
             else:
@@ -587,6 +759,15 @@ def reconstruct_diagnoses(cursor, initial_diagnoses):
 def reconstruct_surgeries(cursor, initial_surgeries):
     """重构手术列表"""
     final_surgeries = []
+
+    # 预先用一次查询取回本病案所有手术名称（含去括号和*后的名称）的精确匹配结果
+    lookup_names = []
+    for surg in initial_surgeries:
+        if surg.get('mc'):
+            lookup_names.extend(_exact_lookup_names(surg['mc']))
+            lookup_names.extend(_exact_lookup_names(strip_stars_and_brackets(surg['mc'])))
+    exact_matches = _fetch_exact_name_matches(cursor, 'MED_LCYBSSDYK', lookup_names)
+
     for surg in initial_surgeries:
         # 如果编码或名称是占位符"无"或为空，则跳过
         if not surg.get('bm') or not surg.get('mc') or '无' in surg.get('bm', '') or '无' in surg.get('mc', ''):
@@ -595,47 +776,54 @@ def reconstruct_surgeries(cursor, initial_surgeries):
         found_match = None
         original_name = surg['mc']
         name_without_paren = strip_stars_and_brackets(original_name)
-        # 统一名称匹配逻辑
-        for use_flags in [True, False]:
-            found_match = find_best_name_match(cursor, original_name, surg['bm'], 'MED_LCYBSSDYK', is_main, use_flags)
-            if found_match:
-                break
+        # 统一名称匹配逻辑（先带标志位，失败后不带标志位重试头尾缩减匹配）
+        found_match = find_best_name_match(cursor, original_name, surg['bm'], 'MED_LCYBSSDYK', is_main,
+                                           exact_matches=exact_matches, retry_without_flags=True)
         if not found_match and name_without_paren and name_without_paren != original_name:
-            for use_flags in [True, False]:
-                found_match = find_best_name_match(cursor, name_without_paren, surg['bm'], 'MED_LCYBSSDYK', is_main, use_flags)
-                if found_match:
-                    break
+            found_match = find_best_name_match(cursor, name_without_paren, surg['bm'], 'MED_LCYBSSDYK', is_main,
+                                               exact_matches=exact_matches, retry_without_flags=True)
         if found_match:
             final_surgeries.append({'xh': surg['xh'], 'bm': found_match['glbm'], 'mc': fix_db_read_encoding(found_match['glmc'])})
         else:
             final_surgeries.append(surg)
     return final_surgeries
 
+ZDSS_INSERT_BATCH_ROWS = 400  # 每条多行 INSERT 的行数（每行5个参数，低于SQL Server 2100个参数的上限）
+
+def _zdss_insert_sql(row_count):
+    """生成插入 row_count 行的 XX_AIFZ_ZDSS 多行 INSERT 语句"""
+    return "INSERT INTO XX_AIFZ_ZDSS(syxh, type, xh, bm, mc) VALUES " + ", ".join(["(%s, %s, %s, %s, %s)"] * row_count)
+
 def save_zdss_to_db(cursor, syxh, final_diags, final_surgeries):
     """
     将最终的诊断和手术信息保存到数据库。
     此函数现在假定事务由调用方管理。
     """
     try:
-        # 为本次操作设置特定的锁超时
-        cursor.execute("SET LOCK_TIMEOUT 60000") # 60秒锁超时
+        # 诊断和手术行合并为多行 VALUES 插入，与锁超时设置、删除旧数据、更新时间戳放在同一个批处理中，一次往返完成
+        rows = [(syxh, 'zd', diag['xh'], diag['bm'], diag['mc']) for diag in final_diags or []]
+        rows += [(syxh, 'ss', surg['xh'], surg['bm'], surg['mc']) for surg in final_surgeries or []]
         
-        # 1. 删除旧数据 (使用ROWLOCK提示减少锁升级概率)
-        cursor.execute("DELETE FROM XX_AIFZ_ZDSS WITH (ROWLOCK) WHERE syxh = %s", (syxh,))
+        # 1. 为本次操作设置特定的锁超时；2. 删除旧数据 (使用ROWLOCK提示减少锁升级概率)
+        statements = ["SET LOCK_TIMEOUT 60000", "DELETE FROM XX_AIFZ_ZDSS WITH (ROWLOCK) WHERE syxh = %s"]
+        params = [syxh]
+        # 3. 插入诊断和手术数据
+        first_rows = rows[:ZDSS_INSERT_BATCH_ROWS]
+        if first_rows:
+            statements.append(_zdss_insert_sql(len(first_rows)))
+            params.extend(value for row in first_rows for value in row)
+        # 4. 更新时间戳：与 aisavetime 一样取数据库服务器时间（格式同原先的 '%Y-%m-%d %H:%M:%S'），
+        #    两者比较时不受应用服务器与数据库服务器时钟偏差影响
+        statements.append(
+            "UPDATE XX_AIFZ_RETURN WITH (ROWLOCK) SET zdssextime = CONVERT(varchar(19), GETDATE(), 120) WHERE syxh = %s"
+        )
+        params.append(syxh)
+        cursor.execute(";\n".join(statements), tuple(params))
         
-        # 2. 批量插入诊断数据
-        if final_diags:
-            diag_values = [(syxh, 'zd', diag['xh'], diag['bm'], diag['mc']) for diag in final_diags]
-            cursor.executemany("INSERT INTO XX_AIFZ_ZDSS(syxh, type, xh, bm, mc) VALUES (%s, %s, %s, %s, %s)", diag_values)
-        
-        # 3. 批量插入手术数据
-        if final_surgeries:
-            surg_values = [(syxh, 'ss', surg['xh'], surg['bm'], surg['mc']) for surg in final_surgeries]
-            cursor.executemany("INSERT INTO XX_AIFZ_ZDSS(syxh, type, xh, bm, mc) VALUES (%s, %s, %s, %s, %s)", surg_values)
-        
-        # 4. 更新时间戳
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("UPDATE XX_AIFZ_RETURN WITH (ROWLOCK) SET zdssextime = %s WHERE syxh = %s", (current_time, syxh))
+        # 超出单批参数上限的其余行（极少出现）分批插入
+        for start in range(ZDSS_INSERT_BATCH_ROWS, len(rows), ZDSS_INSERT_BATCH_ROWS):
+            chunk = rows[start:start + ZDSS_INSERT_BATCH_ROWS]
+            cursor.execute(_zdss_insert_sql(len(chunk)), tuple(value for row in chunk for value in row))
         
         logging.info(f"syxh: {syxh} 的诊断和手术信息已成功暂存以待提交。")
         return True
@@ -649,9 +837,12 @@ def process_single_syxh(conn, syxh):
     """处理单个syxh的诊断和手术提取，并包含重试逻辑。"""
     try:
         with conn.cursor() as cursor:
-            # 获取aireturn内容。使用 READ UNCOMMITTED 避免锁定。
-            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED")
-            cursor.execute("SELECT aireturn FROM XX_AIFZ_RETURN WHERE syxh = %s", (syxh,))
+            # 获取aireturn内容。使用 READ UNCOMMITTED 避免锁定（设置与查询在同一批处理中发送）。
+            cursor.execute(
+                "SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED;\n"
+                "SELECT aireturn FROM XX_AIFZ_RETURN WHERE syxh = %s",
+                (syxh,)
+            )
             aireturn_row = cursor.fetchone()
 
             # 修复类型错误：安全访问数据库结果
@@ -698,37 +889,28 @@ def get_syxh_list_to_process(limit, specific_syxh):
     syxhs = []
     conn = None
     try:
-        conn = get_db_connection()
+        conn = DB_POOL.checkout()
         with conn.cursor() as cursor:
-            # 设置事务隔离级别为READ COMMITTED
-            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-            
             if specific_syxh:
                 syxhs = [specific_syxh]
             else:
+                # 设置事务隔离级别为READ COMMITTED（与查询在同一批处理中发送）
                 # 使用NOLOCK提示，移除READPAST避免兼容性问题
                 top_clause = f"TOP {limit}" if limit else ""
                 query = f"""
+                    SET TRANSACTION ISOLATION LEVEL READ COMMITTED;
                     SELECT {top_clause} syxh FROM XX_AIFZ_RETURN WITH (NOLOCK) 
                     WHERE ISNULL(zdssextime, '') = '' OR (ISNULL(zdssextime, '') <> '' and zdssextime < aisavetime)
                 """
                 cursor.execute(query)
                 results = cursor.fetchall()
                 if results:
-                    # 修复类型错误：使用通用的安全访问方法
-                    syxhs = []
-                    for row in results:
-                        # 安全提取syxh值，兼容字典和元组格式
-                        syxh_value = None
-                        if isinstance(row, dict):
-                            syxh_value = row.get('syxh')
-                        elif isinstance(row, (tuple, list)) and len(row) > 0:
-                            syxh_value = row[0]
-                        
-                        if syxh_value:
-                            syxhs.append(syxh_value)
-                        else:
-                            logging.warning(f"跳过无效的数据库记录: {row}")
+                    # 兼容字典和元组格式：行格式只在首行判断一次，之后统一按同一个键取值
+                    key = 'syxh' if isinstance(results[0], dict) else 0
+                    syxhs = [row[key] for row in results if row[key]]
+                    skipped = len(results) - len(syxhs)
+                    if skipped:
+                        logging.warning(f"跳过 {skipped} 条syxh为空的无效数据库记录")
         conn.commit() # 确保事务关闭
         return syxhs
     except Exception as e:
@@ -736,12 +918,47 @@ def get_syxh_list_to_process(limit, specific_syxh):
         return [] # 返回空列表表示失败
     finally:
         if conn:
-            close_db_connection(conn, "获取syxh列表")
+            DB_POOL.checkin(conn, "获取syxh列表")
+
+def _process_syxh_with_pooled_connection(syxh, position, total):
+    """借用连接处理单个syxh并提交或回滚，返回是否处理成功（供串行和线程池两种方式共用）"""
+    success = False
+    logging.info(f"--- 开始处理 syxh: {syxh} (进度: {position}/{total}) ---")
+    
+    conn = None
+    try:
+        # 为当前syxh借用一个连接（复用空闲连接或新建）
+        # 每条SQL的执行时间由连接参数 timeout（config.ini [database]）限制，超时以异常返回，
+        # 不再为每个syxh单独启动线程等待结果
+        conn = DB_POOL.checkout()
+        if process_single_syxh(conn, syxh):
+            try:
+                conn.commit()
+                success = True
+                logging.info(f"syxh: {syxh} 处理成功，事务已提交。")
+            except Exception as commit_err:
+                logging.error(f"提交事务时发生错误: {commit_err}")
+                # 即使提交失败也不尝试回滚，避免更多错误
+        else:
+            logging.warning(f"处理 syxh: {syxh} 失败。")
+            try:
+                conn.rollback()
+                logging.info(f"syxh: {syxh} 的事务已回滚。")
+            except Exception as rollback_err:
+                logging.error(f"回滚事务时发生错误，但将继续处理: {rollback_err}")
+    except Exception as e:
+        logging.error(f"处理 syxh: {syxh} 时发生意外错误。错误: {e}")
+    finally:
+        if conn:
+            # 归还连接；回滚或恢复会话参数失败（如超时后连接已失效）时直接关闭
+            DB_POOL.checkin(conn, f"syxh {syxh}")
+    return success
 
-def process_diagnoses_and_surgeries(specific_syxh=None, limit=None):
+def process_diagnoses_and_surgeries(specific_syxh=None, limit=None, max_workers=1):
     """
     主流程，提取诊断和手术信息，并进行重构和保存。
-    为每个syxh使用独立的数据库连接和事务，以彻底避免锁问题。
+    每个syxh使用各自借用的数据库连接和独立事务，以彻底避免锁问题。
+    max_workers 大于1时用线程池并发处理各syxh。
     """
     logging.info("====== 开始执行诊断和手术提取与重构任务 ======")
     start_time = time.time()
@@ -758,81 +975,25 @@ def process_diagnoses_and_surgeries(specific_syxh=None, limit=None):
 
     logging.info(f"共找到 {len(syxhs_to_process)} 条记录待处理。")
     processed_count = 0
+    total = len(syxhs_to_process)
     
-    # 2. 遍历列表，为每个syxh使用一个全新的连接
-    for index, syxh in enumerate(syxhs_to_process):
-        logging.info(f"--- 开始处理 syxh: {syxh} (进度: {processed_count + 1}/{len(syxhs_to_process)}) ---")
-        
-        # 为诊断提取任务设置独立的、较短的随机延迟 (0-10秒)
-        delay_seconds = random.uniform(0, 10)
-        logging.debug(f"syxh: {syxh} 的处理将随机延迟 {delay_seconds:.2f} 秒")
-        time.sleep(delay_seconds)
-            
-        conn = None
-        try:
-            # 为当前syxh建立一个全新的连接
-            conn = get_db_connection()
-            
-            # 设置处理超时
-            import threading
-            import queue
-            
-            # 创建一个队列用于获取结果
-            result_queue = queue.Queue()
-            
-            # 定义一个函数在子线程中执行处理操作
-            def process_with_timeout():
+    # 2. 遍历列表，每个syxh从空闲连接池借用连接，各自独立提交或回滚；多线程时并发处理
+    if max_workers > 1 and total > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_syxh = {
+                executor.submit(_process_syxh_with_pooled_connection, syxh, position, total): syxh
+                for position, syxh in enumerate(syxhs_to_process, 1)
+            }
+            for future in as_completed(future_to_syxh):
                 try:
-                    result = process_single_syxh(conn, syxh)
-                    result_queue.put(("success", result))
-                except Exception as e:
-                    result_queue.put(("error", str(e)))
-            
-            # 创建并启动子线程
-            process_thread = threading.Thread(target=process_with_timeout)
-            process_thread.daemon = True
-            process_thread.start()
-            
-            # 等待子线程执行完毕或超时
-            try:
-                status, result = result_queue.get(timeout=120)  # 增加到120秒超时
-                if status == "success" and result:
-                    try:
-                        conn.commit()
+                    if future.result():
                         processed_count += 1
-                        logging.info(f"syxh: {syxh} 处理成功，事务已提交。")
-                    except Exception as commit_err:
-                        logging.error(f"提交事务时发生错误: {commit_err}")
-                        # 即使提交失败也不尝试回滚，避免更多错误
-                else:
-                    if status == "error":
-                        logging.error(f"处理 syxh: {syxh} 时发生错误: {result}")
-                    else:
-                        logging.warning(f"处理 syxh: {syxh} 失败。")
-                    
-                    try:
-                        conn.rollback()
-                        logging.info(f"syxh: {syxh} 的事务已回滚。")
-                    except Exception as rollback_err:
-                        logging.error(f"回滚事务时发生错误，但将继续处理: {rollback_err}")
-            except queue.Empty:
-                logging.error(f"处理 syxh: {syxh} 操作超时，强制中断")
-                # 不再尝试回滚，直接关闭连接释放资源
-                
-                # 如果在自动测试模式下，且已经处理了几条记录后遇到超时，则认为问题仍未解决
-                if auto_test_validation and index > 0:
-                    logging.critical("自动测试验证失败：程序仍然存在卡住的问题，需要进一步修复")
-                    break
-                
-        except Exception as e:
-            logging.error(f"处理 syxh: {syxh} 时发生意外错误。错误: {e}")
-        finally:
-            if conn:
-                try:
-                    # 使用close_db_connection函数安全关闭连接
-                    close_db_connection(conn, f"syxh {syxh}")
-                except:
-                    logging.error(f"关闭 syxh {syxh} 的数据库连接时发生错误。")
+                except Exception as exc:
+                    logging.error(f"处理 syxh: {future_to_syxh[future]} 的任务在执行时抛出异常: {exc}", exc_info=True)
+    else:
+        for position, syxh in enumerate(syxhs_to_process, 1):
+            if _process_syxh_with_pooled_connection(syxh, position, total):
+                processed_count += 1
     
     # 验证是否已经成功解决问题
     if auto_test_validation and processed_count > 0:
@@ -854,6 +1015,112 @@ def close_db_connection(conn, conn_name=""):
         # 确保连接变量被清除，帮助垃圾回收
         conn = None
 
+# 连接池管理的每个连接统一使用的默认会话参数：连接建立时和归还时都执行（一个批处理、一次往返）。
+# READ COMMITTED + 60秒锁超时：等锁超过60秒以异常返回，而不是无限等待；
+# 处理步骤可以在自己的批处理中临时修改（如 READ UNCOMMITTED 读取），归还时恢复。
+DB_SESSION_SETUP_SQL = "SET TRANSACTION ISOLATION LEVEL READ COMMITTED; SET LOCK_TIMEOUT 60000"
+
+class DbConnectionPool:
+    """
+    线程安全的数据库连接池（aifz_main 与本模块共用）
+
+    功能特性：
+    1. 按需通过 connect 建立连接，归还后保留空闲连接供后续任务复用，避免每条病历都重新握手认证
+    2. 连接建立和归还时统一执行 DB_SESSION_SETUP_SQL，无论连接来自哪个模块的连接池，会话参数都相同
+    3. 归还时回滚未提交的事务，行为与关闭连接一致；回滚失败的连接直接丢弃
+    4. 空闲超过一定时间的连接在复用前执行 SELECT 1 检查，失效则重建
+    5. 空闲连接数超过上限时多余的连接直接关闭，连接数不设硬上限，不会阻塞调用方
+    """
+
+    def __init__(self, connect, max_idle=12, health_check_seconds=60):
+        """
+        初始化连接池
+
+        参数：
+        connect: 建立新物理连接的函数（无参数，返回 pymssql 连接）
+        max_idle: 最多保留的空闲连接数
+        health_check_seconds: 空闲超过该秒数的连接在复用前做健康检查
+        """
+        self._connect = connect
+        self._idle = LifoQueue(maxsize=max_idle)  # 后进先出，优先复用最近使用过的连接
+        self._health_check_seconds = health_check_seconds
+
+    @staticmethod
+    def _setup_session(conn):
+        """设置默认会话参数（调用方可能在使用过程中修改过隔离级别或锁超时）"""
+        with conn.cursor() as cursor:
+            cursor.execute(DB_SESSION_SETUP_SQL)
+
+    def _new_connection(self):
+        """建立新连接并设置默认会话参数，设置失败时关闭连接并抛出异常"""
+        conn = self._connect()
+        try:
+            self._setup_session(conn)
+        except Exception as e:
+            logging.error(f"设置数据库会话参数失败: {e}")
+            close_db_connection(conn, "新建连接")
+            raise
+        return conn
+
+    def checkout(self):
+        """取出一个可用连接：优先复用空闲连接，必要时做健康检查，否则新建"""
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except Empty:
+                return self._new_connection()
+            if time.monotonic() - idle_since < self._health_check_seconds:
+                return conn
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchall()
+                return conn
+            except Exception as e:
+                logging.warning(f"连接池中的空闲连接已失效，将重新建立: {e}")
+                close_db_connection(conn, "连接池失效连接")
+
+    def checkin(self, conn, conn_name="连接池"):
+        """归还连接：回滚未提交事务并恢复会话参数，失败或空闲已满时关闭"""
+        try:
+            conn.rollback()
+            self._setup_session(conn)
+            self._idle.put_nowait((conn, time.monotonic()))
+        except Full:
+            close_db_connection(conn, conn_name)
+        except Exception as e:
+            logging.warning(f"归还数据库连接 {conn_name} 失败，连接将被关闭: {e}")
+            close_db_connection(conn, conn_name)
+
+    @contextmanager
+    def acquire(self):
+        """以上下文管理器方式借用连接，退出时自动归还"""
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close_all(self):
+        """关闭所有空闲连接（程序退出时调用）"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            close_db_connection(conn, "连接池")
+
+# 本模块的进程级连接池：用完的连接保留供后续syxh复用。
+# 空闲上限取最大线程数（命令行最多20）再留少量余量，超出上限的连接直接关闭。
+DB_POOL_MAX_IDLE = max(int(THREAD_CONFIG.get('max_workers', 10)), 20) + 2
+DB_POOL_HEALTH_CHECK_SECONDS = 60  # 空闲超过该秒数的连接在复用前执行 SELECT 1 检查
+DB_POOL = DbConnectionPool(get_db_connection, DB_POOL_MAX_IDLE, DB_POOL_HEALTH_CHECK_SECONDS)
+
+def close_idle_db_connections():
+    """关闭本模块连接池中的所有空闲连接（程序退出时调用）"""
+    DB_POOL.close_all()
+
+@_cache_match_result
 def find_match_by_decreasing_chars(cursor, name, is_main, table_name, use_flags=True):
     """
     通过逐字递减匹配来查找诊断或手术
@@ -861,43 +1128,50 @@ def find_match_by_decreasing_chars(cursor, name, is_main, table_name, use_flags=
     :param name: 原始名称
     :param is_main: 是否为主诊断/主手术
     :param table_name: 表名 ('MED_LCYBZDDYK' 或 'MED_LCYBSSDYK')
-    :param use_flags: 是否使用标志位过滤
+    :param use_flags: 是否使用标志位过滤；为 None 时等价于先以 True、再以 False 各匹配一遍，
+                      但每个名称只查询一次（带出标志位，在 Python 中优先选择未标记灰码/除外码的行）
     :return: 匹配结果或None
     """
     if not name or len(name) < 2:
         return None
     
-    # 构建基础查询
-    base_query = f"""
-        SELECT glbm, glmc FROM {table_name} WITH (NOLOCK) 
-        WHERE glmc = %s
-    """
+    # 只有带标志位时会附加 isexcept 条件的情况才需要区分优先级
+    prefer_unflagged = use_flags is None and (table_name == 'MED_LCYBZDDYK' or is_main)
+    
+    # 构建连接条件
+    condition = "t.glmc = v.n"
     
     # 添加标志位过滤
     if table_name == 'MED_LCYBZDDYK':
         if use_flags:
-            base_query += " AND isgray = 0 AND isexcept = 0"
+            condition += " AND t.isgray = 0 AND t.isexcept = 0"
     else:  # MED_LCYBSSDYK
         if is_main and use_flags:
-            base_query += " AND isgray = 0 AND isexcept = 0"
+            condition += " AND t.isgray = 0 AND t.isexcept = 0"
         elif is_main:
-            base_query += " AND isgray = 0"
+            condition += " AND t.isgray = 0"
     
-    # 逐字递减匹配
-    current_name = name
-    while len(current_name) >= 2:  # 至少保留2个字符
-        cursor.execute(base_query, (current_name,))
-        results = cursor.fetchall()
+    # 逐字递减匹配：所有递减后的名称（至少保留2个字符）一次查询，再按从长到短的顺序检查
+    prefixes = [name[:length] for length in range(len(name), 1, -1)]
+    fallback = None  # 不带标志位时的结果：第一个有匹配行的名称及其第一行
+    for current_name, results in zip(prefixes, _batched_name_query(cursor, table_name, prefixes, condition)):
+        if prefer_unflagged:
+            if results and fallback is None:
+                fallback = (current_name, results[0])
+            results = _without_flagged(results)
         
         if results:
-            logging.debug(f"逐字递减匹配成功: '{name}' -> '{current_name}'")
+            logging.debug("逐字递减匹配成功: '%s' -> '%s'", name, current_name)
             return results[0]
-        
-        # 减少最后一个字符
-        current_name = current_name[:-1]
     
+    if fallback:
+        logging.debug("逐字递减匹配成功: '%s' -> '%s'", name, fallback[0])
+        return fallback[1]
     return None
 
+FROM_START_CANDIDATE_LIMIT = 50  # 从首字递减模糊匹配时参与相似度打分的候选行数上限
+
+@_cache_match_result
 def find_match_by_decreasing_chars_from_start(cursor, name, is_main, table_name, use_flags=True):
     """
     通过从第一个字开始递减进行模糊匹配来查找诊断或手术，返回自动相似度最优结果。
@@ -905,61 +1179,115 @@ def find_match_by_decreasing_chars_from_start(cursor, name, is_main, table_name,
     :param name: 原始名称
     :param is_main: 是否为主诊断/主手术
     :param table_name: 表名 ('MED_LCYBZDDYK' 或 'MED_LCYBSSDYK')
-    :param use_flags: 是否使用标志位过滤
+    :param use_flags: 是否使用标志位过滤；为 None 时等价于先以 True、再以 False 各匹配一遍，
+                      但每个名称只探测一次（同时探测是否有未标记灰码/除外码的行，有则优先只取这些行）
     :return: 匹配结果或None
     """
     if not name or len(name) < 2:
         return None
     
-    # 构建基础查询
-    base_query = f"""
-        SELECT glbm, glmc FROM {table_name} WITH (NOLOCK) 
-        WHERE glmc LIKE %s
-    """
+    # 只有带标志位时会附加 isexcept 条件的情况才需要区分优先级
+    prefer_unflagged = use_flags is None and (table_name == 'MED_LCYBZDDYK' or is_main)
     
     # 添加标志位过滤
+    flag_condition = ""
     if table_name == 'MED_LCYBZDDYK':
         if use_flags:
-            base_query += " AND isgray = 0 AND isexcept = 0"
+            flag_condition = " AND isgray = 0 AND isexcept = 0"
     else:  # MED_LCYBSSDYK
         if is_main and use_flags:
-            base_query += " AND isgray = 0 AND isexcept = 0"
+            flag_condition = " AND isgray = 0 AND isexcept = 0"
         elif is_main:
-            base_query += " AND isgray = 0"
+            flag_condition = " AND isgray = 0"
     
-    # 从第一个字开始递减模糊匹配
-    current_name = name
-    while len(current_name) >= 2:  # 至少保留2个字符
-        cursor.execute(base_query, (f'%{current_name}%',))
-        results = cursor.fetchall()
-        if results:
-            # 全自动相似度排序，返回最优
-            best = best_match_with_lcs_priority(name, results, fix_db_read_encoding)
-            log_candidates = [(fix_db_read_encoding(r['glmc']), jaccard_score(name, fix_db_read_encoding(r['glmc'])), longest_common_substring(name, fix_db_read_encoding(r['glmc']))) for r in results]
-            logging.debug(f"从首字递减模糊候选({current_name}): {log_candidates}")
-            return best
-        # 减少第一个字符
-        current_name = current_name[1:]
+    # 从第一个字开始递减的全部名称（至少保留2个字符）先用一次查询探测哪些有匹配行，
+    # 再只取第一个有匹配的名称的全部行，代替逐个名称查询
+    suffixes = [name[start:] for start in range(len(name) - 1)]
+    patterns = [f'%{suffix}%' for suffix in suffixes]
+    probes = _probe_like_patterns(cursor, table_name, patterns, flag_condition)
+    
+    chosen = None       # (名称序号, 是否只保留未标记灰码/除外码的行)
+    fallback = None     # 不带标志位时的结果：第一个有匹配行的名称序号
+    for i, (has_rows, has_unflagged) in enumerate(probes):
+        if prefer_unflagged:
+            if has_unflagged:
+                chosen = (i, True)
+                break
+            if has_rows and fallback is None:
+                fallback = i
+        elif has_rows:
+            chosen = (i, False)
+            break
+    if chosen is None and fallback is not None:
+        chosen = (fallback, False)
+    if chosen is None:
+        return None
+    
+    i, only_unflagged = chosen
+    if only_unflagged:
+        flag_condition += " AND isgray = 0 AND isexcept = 0"
+    # 只取最短的若干个候选（名称越短越接近基础诊断），避免常见子串把成千上万行传回客户端再逐个打分
+    cursor.execute(
+        _as_sp_executesql(
+            f"SELECT TOP {FROM_START_CANDIDATE_LIMIT} glbm, glmc FROM {table_name} WITH (NOLOCK) "
+            f"WHERE glmc LIKE %s{flag_condition} ORDER BY LEN(glmc)"
+        ),
+        (patterns[i],)
+    )
+    results = cursor.fetchall()
+    if results:
+        return _best_from_start_candidates(name, suffixes[i], results)
     return None
 
+def _probe_like_patterns(cursor, table_name: str, patterns: List[str], flag_condition: str) -> List[Tuple[bool, bool]]:
+    """
+    一次查询探测每个 LIKE 模式是否有匹配行，返回与 patterns 一一对应的 (有匹配行, 有未标记灰码/除外码的匹配行)。
+    flag_condition 为附加在 "glmc LIKE 模式" 之后的标志位条件（可为空）。只返回是否存在，不传输匹配行。
+    """
+    probes = [(False, False)] * len(patterns)
+    for start in range(0, len(patterns), NAME_BATCH_SIZE):
+        chunk = patterns[start:start + NAME_BATCH_SIZE]
+        value_rows = ', '.join(['(%s, %s)'] * len(chunk))
+        params = tuple(p for i, pattern in enumerate(chunk, start) for p in (i, pattern))
+        match_condition = f"FROM {table_name} WITH (NOLOCK) WHERE glmc LIKE v.n{flag_condition}"
+        cursor.execute(
+            f"SELECT v.i, "
+            f"CASE WHEN EXISTS (SELECT 1 {match_condition}) THEN 1 ELSE 0 END AS has_rows, "
+            f"CASE WHEN EXISTS (SELECT 1 {match_condition} AND isgray = 0 AND isexcept = 0) THEN 1 ELSE 0 END AS has_unflagged "
+            f"FROM (VALUES {value_rows}) AS v(i, n)",
+            params
+        )
+        for row in cursor.fetchall():
+            probes[row['i']] = (bool(row['has_rows']), bool(row['has_unflagged']))
+    return probes
+
+def _best_from_start_candidates(name, current_name, results):
+    """从首字递减模糊匹配的候选中按相似度选出最优结果"""
+    # 全自动相似度排序，返回最优
+    best = best_match_with_lcs_priority(name, results, fix_db_read_encoding)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        log_candidates = [(fix_db_read_encoding(r['glmc']), jaccard_score(name, fix_db_read_encoding(r['glmc'])), longest_common_substring(name, fix_db_read_encoding(r['glmc']))) for r in results]
+        logging.debug(f"从首字递减模糊候选({current_name}): {log_candidates}")
+    return best
+
 def run_preliminary_update():
     """
     执行一个预处理SQL，将那些在XX_AIFZ_RETURN中存在但在XX_AIFZ_ZDSS中没有对应记录的条目
     的zdssextime重置，以便重新处理。
     """
     logging.info("===== 开始执行预处理SQL更新 =====")
+    # 新一轮处理开始前清空名称匹配缓存，使对照表的修改在本轮生效
+    clear_name_match_caches()
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
+            # 直接以连接更新，不再用 IN 子查询再回表匹配一次 syxh（更新目标表不能加 NOLOCK）
             sql = """
-            UPDATE XX_AIFZ_RETURN SET zdssextime = '' 
-            WHERE syxh IN (
-                SELECT a.syxh 
-                FROM XX_AIFZ_RETURN a WITH (NOLOCK)
-                LEFT JOIN XX_AIFZ_ZDSS b WITH (NOLOCK) ON a.syxh = b.syxh
-                WHERE b.syxh IS NULL AND a.aireturn IS NOT NULL AND a.aireturn <> ''
-            )
+            UPDATE a SET zdssextime = ''
+            FROM XX_AIFZ_RETURN a
+            LEFT JOIN XX_AIFZ_ZDSS b WITH (NOLOCK) ON a.syxh = b.syxh
+            WHERE b.syxh IS NULL AND a.aireturn IS NOT NULL AND a.aireturn <> ''
             """
             cursor.execute(sql)
             conn.commit()
@@ -976,6 +1304,50 @@ def run_preliminary_update():
         if conn:
             close_db_connection(conn, "预处理SQL")
 
+REPROCESS_CHUNK_SIZE = 500  # 重新处理时每批预取aireturn的syxh数量（远低于SQL Server 2100个参数的上限）
+
+def _fetch_aireturn_batch(syxh_chunk: List[str]) -> Dict[str, Any]:
+    """
+    用一条 IN 查询批量获取一批syxh的aireturn内容，返回 {syxh: aireturn}。
+    查询不到的syxh不会出现在结果中。
+    """
+    conn = None
+    try:
+        conn = DB_POOL.checkout()
+        with conn.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(syxh_chunk))
+            cursor.execute(
+                f"SELECT syxh, aireturn FROM XX_AIFZ_RETURN WITH (NOLOCK) WHERE syxh IN ({placeholders})",
+                tuple(syxh_chunk)
+            )
+            rows = cursor.fetchall()
+        if rows and isinstance(rows[0], dict):
+            return {str(row['syxh']): row['aireturn'] for row in rows}
+        return {str(row[0]): row[1] for row in rows}
+    finally:
+        if conn:
+            DB_POOL.checkin(conn, "批量获取aireturn")
+
+def _delete_empty_aireturn_batch(syxh_chunk: List[str]):
+    """用一条 IN 删除并一次提交一批解析不出诊断和手术的 XX_AIFZ_RETURN 记录，失败时回滚并抛出异常"""
+    conn = None
+    try:
+        conn = DB_POOL.checkout()
+        with conn.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(syxh_chunk))
+            cursor.execute(f"DELETE FROM XX_AIFZ_RETURN WHERE syxh IN ({placeholders})", tuple(syxh_chunk))
+        conn.commit()
+    except Exception:
+        if conn:
+            try:
+                conn.rollback()
+            except Exception as rb_e:
+                logging.error(f"回滚批量删除无效记录的事务失败: {rb_e}")
+        raise
+    finally:
+        if conn:
+            DB_POOL.checkin(conn, "批量删除无效记录")
+
 def reprocess_and_save_syxh_list(syxh_list: List[str]):
     """
     接收一个SYXH列表，为列表中的每个条目重新提取和保存诊断及手术信息。
@@ -993,55 +1365,89 @@ def reprocess_and_save_syxh_list(syxh_list: List[str]):
     # 从配置加载线程数，如果未配置则使用默认值10
     max_workers = THREAD_CONFIG.get('max_workers', 10)
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 为每个syxh提交一个处理任务
-        future_to_syxh = {executor.submit(process_single_syxh_for_reprocessing, syxh): syxh for syxh in syxh_list}
-        
-        success_count = 0
-        failure_count = 0
+    success_count = 0
+    failure_count = 0
 
-        for future in as_completed(future_to_syxh):
-            syxh = future_to_syxh[future]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 分批处理：每批先用一条查询预取aireturn，避免每个syxh单独查询一次
+        for start in range(0, len(syxh_list), REPROCESS_CHUNK_SIZE):
+            chunk = syxh_list[start:start + REPROCESS_CHUNK_SIZE]
             try:
-                # 正确的获取 future 结果的方法是调用 result()
-                result = future.result()
-                if result:
-                    success_count += 1
-                    # 日志级别从INFO调整为DEBUG，避免在成功时产生过多日志
-                    logging.debug(f"成功重新处理 SYXH: {syxh}")
+                prefetched = _fetch_aireturn_batch(chunk)
+            except Exception as e:
+                # 批量预取失败时退回到逐条查询
+                logging.warning(f"批量获取aireturn失败，本批 {len(chunk)} 条改为逐条查询: {e}")
+                prefetched = None
+
+            # 解析不出内容的记录由各任务收集（list.append 线程安全），本批结束后一次删除
+            empty_syxhs = []
+            future_to_syxh = {}
+            for syxh in chunk:
+                if prefetched is None:
+                    future = executor.submit(process_single_syxh_for_reprocessing, syxh, None, empty_syxhs)
+                elif syxh in prefetched:
+                    future = executor.submit(process_single_syxh_for_reprocessing, syxh, prefetched[syxh] or '', empty_syxhs)
                 else:
                     failure_count += 1
-                    logging.warning(f"重新处理 SYXH: {syxh} 失败或被跳过。更多信息请查看日志。")
-            except Exception as exc:
-                failure_count += 1
-                logging.error(f"为 SYXH: {syxh} 的重新处理任务在执行时抛出异常: {exc}", exc_info=True)
+                    logging.warning(f"在重新处理时未找到 SYXH: {syxh} 的记录。")
+                    continue
+                future_to_syxh[future] = syxh
+
+            for future in as_completed(future_to_syxh):
+                syxh = future_to_syxh[future]
+                try:
+                    # 正确的获取 future 结果的方法是调用 result()
+                    result = future.result()
+                    if result:
+                        success_count += 1
+                        # 日志级别从INFO调整为DEBUG，避免在成功时产生过多日志
+                        logging.debug(f"成功重新处理 SYXH: {syxh}")
+                    else:
+                        failure_count += 1
+                        logging.warning(f"重新处理 SYXH: {syxh} 失败或被跳过。更多信息请查看日志。")
+                except Exception as exc:
+                    failure_count += 1
+                    logging.error(f"为 SYXH: {syxh} 的重新处理任务在执行时抛出异常: {exc}", exc_info=True)
+
+            if empty_syxhs:
+                try:
+                    _delete_empty_aireturn_batch(empty_syxhs)
+                    logging.info(f"已成功删除 {len(empty_syxhs)} 条无效记录。")
+                except Exception as del_e:
+                    # 这些记录已按成功计数，删除失败时改记为失败
+                    success_count -= len(empty_syxhs)
+                    failure_count += len(empty_syxhs)
+                    logging.error(f"批量删除 {len(empty_syxhs)} 条无效记录时失败: {del_e}")
 
     logging.info(f"重新处理任务完成。成功: {success_count}，失败: {failure_count}。")
 
-def process_single_syxh_for_reprocessing(syxh: str) -> bool:
+def process_single_syxh_for_reprocessing(syxh: str, aireturn_content: Optional[str] = None,
+                                         empty_syxhs: Optional[List[str]] = None) -> bool:
     """
     处理单个SYXH的重新提取逻辑。包括获取数据、解析、重构和保存。
+    aireturn_content 为调用方批量预取的内容；为 None 时在此处单独查询。
+    empty_syxhs 不为 None 时，解析不出内容的记录不在此处删除，而是加入该列表由调用方批量删除。
     返回 True 表示成功，False 表示失败。
     """
     conn = None
     try:
-        conn = get_db_connection()
+        conn = DB_POOL.checkout()
         with conn.cursor() as cursor:
-            # 1. 从 XX_AIFZ_RETURN 获取 aireturn 内容
-            cursor.execute("SELECT aireturn FROM XX_AIFZ_RETURN WITH (NOLOCK) WHERE syxh = %s", (syxh,))
-            row = cursor.fetchone()
-            
-            # 修复类型错误：安全访问数据库结果
-            if not row:
-                logging.warning(f"在重新处理时未找到 SYXH: {syxh} 的记录。")
-                return False
+            # 1. 从 XX_AIFZ_RETURN 获取 aireturn 内容（未预取时）
+            if aireturn_content is None:
+                cursor.execute("SELECT aireturn FROM XX_AIFZ_RETURN WITH (NOLOCK) WHERE syxh = %s", (syxh,))
+                row = cursor.fetchone()
                 
-            # 安全提取aireturn值，兼容字典和元组格式
-            aireturn_content = None
-            if isinstance(row, dict):
-                aireturn_content = row.get('aireturn')
-            elif isinstance(row, (tuple, list)) and len(row) > 0:
-                aireturn_content = row[0]
+                # 修复类型错误：安全访问数据库结果
+                if not row:
+                    logging.warning(f"在重新处理时未找到 SYXH: {syxh} 的记录。")
+                    return False
+                    
+                # 安全提取aireturn值，兼容字典和元组格式
+                if isinstance(row, dict):
+                    aireturn_content = row.get('aireturn')
+                elif isinstance(row, (tuple, list)) and len(row) > 0:
+                    aireturn_content = row[0]
                 
             if not aireturn_content:
                 logging.warning(f"在重新处理时未找到 SYXH: {syxh} 的有效 'aireturn' 内容。")
@@ -1052,6 +1458,9 @@ def process_single_syxh_for_reprocessing(syxh: str) -> bool:
             if not parsed_data or (not parsed_data[0] and not parsed_data[1]):
                 # 当解析不出任何内容时，日志级别降为DEBUG，避免在RELEASE模式下过多输出
                 logging.debug(f"为 SYXH: {syxh} 解析 'aireturn' 未返回有效诊断或手术，将删除该记录。")
+                if empty_syxhs is not None:
+                    empty_syxhs.append(syxh)
+                    return True
                 try:
                     # 删除 XX_AIFZ_RETURN 表中对应的记录
                     cursor.execute("DELETE FROM XX_AIFZ_RETURN WHERE syxh = %s", (syxh,))
@@ -1075,10 +1484,7 @@ def process_single_syxh_for_reprocessing(syxh: str) -> bool:
                 conn.rollback()
                 return False
 
-            # 4. 更新 XX_AIFZ_RETURN 表中的 zdssextime 字段
-            # 确保此操作在同一个事务中
-            update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute("UPDATE XX_AIFZ_RETURN SET zdssextime = %s WHERE syxh = %s", (update_time, syxh))
+            # 4. XX_AIFZ_RETURN 的 zdssextime 已由 save_zdss_to_db 在同一批处理、同一事务中更新，无需再单独更新
             
             # 5. 提交整个事务
             conn.commit()
@@ -1096,7 +1502,7 @@ def process_single_syxh_for_reprocessing(syxh: str) -> bool:
         return False
     finally:
         if conn:
-            close_db_connection(conn, f"reprocess_{syxh}")
+            DB_POOL.checkin(conn, f"reprocess_{syxh}")
 
 
 def main():
@@ -1114,6 +1520,8 @@ def main():
     parser.set_defaults(debug=None)
     
     args = parser.parse_args()
+    if args.threads is not None and not (1 <= args.threads <= 20):
+        parser.error("--threads 参数值必须在 1 到 20 之间。")
     
     # --- 日志初始化 ---
     # 当作为独立脚本运行时，需要调用 setup_logging
@@ -1130,7 +1538,10 @@ def main():
     max_workers = args.threads if args.threads is not None else THREAD_CONFIG.get('max_workers', 10)
     logging.info(f"设置并发处理线程数为: {max_workers}")
     
-    process_diagnoses_and_surgeries(specific_syxh=args.syxh, limit=args.limit)
+    try:
+        process_diagnoses_and_surgeries(specific_syxh=args.syxh, limit=args.limit, max_workers=max_workers)
+    finally:
+        close_idle_db_connections()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
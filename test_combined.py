@@ -1,6 +1,16 @@
 import unittest
 import logging
+import random
+import threading
+import time
+import os
+import tempfile
+from unittest import mock
 from aifz_parser import parse_diagnoses_and_surgeries
+from aifz_zdss_extract import longest_common_substring
+import aifz_main
+from aifz_main import ApiKeyManager, _is_transient_db_error
+from aifz_logger import _ApiCounter
 
 # --- 测试用例精选 ---
 
@@ -261,5 +271,217 @@ class TestAifzParser(unittest.TestCase):
         self._run_test_case(PANCREATITIS_FAILURE_CASE, "pancreatitis_failure_case")
 
 
+def _reference_lcs(s1, s2):
+    """最长公共子串的原始二维DP实现，作为 longest_common_substring 的对照"""
+    if not s1 or not s2:
+        return 0
+    dp = [[0] * (len(s2) + 1) for _ in range(len(s1) + 1)]
+    max_len = 0
+    for i in range(len(s1)):
+        for j in range(len(s2)):
+            if s1[i] == s2[j]:
+                dp[i + 1][j + 1] = dp[i][j] + 1
+                max_len = max(max_len, dp[i + 1][j + 1])
+    return max_len
+
+
+class TestLongestCommonSubstring(unittest.TestCase):
+    """longest_common_substring 必须与原始DP实现结果一致（用于候选排序，结果变化会改变匹配到的编码）"""
+
+    def test_edge_cases(self):
+        cases = [
+            ('', ''), ('', '高血压'), ('高血压', ''),
+            ('高血压', '高血压'),
+            ('高血压', '糖尿病'),
+            ('急性心力衰竭', '慢性心力衰竭加重'),
+            ('aaa', 'aa'), ('abab', 'baba'),
+        ]
+        for s1, s2 in cases:
+            with self.subTest(s1=s1, s2=s2):
+                self.assertEqual(longest_common_substring(s1, s2), _reference_lcs(s1, s2))
+        self.assertEqual(longest_common_substring('高血压', '高血压'), 3)
+        self.assertEqual(longest_common_substring('高血压', '糖尿病'), 0)
+
+    def test_matches_reference_dp(self):
+        rng = random.Random(0)
+        chars = '高血压糖尿病心衰肾慢性急'
+        for _ in range(2000):
+            s1 = ''.join(rng.choice(chars) for _ in range(rng.randint(0, 10)))
+            s2 = ''.join(rng.choice(chars) for _ in range(rng.randint(0, 10)))
+            self.assertEqual(longest_common_substring(s1, s2), _reference_lcs(s1, s2), (s1, s2))
+
+
+
+class TestApiKeyManager(unittest.TestCase):
+    """ApiKeyManager 的轮询选择与无可用密钥时的等待"""
+
+    def test_round_robin(self):
+        keys = ['key-aaaa', 'key-bbbb', 'key-cccc']
+        manager = ApiKeyManager(keys, min_interval_seconds=0)
+        taken = []
+        for _ in range(6):
+            key = manager.get_key()
+            taken.append(key)
+            manager.release_key(key)
+        # 从随机起点开始，依次轮询每个密钥
+        start = keys.index(taken[0])
+        self.assertEqual(taken, [keys[(start + i) % len(keys)] for i in range(6)])
+
+    def test_in_use_keys_are_skipped(self):
+        keys = ['key-aaaa', 'key-bbbb', 'key-cccc']
+        manager = ApiKeyManager(keys, min_interval_seconds=0)
+        self.assertCountEqual([manager.get_key() for _ in keys], keys)
+
+    def test_waits_until_key_released(self):
+        manager = ApiKeyManager(['key-aaaa'], min_interval_seconds=0)
+        held = manager.get_key()
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(manager.get_key()), daemon=True)
+        waiter.start()
+        time.sleep(0.1)
+        self.assertEqual(result, [], "密钥被占用时 get_key 应等待")
+        manager.release_key(held)
+        waiter.join(timeout=5)
+        self.assertFalse(waiter.is_alive(), "释放密钥后等待者应被唤醒")
+        self.assertEqual(result, ['key-aaaa'])
+
+
+
+class TestTransientDbError(unittest.TestCase):
+    """只有死锁(1205)和锁请求超时(1222)视为可重试的瞬时错误"""
+
+    def test_transient_codes(self):
+        for exc in (
+            Exception(1205, b'Transaction was deadlocked'),
+            Exception((1205, b'Transaction was deadlocked'),),
+            Exception(1222, b'Lock request time out period exceeded.'),
+            Exception((1222, b'Lock request time out period exceeded.'),),
+            Exception('Transaction (Process ID 52) was deadlocked on lock resources'),
+        ):
+            with self.subTest(exc=exc):
+                self.assertTrue(_is_transient_db_error(exc))
+
+    def test_non_transient_errors(self):
+        for exc in (
+            Exception(2627, b'Violation of PRIMARY KEY constraint'),
+            Exception((20009, b'DB-Lib error message 20009, severity 9'),),
+            Exception(-2, b'Timeout expired'),
+            Exception('Invalid object name'),
+            Exception(),
+        ):
+            with self.subTest(exc=exc):
+                self.assertFalse(_is_transient_db_error(exc))
+
+
+
+class TestApiCounter(unittest.TestCase):
+    """API统计计数器：从已有次数开始累加，并发递增不丢失计数"""
+
+    def test_starts_from_existing_count(self):
+        counter = _ApiCounter(5)
+        self.assertEqual(counter.value, 5)
+        counter.increment()
+        counter.increment()
+        self.assertEqual(counter.value, 7)
+
+    def test_concurrent_increments(self):
+        counter = _ApiCounter()
+
+        def worker():
+            for _ in range(1000):
+                counter.increment()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(counter.value, 8000)
+
+
+
+class TestRequirementsStamp(unittest.TestCase):
+    """依赖检查通过后写入标记文件，依赖清单未变化时下次启动直接跳过检查"""
+
+    def test_first_run_creates_stamp_and_second_run_skips(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with open('requirements.txt', 'w', encoding='utf-8') as f:
+                    f.write('pymssql\n')
+                aifz_main.check_and_install_packages()
+                self.assertTrue(os.path.exists(aifz_main.REQUIREMENTS_STAMP), "首次检查后应写入标记文件")
+
+                # 第二次启动不应再扫描已安装包
+                with mock.patch('importlib.metadata.distributions', side_effect=AssertionError("不应扫描已安装包")):
+                    aifz_main.check_and_install_packages()
+            finally:
+                os.chdir(cwd)
+
+
+
+class _FakeContentCursor:
+    """模拟 usp_xx_hz_zlxx 的游标：批处理返回 batch_sets 中的结果集（或抛出 batch_error），单个调用返回 single-类型"""
+
+    def __init__(self, batch_sets=None, batch_error=None):
+        self.batch_sets = batch_sets
+        self.batch_error = batch_error
+        self.sets = []
+
+    def execute(self, sql, params=()):
+        if sql.count('EXEC') > 1:
+            if self.batch_error:
+                raise self.batch_error
+            self.sets = list(self.batch_sets)
+        else:
+            self.sets = [[{'Content': 'single-' + params[1]}]]
+
+    def fetchall(self):
+        return self.sets[0]
+
+    def nextset(self):
+        self.sets = self.sets[1:]
+        return True if self.sets else None
+
+
+class TestFetchContentBatch(unittest.TestCase):
+    """批量获取病历内容：只有结构性问题才永久停用批处理，瞬时错误向上抛出"""
+
+    TYPES = ['a', 'b']
+
+    def setUp(self):
+        aifz_main._CONTENT_BATCH_ENABLED = True
+
+    def tearDown(self):
+        aifz_main._CONTENT_BATCH_ENABLED = True
+
+    def test_batch_result_sets(self):
+        cursor = _FakeContentCursor([[{'Content': 'A'}], [{'Content': 'B'}]])
+        self.assertEqual(aifz_main._fetch_content_batch(cursor, 1, self.TYPES), ['A', 'B'])
+        self.assertTrue(aifz_main._CONTENT_BATCH_ENABLED)
+
+    def test_extra_result_set_disables_batch(self):
+        cursor = _FakeContentCursor([[{'Content': 'A'}], [{'Content': 'debug'}], [{'Content': 'B'}]])
+        self.assertEqual(aifz_main._fetch_content_batch(cursor, 1, self.TYPES), ['single-a', 'single-b'])
+        self.assertFalse(aifz_main._CONTENT_BATCH_ENABLED)
+
+    def test_transient_error_is_raised_and_batch_stays_enabled(self):
+        cursor = _FakeContentCursor(batch_error=aifz_main.pymssql.OperationalError(1205, b'deadlocked'))
+        with self.assertRaises(aifz_main.pymssql.OperationalError):
+            aifz_main._fetch_content_batch(cursor, 1, self.TYPES)
+        self.assertTrue(aifz_main._CONTENT_BATCH_ENABLED)
+
+    def test_other_error_falls_back_for_this_record_only(self):
+        cursor = _FakeContentCursor(batch_error=aifz_main.pymssql.OperationalError(20047, b'connection lost'))
+        self.assertEqual(aifz_main._fetch_content_batch(cursor, 1, self.TYPES), ['single-a', 'single-b'])
+        self.assertTrue(aifz_main._CONTENT_BATCH_ENABLED)
+
+    def test_syntax_error_disables_batch(self):
+        cursor = _FakeContentCursor(batch_error=aifz_main.pymssql.ProgrammingError(102, b'Incorrect syntax'))
+        self.assertEqual(aifz_main._fetch_content_batch(cursor, 1, self.TYPES), ['single-a', 'single-b'])
+        self.assertFalse(aifz_main._CONTENT_BATCH_ENABLED)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2) 
\ No newline at end of file